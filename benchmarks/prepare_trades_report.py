@@ -0,0 +1,119 @@
+"""
+Сравнение prepare_trades_report с прежней построчной (df.apply) реализацией.
+
+    python benchmarks/prepare_trades_report.py --rows 100000
+
+Курсы берутся из памяти, без обращений к cbr.ru; обе реализации должны дать одинаковые значения вплоть до записи Decimal
+(новая реализация хранит суммы как Decimal, валюта - в отдельном столбце currency).
+
+"""
+
+import argparse
+import datetime
+import time
+from decimal import Decimal
+from typing import List
+
+import pandas  # type: ignore
+
+from investments.calculators import compute_total_cost
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.ibtax.ibtax import prepare_trades_report
+from investments.money import Money
+from investments.ticker import Ticker, TickerKind
+from investments.trades_fifo import FinishedTrade
+
+
+class SyntheticRates(RatesProvider):
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        if currency is Currency.RUB:
+            return Money(1, Currency.RUB)
+        day = dt.date() if isinstance(dt, datetime.datetime) else dt
+        return Money(Decimal('60.1234') + Decimal(day.toordinal() % 97) / 8, Currency.RUB)
+
+
+def legacy_prepare_trades_report(finished_trades: List[FinishedTrade], cbr_client_usd: RatesProvider) -> pandas.DataFrame:
+    trade_date_column = 'trade_date'
+    tax_date_column = 'settle_date'
+
+    df = pandas.DataFrame(finished_trades, columns=finished_trades[0].fields)
+
+    df[trade_date_column] = df[trade_date_column].dt.normalize()
+    df['date'] = df[trade_date_column].dt.date
+    df[tax_date_column] = pandas.to_datetime(df[tax_date_column])
+
+    tax_years = df.groupby('N')[tax_date_column].max().map(lambda x: x.year).rename('tax_year')
+    df = df.join(tax_years, how='left', on='N')
+
+    df['price_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['price'], x[tax_date_column]), axis=1)
+    df['fee_per_piece_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['fee_per_piece'], x[trade_date_column]), axis=1)
+    df['fee'] = df.apply(lambda x: x['fee_per_piece'] * abs(x['quantity']), axis=1)
+    df['total'] = df.apply(lambda x: compute_total_cost(x['quantity'], x['price'], x['fee_per_piece']), axis=1)
+    df['total_rub'] = df.apply(lambda x: compute_total_cost(x['quantity'], x['price_rub'], x['fee_per_piece_rub']), axis=1)
+    df['settle_rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['price'].currency, x[tax_date_column]), axis=1)
+    df['fee_rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['fee_per_piece'].currency, x[trade_date_column]), axis=1)
+    df['profit_rub'] = df['total_rub']
+
+    profit = df.groupby('N')['profit_rub'].sum().reset_index().set_index('N')
+    df = df.join(profit, how='left', on='N', lsuffix='_delete')
+    df.drop(columns=['profit_rub_delete'], axis=0, inplace=True)
+    df.loc[~df.index.isin(df.groupby('N')[trade_date_column].idxmax()), 'profit_rub'] = Money(0, Currency.RUB)
+
+    return df
+
+
+def generate_trades(rows: int) -> List[FinishedTrade]:
+    tickers = [Ticker(symbol=f'T{i}', kind=TickerKind.Stock) for i in range(50)]
+    currencies = [Currency.USD, Currency.EUR, Currency.RUB]
+    first_day = datetime.datetime(2015, 1, 5, 15, 30)
+
+    trades = []
+    for i in range(rows):
+        day = first_day + datetime.timedelta(days=i % 2500)
+        currency = currencies[i % len(currencies)]
+        trades.append(
+            FinishedTrade(
+                N=i // 2 + 1,
+                ticker=tickers[i % len(tickers)],
+                trade_date=day,
+                settle_date=(day + datetime.timedelta(days=2)).date(),
+                quantity=Decimal(i % 9 + 1) if i % 2 == 0 else Decimal(-(i % 9 + 1)),
+                price=Money(Decimal(10000 + i % 777) / 100, currency),
+                fee_per_piece=Money(Decimal(-(i % 13 + 1)) / 37, currency),
+            )
+        )
+    return trades
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--skip-legacy', action='store_true', help='measure the vectorized implementation only')
+    args = parser.parse_args()
+
+    trades = generate_trades(args.rows)
+    rates = SyntheticRates()
+
+    start = time.perf_counter()
+    df = prepare_trades_report(trades, rates)
+    elapsed = time.perf_counter() - start
+    print(f'prepare_trades_report: {args.rows} rows in {elapsed:.2f}s')
+
+    if args.skip_legacy:
+        return
+
+    start = time.perf_counter()
+    legacy_df = legacy_prepare_trades_report(trades, rates)
+    legacy_elapsed = time.perf_counter() - start
+    print(f'legacy df.apply:       {args.rows} rows in {legacy_elapsed:.2f}s ({legacy_elapsed / elapsed:.1f}x)')
+
+    assert list(df.columns) == [*legacy_df.columns[:9], 'currency', *legacy_df.columns[9:]]
+    assert df['currency'].tolist() == [x.price.currency for x in trades]
+    for column in ('price_rub', 'fee_per_piece_rub', 'fee', 'total', 'total_rub', 'settle_rate', 'fee_rate', 'profit_rub'):
+        assert df[column].map(str).tolist() == [str(x.amount) for x in legacy_df[column]], column
+    print('results are identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Сравнение render_table с tabulate на таблице сделок.
+
+    python benchmarks/render_table.py --rows 100000
+
+Таблица строится так же, как раздел TRADES отчёта; обе реализации должны дать одинаковый вывод.
+
+"""
+
+import argparse
+import io
+import time
+
+from tabulate import tabulate
+
+from benchmarks.prepare_trades_report import SyntheticRates, generate_trades
+from investments.ibtax.ibtax import prepare_trades_report
+from investments.ibtax.report_presenter import apply_money_for_dataframe, apply_round_for_dataframe
+from investments.ibtax.tables import render_table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--tablefmt', default='presto', choices=['presto', 'html'])
+    args = parser.parse_args()
+
+    df = prepare_trades_report(generate_trades(args.rows), SyntheticRates())
+    df['ticker'] = df['ticker'].map(str)
+    df = df[['currency', 'N', 'ticker', 'date', 'quantity', 'price', 'fee', 'total', 'total_rub', 'settle_rate', 'profit_rub']]
+    apply_round_for_dataframe(df, {'price', 'total', 'total_rub', 'profit_rub'}, 2)
+    apply_round_for_dataframe(df, {'fee', 'settle_rate'}, 4)
+    df = apply_money_for_dataframe(df, ['price', 'fee', 'total'], ['total_rub', 'settle_rate', 'profit_rub'])
+
+    start = time.perf_counter()
+    output = io.StringIO()
+    render_table(output, df, tablefmt=args.tablefmt)
+    elapsed = time.perf_counter() - start
+    print(f'render_table: {args.rows} rows in {elapsed:.2f}s')
+
+    start = time.perf_counter()
+    expected = tabulate(df, headers='keys', showindex=False, numalign='decimal', stralign='right', tablefmt=args.tablefmt)
+    tabulate_elapsed = time.perf_counter() - start
+    print(f'tabulate:     {args.rows} rows in {tabulate_elapsed:.2f}s ({tabulate_elapsed / elapsed:.1f}x)')
+
+    assert output.getvalue() == expected
+    print('results are identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Время запуска ibtax/ibdds по python -X importtime.
+
+    python benchmarks/startup.py --module investments.ibdds.ibdds --budget-ms 150
+
+Выводит самые долгие импорты (с учётом вложенных) и завершается с ошибкой, если импорт модуля дольше бюджета.
+Замеры повторяются --repeat раз, берётся лучший.
+
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def import_times(code: str) -> List[Tuple[str, int, int]]:
+    """Импорты при выполнении code: имя, вложенность и время импорта с учётом вложенных в микросекундах."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(cumulative)))
+    return times
+
+
+def startup_times(module: str) -> Tuple[int, List[Tuple[str, int, int]]]:
+    """Время импорта module в микросекундах и импорты, которых нет при запуске самого интерпретатора."""
+    interpreter = {name for name, _, _ in import_times('pass')}
+    times = [x for x in import_times(f'import {module}') if x[0] not in interpreter]
+    return sum(us for _, depth, us in times if depth == 0), times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='investments.ibtax.ibtax')
+    parser.add_argument('--budget-ms', type=float, default=None)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    total, times = min((startup_times(args.module) for _ in range(args.repeat)), key=lambda x: x[0])
+    for name, depth, us in sorted(times, key=lambda x: -x[2])[: args.top]:
+        print(f'{us / 1000:10.1f} ms  {"  " * depth}{name}')
+
+    total_ms = total / 1000
+    print(f'import {args.module}: {total_ms:.1f} ms')
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        sys.exit(f'startup budget exceeded: {total_ms:.1f} ms > {args.budget_ms} ms')
+
+
+if __name__ == '__main__':
+    main()
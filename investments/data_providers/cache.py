@@ -1,35 +1,124 @@
+"""
+Локальный кеш курсов валют.
+
+Курсы одной валюты хранятся в .npy файле с колонками: день (от 1970-01-01), мантисса и порядок Decimal.
+Такой файл загружается целиком или отображается в память без десериализации python-объектов (allow_pickle=False),
+поэтому его безопасно читать из общей для нескольких пользователей директории.
+
+"""
+
 import datetime
+import logging
 import os
-from typing import Optional
+import tempfile
+from decimal import Decimal
+from typing import Iterator, Mapping, Optional, Tuple
+
+import numpy
+
+from investments.currency import Currency
+from investments.money import Money
+
+RATES_DTYPE = numpy.dtype([('day', '<i4'), ('units', '<i8'), ('exp', 'i1')])
+
+_EPOCH = datetime.date(1970, 1, 1)
+_INT64_MAX = 2**63 - 1
+
+
+def _decimal_to_columns(value: Decimal) -> Tuple[int, int]:
+    sign, digits, exp = value.as_tuple()
+    assert isinstance(exp, int), f'unsupported rate {value}'
+    units = int(''.join(map(str, digits))) * (-1 if sign else 1)
+    if abs(units) > _INT64_MAX or not -128 <= exp <= 127:
+        raise ValueError(f'rate {value} does not fit into rates cache columns')
+    return units, exp
+
+
+class RatesTable:
+    """Курсы одной валюты, отсортированные по дню."""
+
+    def __init__(self, data: numpy.ndarray):
+        assert data.dtype == RATES_DTYPE
+        self._data = data
+
+    @staticmethod
+    def from_rates(rates: Mapping[datetime.date, Money]) -> 'RatesTable':
+        data = numpy.empty(len(rates), dtype=RATES_DTYPE)
+        for i, (day, rate) in enumerate(sorted(rates.items())):
+            units, exp = _decimal_to_columns(rate.amount)
+            data[i] = ((day - _EPOCH).days, units, exp)
+        return RatesTable(data)
 
-import pandas  # type: ignore
+    @property
+    def data(self) -> numpy.ndarray:
+        return self._data
 
+    def __len__(self) -> int:
+        return len(self._data)
 
-class DataFrameCache:
-    def __init__(self, cache_dir: Optional[str], cache_file: str, ttl: datetime.timedelta):
+    def get(self, day: datetime.date) -> Optional[Money]:
+        days = self._data['day']
+        key = (day - _EPOCH).days
+        idx = int(numpy.searchsorted(days, key))
+        if idx >= len(days) or days[idx] != key:
+            return None
+        return Money(Decimal(int(self._data['units'][idx])).scaleb(int(self._data['exp'][idx])), Currency.RUB)
+
+    def latest(self, day: datetime.date) -> Optional[Tuple[datetime.date, Money]]:
+        """Последний известный курс на день day или раньше."""
+        idx = int(numpy.searchsorted(self._data['day'], (day - _EPOCH).days, side='right')) - 1
+        if idx < 0:
+            return None
+        day_num, units, exp = self._data[idx].tolist()
+        return _EPOCH + datetime.timedelta(days=day_num), Money(Decimal(units).scaleb(exp), Currency.RUB)
+
+    def items(self) -> Iterator[Tuple[datetime.date, Money]]:
+        for day, units, exp in self._data.tolist():
+            yield _EPOCH + datetime.timedelta(days=day), Money(Decimal(units).scaleb(exp), Currency.RUB)
+
+    def merge(self, other: 'RatesTable') -> 'RatesTable':
+        """Объединение курсов, при совпадении дней приоритет у other."""
+        data = numpy.concatenate([other.data, self._data])
+        _, idx = numpy.unique(data['day'], return_index=True)
+        return RatesTable(data[idx])
+
+
+class RatesCache:
+    def __init__(self, cache_dir: Optional[str], cache_file: str):
         if cache_dir is None:
             self._cache_file = None
             return
 
-        assert cache_file is not None
-        assert ttl is not None
         os.makedirs(cache_dir, exist_ok=True)
-
         self._cache_file = os.path.join(cache_dir, cache_file)
-        self._ttl = ttl
 
-    def get(self) -> Optional[pandas.DataFrame]:
+    def get(self) -> Optional[RatesTable]:
         if self._cache_file is None:
             return None
         try:
-            mtime = os.path.getmtime(self._cache_file)
+            data = numpy.load(self._cache_file, mmap_mode='r', allow_pickle=False)
         except FileNotFoundError:
             return None
+        except ValueError as ex:
+            logging.warning(f'ignore broken rates cache {self._cache_file}: {ex}')
+            return None
 
-        if (datetime.datetime.utcnow() - datetime.datetime.utcfromtimestamp(mtime)) > self._ttl:
+        if data.dtype != RATES_DTYPE:
+            logging.warning(f'ignore rates cache {self._cache_file} with unexpected columns {data.dtype}')
             return None
-        return pandas.read_pickle(self._cache_file)
+        return RatesTable(data)
+
+    def put(self, table: RatesTable):
+        if self._cache_file is None:
+            return
 
-    def put(self, df: pandas.DataFrame):
-        if self._cache_file is not None:
-            df.to_pickle(self._cache_file)
+        # пишем во временный файл и переименовываем, чтобы параллельные читатели не увидели файл частично
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._cache_file), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                numpy.save(fh, table.data, allow_pickle=False)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self._cache_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
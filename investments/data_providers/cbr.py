@@ -6,87 +6,291 @@
 """
 
 import datetime
+import hashlib
 import logging
+import os
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Optional, Tuple
-
-import pandas  # type: ignore
-import requests
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple, TypeVar
 
 from investments.currency import Currency
-from investments.data_providers.cache import DataFrameCache
+from investments.data_providers.http import HttpClient, default_http_client
+from investments.data_providers.rates import LruRatesLayer, RatesChain, RatesLayer, RequiredRates, StoreRatesLayer
+from investments.data_providers.rates_bundle import RatesBundle, read_rates_bundle, write_rates_bundle
 from investments.money import Money
 
+CBR_URL = 'http://www.cbr.ru/scripts'
 
-class ExchangeRatesRUB:
-    _year_from: int
-    _cache_dir: Optional[str]
-    _frames_loaded: Dict[str, pandas.DataFrame]
+# курс на выходные и праздники равен последнему установленному, самые длинные (новогодние) праздники короче двух недель
+RATES_LOOKBACK = datetime.timedelta(days=14)
+
+# условная "стоимость" запроса к cbr.ru в записях ответа: задержка на соединение важнее объёма
+REQUEST_COST = 100
+
+# примерное количество валют в ответе XML_daily
+DAILY_RECORDS = 45
+
+# файлы курсов в cache_dir: загруженные с cbr.ru и импортированные (import_rates)
+STORE_FILE_TEMPLATE = 'cbrates_{code}.npy'
+BUNDLE_FILE_TEMPLATE = 'cbrates_{code}_offline.npy'
+
+
+class RatesRange(NamedTuple):
+    currency: Currency
+    date_from: datetime.date
+    date_to: datetime.date
 
-    def __init__(self, year_from: int = 2000, cache_dir: Optional[str] = None):
-        self._year_from = year_from
-        self._cache_dir = cache_dir
-        self._frames_loaded = {}
 
-    def get_rate(self, currency: Currency, dt: datetime.datetime) -> Money:
+class RatesFetchPlan(NamedTuple):
+    # диапазоны для XML_dynamic, по одному запросу на валюту
+    ranges: List[RatesRange]
+
+    # даты для XML_daily, по одному запросу на дату сразу для всех валют
+    daily_dates: List[datetime.date]
+    daily_currencies: List[Currency]
+
+
+def plan_rates_fetch(required: Mapping[Currency, Iterable[datetime.date]]) -> RatesFetchPlan:
+    """
+    Минимальный набор запросов к cbr.ru для получения курсов на требуемые даты.
+
+    Для каждой валюты берётся диапазон от первой до последней нужной даты, если же нужных дат мало,
+    то дешевле запросить курсы всех валют на каждую дату через XML_daily.
+
+    """
+    ranges: List[RatesRange] = []
+    all_dates: Set[datetime.date] = set()
+    for currency, dates in required.items():
         if currency is Currency.RUB:
-            return Money(1, Currency.RUB)
+            continue
+        currency_dates = set(dates)
+        if not currency_dates:
+            continue
+        all_dates |= currency_dates
+        ranges.append(RatesRange(currency, min(currency_dates) - RATES_LOOKBACK, max(currency_dates)))
+
+    dynamic_cost = sum(REQUEST_COST + (r.date_to - r.date_from).days for r in ranges)
+    daily_cost = len(all_dates) * (REQUEST_COST + DAILY_RECORDS)
+    if ranges and daily_cost < dynamic_cost:
+        return RatesFetchPlan(ranges=[], daily_dates=sorted(all_dates), daily_currencies=[r.currency for r in ranges])
+    return RatesFetchPlan(ranges=ranges, daily_dates=[], daily_currencies=[])
+
+
+def _parse_rate(elem: ET.Element) -> Money:
+    unit_rate = elem.findtext('VunitRate')
+    if unit_rate is not None:
+        return Money(unit_rate.replace(',', '.'), Currency.RUB)
+
+    value = elem.findtext('Value')
+    nominal = elem.findtext('Nominal')
+    assert isinstance(value, str)
+    assert isinstance(nominal, str)
+    return Money(value.replace(',', '.'), Currency.RUB) / int(nominal)
+
+
+_T = TypeVar('_T')
+
+
+class CbrRatesLayer(RatesLayer):
+    """
+    Загрузка курсов с cbr.ru, последний слой цепочки.
+
+    Запросы идут через общий HttpClient (keep-alive, повторы, circuit breaker), при недоступности cbr.ru
+    слой не бросает исключение, а возвращает промах и выставляет unavailable.
+
+    """
+
+    name = 'cbr'
+
+    def __init__(self, year_from: int = 2000, http_client: Optional[HttpClient] = None, base_url: str = CBR_URL):
+        super().__init__()
+        self._year_from = year_from
+        self._http = http_client if http_client is not None else default_http_client()
+        self._base_url = base_url
+        self._rates: Dict[Currency, Dict[datetime.date, Money]] = defaultdict(dict)
+        self._loaded: Dict[Currency, Dict[datetime.date, Money]] = defaultdict(dict)
+        self.unavailable = False
 
-        if currency.name not in self._frames_loaded:
-            self._fetch_currency_rates(currency)
+    def rates(self, currency: Currency) -> Dict[datetime.date, Money]:
+        return self._rates[currency]
 
-        rates = self._frames_loaded.get(currency.name)
-        assert rates is not None
+    def get(self, currency: Currency, day: datetime.date) -> Optional[Money]:
+        rate = self._rates[currency].get(day)
+        if rate is None:
+            # без предварительной загрузки берём всю историю с year_from, как и раньше
+            today = datetime.datetime.now(datetime.UTC).date()
+            date_from, date_to = min(datetime.date(self._year_from, 1, 1), day - RATES_LOOKBACK), max(day, today)
+            rates = self._call(lambda: self._load_range(currency, date_from, date_to))
+            if rates:
+                self._add(currency, rates)
+            rate = self._rates[currency].get(day)
+        return rate
 
-        return rates.loc[dt].item()
+    def prefetch(self, required: RequiredRates) -> RequiredRates:
+        plan = plan_rates_fetch(required)
+        with ThreadPoolExecutor(max_workers=self._http.max_concurrency) as pool:
+            ranges = [(r, pool.submit(self._load_range, r.currency, r.date_from, r.date_to)) for r in plan.ranges]
+            daily = [(day, pool.submit(self._load_daily, day)) for day in plan.daily_dates]
 
-    def convert_to_rub(self, source: Money, rate_date: datetime.datetime) -> Money:
-        assert isinstance(rate_date, datetime.datetime)
+        for r, range_future in ranges:
+            rates = self._call(range_future.result)
+            if rates:
+                self._add(r.currency, rates)
 
-        if source.currency == Currency.RUB:
-            return Money(source.amount, Currency.RUB)
+        for day, daily_future in daily:
+            day_rates = self._call(daily_future.result)
+            for currency in plan.daily_currencies:
+                if day_rates and currency.cbr_code in day_rates:
+                    self._add(currency, {day: day_rates[currency.cbr_code]})
 
-        rate = self.get_rate(source.currency, rate_date)
-        return Money(source.amount * rate.amount, rate.currency)
+        return super().prefetch(required)
 
-    def _fetch_currency_rates(self, currency: Currency):
-        """Загружаем курс запрошенной валюты из кеша или с cbr.ru."""
-        cache_key = f'cbrates_{currency.cbr_code}_since{self._year_from}.cache'
-        logging.info(f'load currency rates from cbr.ru {currency} {cache_key}')
-        frame_key = currency.name
+    def take_loaded(self) -> Dict[Currency, Dict[datetime.date, Money]]:
+        loaded = self._loaded
+        self._loaded = defaultdict(dict)
+        return loaded
 
-        cache = DataFrameCache(self._cache_dir, cache_key, datetime.timedelta(days=1))
-        df = cache.get()
-        if df is not None:
-            logging.info('cache hit')
-            self._frames_loaded[frame_key] = df
-            return
+    def _call(self, fn: Callable[[], _T]) -> Optional[_T]:
+        try:
+            return fn()
+        except OSError as ex:  # requests.RequestException и CircuitOpenError
+            logging.warning(f'cbr.ru is unavailable: {ex}')
+            self.unavailable = True
+            return None
 
-        end_date = (datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=1)).strftime('%d/%m/%Y')
-        r = requests.get(f'http://www.cbr.ru/scripts/XML_dynamic.asp?date_req1=01/01/{self._year_from}&date_req2={end_date}&VAL_NM_RQ={currency.cbr_code}', timeout=10)
+    def _add(self, currency: Currency, rates: Mapping[datetime.date, Money]):
+        self._rates[currency].update(rates)
 
-        tree = ET.fromstring(r.text)
+        # курс на дату позже сегодняшней может быть ещё не установлен, такие значения не сохраняем
+        today = datetime.datetime.now(datetime.UTC).date()
+        self._loaded[currency].update((d, rate) for d, rate in rates.items() if d <= today)
+
+    def _load_range(self, currency: Currency, date_from: datetime.date, date_to: datetime.date) -> Dict[datetime.date, Money]:
+        logging.info(f'load currency rates from cbr.ru {currency} {date_from} - {date_to}')
+
+        end_date = (date_to + datetime.timedelta(days=1)).strftime('%d/%m/%Y')
+        text = self._http.get_text(f'{self._base_url}/XML_dynamic.asp?date_req1={date_from:%d/%m/%Y}&date_req2={end_date}&VAL_NM_RQ={currency.cbr_code}')
+
+        tree = ET.fromstring(text)
 
-        rates_data: List[Tuple[datetime.date, Money]] = []
+        rates_data: Dict[datetime.date, Money] = {}
         for rec in tree.findall('Record'):
             assert rec.get('Id') == currency.cbr_code
             d = datetime.datetime.strptime(rec.attrib['Date'], '%d.%m.%Y').date()
-            unit_rate = rec.findtext('VunitRate')
-            if unit_rate is not None:
-                rate = Money(unit_rate.replace(',', '.'), Currency.RUB)
-            else:
-                value = rec.findtext('Value')
-                nominal = rec.findtext('Nominal')
-                assert isinstance(value, str)
-                assert isinstance(nominal, str)
-                rate = Money(value.replace(',', '.'), Currency.RUB) / int(nominal)
-            rates_data.append((d, rate))
-
-        df = pandas.DataFrame(rates_data, columns=['date', 'rate'])
-        df.set_index(['date'], inplace=True)
-        today = datetime.datetime.now(datetime.UTC).date()
-        df = df.reindex(pandas.date_range(df.index.min(), today))
-        df['rate'] = df['rate'].ffill()
+            rates_data[d] = _parse_rate(rec)
+
+        # на выходные и праздники - последний установленный курс
+        rates: Dict[datetime.date, Money] = {}
+        dates = sorted(rates_data)
+        for day, next_rate_day in zip(dates, [*dates[1:], date_to + datetime.timedelta(days=1)], strict=True):
+            rate = rates_data[day]
+            while day < next_rate_day and day <= date_to:
+                rates[day] = rate
+                day += datetime.timedelta(days=1)
+        return rates
+
+    def _load_daily(self, day: datetime.date) -> Dict[str, Money]:
+        """Курсы всех валют на дату, ключ - код валюты в классификаторе ЦБ РФ."""
+        logging.info(f'load daily currency rates from cbr.ru {day}')
+        tree = ET.fromstring(self._http.get_text(f'{self._base_url}/XML_daily.asp?date_req={day:%d/%m/%Y}'))
+        return {valute.attrib['ID']: _parse_rate(valute) for valute in tree.findall('Valute')}
+
+
+class ExchangeRatesRUB(RatesChain):
+    """
+    Курсы ЦБ РФ: память -> локальный кеш -> импортированные файлы (import_rates) -> cbr.ru.
+
+    offline=True - без обращений к cbr.ru, курсы только из кеша и импортированных файлов.
+
+    Если cbr.ru недоступен, а курса на нужную дату в кеше нет, используется последний известный курс
+    на более раннюю дату с предупреждением в лог.
+
+    """
+
+    def __init__(self, year_from: int = 2000, cache_dir: Optional[str] = None, offline: bool = False, http_client: Optional[HttpClient] = None, cbr_url: str = CBR_URL):
+        self._store = StoreRatesLayer('store', cache_dir, STORE_FILE_TEMPLATE)
+        self._bundle = StoreRatesLayer('bundle', cache_dir, BUNDLE_FILE_TEMPLATE, write_through=False)
+        self._remote = None if offline else CbrRatesLayer(year_from, http_client, cbr_url)
+        self._stale: Dict[Tuple[Currency, datetime.date], Money] = {}
+        self._unpublished = False
+
+        layers: List[RatesLayer] = [LruRatesLayer(), self._store, self._bundle]
+        if self._remote is not None:
+            layers.append(self._remote)
+        super().__init__(layers)
+
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        if currency is not Currency.RUB and (dt.date() if isinstance(dt, datetime.datetime) else dt) > datetime.datetime.now(datetime.UTC).date():
+            self._unpublished = True
+        try:
+            return super().get_rate(currency, dt)
+        except KeyError:
+            if self._remote is None or not self._remote.unavailable:
+                raise
+
+        day = dt.date() if isinstance(dt, datetime.datetime) else dt
+        with self._lock:
+            if (currency, day) in self._stale:
+                return self._stale[(currency, day)]
+
+            stale = [x for x in (self._store.get_latest(currency, day), self._bundle.get_latest(currency, day)) if x is not None]
+            if not stale:
+                raise KeyError(f'no {currency.name} rate for {day}: cbr.ru is unavailable and there is no cached rate before that date')
+
+            stale_day, rate = max(stale, key=lambda x: x[0])
+            logging.warning(f'cbr.ru is unavailable, use stale {currency.name} rate {rate} from {stale_day} for {day}')
+            self._stale[(currency, day)] = rate
+            return rate
+
+    @property
+    def used_stale_rates(self) -> bool:
+        """Использовался ли последний известный курс вместо курса на дату (cbr.ru был недоступен)."""
+        return bool(self._stale)
+
+    @property
+    def used_unpublished_rates(self) -> bool:
+        """Запрашивались ли курсы на даты позже сегодняшней: ЦБ мог их ещё не установить, тогда это последний установленный курс."""
+        return self._unpublished
+
+    def import_rates(self, filepath: str):
+        """Импорт курсов из файла (csv/json) в кеш, импортированные курсы не устаревают."""
+        for currency, rates in read_rates_bundle(filepath).items():
+            if currency is not Currency.RUB:
+                self._bundle.save(currency, rates)
+                logging.info(f'imported {len(rates)} {currency.name} rates from {filepath}')
+
+    def export_rates(self, filepath: str):
+        """Выгрузка всех закешированных и загруженных курсов в файл (csv/json), см. import_rates."""
+        rates: RatesBundle = defaultdict(dict)
+        for currency in Currency:
+            if currency is Currency.RUB:
+                continue
+            rates[currency].update(self._bundle.rates(currency))
+            rates[currency].update(self._store.rates(currency))
+            if self._remote is not None:
+                rates[currency].update(self._remote.rates(currency))
+            if not rates[currency]:
+                del rates[currency]
+
+        write_rates_bundle(filepath, rates)
+        logging.info(f'exported {sum(len(x) for x in rates.values())} rates to {filepath}')
+
+
+def rates_data_version(cache_dir: Optional[str]) -> Optional[str]:
+    """Версия курсов в cache_dir - хеш файлов загруженных и импортированных курсов, меняется после каждой загрузки и импорта. None - без cache_dir."""
+    if cache_dir is None:
+        return None
 
-        cache.put(df)
-        self._frames_loaded[frame_key] = df
+    digest = hashlib.sha256()
+    for currency in Currency:
+        for template in (STORE_FILE_TEMPLATE, BUNDLE_FILE_TEMPLATE):
+            filename = template.format(code=currency.cbr_code)
+            try:
+                with open(os.path.join(cache_dir, filename), 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            digest.update(f'{filename}:{len(content)}:'.encode())
+            digest.update(content)
+    return digest.hexdigest()
@@ -0,0 +1,145 @@
+"""
+HTTP клиент для внешних источников данных (cbr.ru).
+
+Одна сессия requests на процесс с пулом keep-alive соединений, ограничением количества параллельных запросов,
+повторами с экспоненциальной задержкой и circuit breaker: после серии неудачных запросов источник считается
+недоступным и запросы сразу завершаются ошибкой, не дожидаясь таймаутов.
+
+requests импортируется при первом запросе: с заполненным кешем курсов он не нужен.
+
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# ответы, после которых имеет смысл повторить запрос
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(ConnectionError):
+    """Источник недоступен, запрос не выполнялся. Как и исключения requests, это OSError."""
+
+
+class HttpClient:
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        timeout: float = 10.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60.0,
+    ):
+        self._max_concurrency = max_concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = timeout
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+        self._session: Optional['requests.Session'] = None
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+
+        self.requests_count = 0
+        self.retries_count = 0
+        self.bytes_received = 0
+
+    @property
+    def max_concurrency(self) -> int:
+        return self._max_concurrency
+
+    def _get_session(self) -> 'requests.Session':
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if self._session is None:
+                adapter = HTTPAdapter(pool_connections=self._max_concurrency, pool_maxsize=self._max_concurrency)
+                self._session = requests.Session()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def _check_circuit(self, url: str):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self._reset_timeout:
+                raise CircuitOpenError(f'circuit is open, skip request {url}')
+            # пробный запрос, при неудаче цепь снова разомкнётся
+            self._opened_at = None
+            self._consecutive_failures = self._failure_threshold - 1
+
+    def _record_result(self, success: bool):
+        with self._lock:
+            if success:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self._failure_threshold and self._opened_at is None:
+                logging.warning(f'{self._consecutive_failures} failed requests in a row, open circuit for {self._reset_timeout}s')
+                self._opened_at = time.monotonic()
+
+    def _delay(self, attempt: int) -> float:
+        # "full jitter": случайная задержка, чтобы параллельные клиенты не повторяли запросы одновременно
+        return random.uniform(0, min(self._max_backoff, self._backoff * 2**attempt))
+
+    def get_text(self, url: str) -> str:
+        import requests
+
+        self._check_circuit(url)
+        session = self._get_session()
+
+        attempt = 0
+        while True:
+            try:
+                with self._semaphore:
+                    with self._lock:
+                        self.requests_count += 1
+                    r = session.get(url, timeout=self._timeout)
+                with self._lock:
+                    self.bytes_received += len(r.content)
+                if r.status_code in RETRY_STATUSES:
+                    raise requests.HTTPError(f'{r.status_code} for {url}', response=r)
+                r.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as ex:
+                retryable = not isinstance(ex, requests.HTTPError) or (ex.response is not None and ex.response.status_code in RETRY_STATUSES)
+                if not retryable:
+                    raise
+                if attempt >= self._retries:
+                    self._record_result(False)
+                    raise
+                delay = self._delay(attempt)
+                logging.info(f'request {url} failed ({ex}), retry in {delay:.2f}s')
+                with self._lock:
+                    self.retries_count += 1
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._record_result(True)
+            return r.text
+
+
+_default_client: Optional[HttpClient] = None
+_default_client_lock = threading.Lock()
+
+
+def default_http_client() -> HttpClient:
+    """Общий для всего процесса клиент."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
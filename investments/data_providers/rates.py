@@ -0,0 +1,231 @@
+"""
+Курсы валют относительно рубля: общий интерфейс и цепочка источников.
+
+RatesChain опрашивает слои по порядку (память, локальное хранилище, импортированный файл, cbr.ru),
+курсы найденные в нижних слоях записываются в верхние, для каждого слоя считается количество попаданий и промахов.
+Запросы к цепочке из разных потоков выполняются по очереди.
+
+"""
+
+import datetime
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+from investments.currency import Currency
+from investments.data_providers.cache import RatesCache, RatesTable
+from investments.money import Money
+
+RequiredRates = Dict[Currency, Set[datetime.date]]
+
+
+def _as_date(dt: datetime.date) -> datetime.date:
+    return dt.date() if isinstance(dt, datetime.datetime) else dt
+
+
+class RatesProvider(ABC):
+    @abstractmethod
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        pass
+
+    def prefetch(self, required: Mapping[Currency, Iterable[datetime.date]]):
+        """Подсказка провайдеру, на какие даты понадобятся курсы."""
+        return None
+
+    def convert_to_rub(self, source: Money, rate_date: datetime.datetime) -> Money:
+        assert isinstance(rate_date, datetime.datetime)
+
+        if source.currency == Currency.RUB:
+            return Money(source.amount, Currency.RUB)
+
+        rate = self.get_rate(source.currency, rate_date)
+        return Money(source.amount * rate.amount, rate.currency)
+
+    def get_rates(self, currencies: Sequence[Currency], dates: Sequence[datetime.date]) -> List[Money]:
+        """Курсы для столбцов валют и дат, каждая уникальная пара (валюта, дата) запрашивается один раз."""
+        resolved: Dict[Tuple[Currency, datetime.date], Money] = {}
+        rates = []
+        for key in zip(currencies, map(_as_date, dates), strict=True):
+            rate = resolved.get(key)
+            if rate is None:
+                rate = resolved[key] = self.get_rate(*key)
+            rates.append(rate)
+        return rates
+
+
+class PreloadedRates(RatesProvider):
+    """
+    Курсы на даты required, заранее загруженные и прочитанные из provider в словарь: потоки, которые готовят
+    отчёты, читают их без блокировок provider. Остальные курсы (и те, которых не нашлось) запрашиваются у provider.
+
+    """
+
+    def __init__(self, provider: RatesProvider, required: Mapping[Currency, Iterable[datetime.date]]):
+        self._provider = provider
+        self._rates: Dict[Tuple[Currency, datetime.date], Money] = {}
+        provider.prefetch(required)
+        for currency, dates in required.items():
+            for day in map(_as_date, dates):
+                try:
+                    self._rates[(currency, day)] = provider.get_rate(currency, day)
+                except KeyError:
+                    # ошибка - только если курс действительно понадобится
+                    continue
+
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        rate = self._rates.get((currency, _as_date(dt)))
+        return rate if rate is not None else self._provider.get_rate(currency, dt)
+
+
+class LayerStats(NamedTuple):
+    name: str
+    hits: int
+    misses: int
+
+
+class RatesLayer(ABC):
+    name: str
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get(self, currency: Currency, day: datetime.date) -> Optional[Money]:
+        pass
+
+    def prefetch(self, required: RequiredRates) -> RequiredRates:
+        """Загрузить курсы заранее, возвращает даты, которых в слое нет."""
+        missing = {currency: {d for d in days if self.get(currency, d) is None} for currency, days in required.items()}
+        return {currency: days for currency, days in missing.items() if days}
+
+    def put(self, currency: Currency, day: datetime.date, rate: Money):
+        """Курс найден в одном из нижних слоев."""
+        return None
+
+    def put_many(self, currency: Currency, rates: Mapping[datetime.date, Money]):
+        """Ряд курсов загружен одним из нижних слоев."""
+        return None
+
+    def take_loaded(self) -> Dict[Currency, Dict[datetime.date, Money]]:
+        """Курсы, загруженные слоем с момента предыдущего вызова, для записи в верхние слои."""
+        return {}
+
+
+class LruRatesLayer(RatesLayer):
+    name = 'lru'
+
+    def __init__(self, maxsize: int = 65536):
+        super().__init__()
+        self._maxsize = maxsize
+        self._rates: OrderedDict[Tuple[Currency, datetime.date], Money] = OrderedDict()
+
+    def get(self, currency: Currency, day: datetime.date) -> Optional[Money]:
+        rate = self._rates.get((currency, day))
+        if rate is not None:
+            self._rates.move_to_end((currency, day))
+        return rate
+
+    def put(self, currency: Currency, day: datetime.date, rate: Money):
+        self._rates[(currency, day)] = rate
+        if len(self._rates) > self._maxsize:
+            self._rates.popitem(last=False)
+
+
+class StoreRatesLayer(RatesLayer):
+    """
+    Курсы, сохранённые в cache_dir, по файлу на валюту; без cache_dir - только в памяти.
+
+    write_through=True - сохранять курсы, загруженные нижними слоями цепочки.
+
+    """
+
+    def __init__(self, name: str, cache_dir: Optional[str], cache_file_template: str, write_through: bool = True):
+        super().__init__()
+        self.name = name
+        self._cache_dir = cache_dir
+        self._cache_file_template = cache_file_template
+        self._write_through = write_through
+        self._tables: Dict[Currency, RatesTable] = {}
+
+    def _cache(self, currency: Currency) -> RatesCache:
+        return RatesCache(self._cache_dir, self._cache_file_template.format(code=currency.cbr_code))
+
+    def _table(self, currency: Currency) -> RatesTable:
+        table = self._tables.get(currency)
+        if table is None:
+            table = self._cache(currency).get()
+            if table is None:
+                table = RatesTable.from_rates({})
+            self._tables[currency] = table
+        return table
+
+    def rates(self, currency: Currency) -> Dict[datetime.date, Money]:
+        return dict(self._table(currency).items())
+
+    def get(self, currency: Currency, day: datetime.date) -> Optional[Money]:
+        return self._table(currency).get(day)
+
+    def get_latest(self, currency: Currency, day: datetime.date) -> Optional[Tuple[datetime.date, Money]]:
+        return self._table(currency).latest(day)
+
+    def put_many(self, currency: Currency, rates: Mapping[datetime.date, Money]):
+        if self._write_through:
+            self.save(currency, rates)
+
+    def save(self, currency: Currency, rates: Mapping[datetime.date, Money]):
+        table = self._table(currency).merge(RatesTable.from_rates(rates))
+        self._tables[currency] = table
+        self._cache(currency).put(table)
+
+
+class RatesChain(RatesProvider):
+    def __init__(self, layers: List[RatesLayer]):
+        assert layers
+        self._layers = layers
+        self._lock = threading.RLock()
+
+    def stats(self) -> List[LayerStats]:
+        return [LayerStats(layer.name, layer.hits, layer.misses) for layer in self._layers]
+
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        if currency is Currency.RUB:
+            return Money(1, Currency.RUB)
+
+        with self._lock:
+            return self._get_rate(currency, _as_date(dt))
+
+    def _get_rate(self, currency: Currency, day: datetime.date) -> Money:
+        for i, layer in enumerate(self._layers):
+            rate = layer.get(currency, day)
+            self._write_through(i)
+            if rate is None:
+                layer.misses += 1
+                continue
+
+            layer.hits += 1
+            for upper in self._layers[:i]:
+                upper.put(currency, day, rate)
+            return rate
+
+        raise KeyError(f'no {currency.name} rate for {day} in {[x.name for x in self._layers]}')
+
+    def prefetch(self, required: Mapping[Currency, Iterable[datetime.date]]):
+        missing: RequiredRates = {}
+        for currency, dates in required.items():
+            days = {_as_date(d) for d in dates}
+            if currency is not Currency.RUB and days:
+                missing[currency] = days
+
+        with self._lock:
+            for i, layer in enumerate(self._layers):
+                if not missing:
+                    break
+                missing = layer.prefetch(missing)
+                self._write_through(i)
+
+    def _write_through(self, layer_idx: int):
+        for currency, rates in self._layers[layer_idx].take_loaded().items():
+            for upper in self._layers[:layer_idx]:
+                upper.put_many(currency, rates)
@@ -0,0 +1,56 @@
+"""
+Переносимый файл с курсами валют для работы без доступа к cbr.ru.
+
+Поддерживаются два формата, выбираются по расширению файла:
+- csv: строки currency,date,rate
+- json: {"USD": {"2020-03-31": "77.7325", ...}, ...}
+
+Курс должен быть указан на каждую нужную дату, включая выходные, пропуски не заполняются.
+
+"""
+
+import csv
+import datetime
+import json
+from typing import Dict, Mapping
+
+from investments.currency import Currency
+from investments.money import Money
+
+RatesBundle = Dict[Currency, Dict[datetime.date, Money]]
+
+
+def _is_json(filepath: str) -> bool:
+    return filepath.lower().endswith('.json')
+
+
+def write_rates_bundle(filepath: str, rates: Mapping[Currency, Mapping[datetime.date, Money]]):
+    ordered = sorted(rates.items(), key=lambda x: x[0].name)
+    with open(filepath, 'w', newline='', encoding='utf-8') as fh:
+        if _is_json(filepath):
+            data = {currency.name: {d.isoformat(): str(rate.amount) for d, rate in sorted(currency_rates.items())} for currency, currency_rates in ordered}
+            json.dump(data, fh, indent=1)
+            return
+
+        writer = csv.writer(fh)
+        writer.writerow(['currency', 'date', 'rate'])
+        for currency, currency_rates in ordered:
+            for d, rate in sorted(currency_rates.items()):
+                writer.writerow([currency.name, d.isoformat(), str(rate.amount)])
+
+
+def read_rates_bundle(filepath: str) -> RatesBundle:
+    rates: RatesBundle = {}
+    with open(filepath, newline='', encoding='utf-8') as fh:
+        if _is_json(filepath):
+            rows = [(name, d, rate) for name, currency_rates in json.load(fh).items() for d, rate in currency_rates.items()]
+        else:
+            reader = csv.reader(fh)
+            header = next(reader)
+            assert header == ['currency', 'date', 'rate'], f'unexpected rates bundle header {header}'
+            rows = [(name, d, rate) for name, d, rate in reader]
+
+    for name, d, rate in rows:
+        currency = Currency[name]
+        rates.setdefault(currency, {})[datetime.date.fromisoformat(d)] = Money(rate, Currency.RUB)
+    return rates
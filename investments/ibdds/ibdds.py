@@ -13,8 +13,6 @@ import csv
 import logging
 from typing import Any, List
 
-from tabulate import tabulate
-
 from investments.cash import Cash
 from investments.money import Money
 from investments.report_parsers.ib import InteractiveBrokersReportParser
@@ -50,6 +48,8 @@ def dds_specific_round(source_amount: Money) -> Money:
 
 
 def show_report(cash: List[Cash]):
+    from tabulate import tabulate
+
     currencies = {x.amount.currency for x in cash}
     logging.info(f'currency={currencies}')
 
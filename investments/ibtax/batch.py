@@ -0,0 +1,222 @@
+"""
+Отчёты ibtax для нескольких счетов по манифесту.
+
+    python -m investments.ibtax.batch --manifest accounts.json --jobs 4
+
+Манифест - json список счетов:
+
+    [{"name": "ivan", "activity_reports_dir": "ivan/activity", "confirmation_reports_dir": "ivan/confirmation", "years": [2023], "save_to": "ivan.pdf"}]
+
+Необязательные поля: years (по умолчанию все годы), save_to (по умолчанию --output-dir/<name>.txt, .csv или .jsonl),
+report_type и verbose - как одноимённые параметры ibtax. Относительные пути в манифесте - от каталога манифеста.
+
+Разбор отчётов и FIFO идут в пуле процессов. Затем курсы для всех счетов загружает один провайдер: одна серия
+запросов к cbr.ru, курсы записываются в общий кеш на диске. Отчёты готовятся в том же пуле, каждый процесс
+открывает кеш один раз и использует его для всех своих счетов.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+
+from investments.data_providers import cbr
+from investments.data_providers.http import default_http_client
+from investments.data_providers.rates import RatesProvider, RequiredRates
+from investments.ibtax.ibtax import REPORT_TYPES, AccountOperations, analyze_reports, present_reports, required_rates
+from investments.ibtax.profiler import Profiler
+
+_EXTENSIONS = {'native': '.txt', 'csv': '.csv', 'jsonl': '.jsonl'}
+
+
+class Account(NamedTuple):
+    name: str
+    activity_reports_dir: str
+    confirmation_reports_dir: str
+    save_to: str
+    years: List[int]
+    report_type: str = 'native'
+    verbose: bool = False
+
+
+class RatesOptions(NamedTuple):
+    year_from: int
+    cache_dir: str
+    offline: bool
+
+
+class AccountResult(NamedTuple):
+    account: Account
+    profiler: Profiler
+    error: Optional[str]
+
+
+def read_manifest(filepath: str, output_dir: str) -> List[Account]:
+    with open(filepath, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError(f'{filepath}: manifest must be a list of accounts')
+
+    base_dir = os.path.dirname(os.path.abspath(filepath))
+    accounts = []
+    for item in data:
+        unknown = set(item) - set(Account._fields)
+        if unknown:
+            raise ValueError(f'{filepath}: unknown fields {sorted(unknown)} for account {item.get("name")}')
+        for field in ('name', 'activity_reports_dir', 'confirmation_reports_dir'):
+            if field not in item:
+                raise ValueError(f'{filepath}: {field} is required for every account')
+
+        report_type = item.get('report_type', 'native')
+        if report_type not in REPORT_TYPES:
+            raise ValueError(f'{filepath}: unknown report_type {report_type} for account {item["name"]}')
+
+        save_to = os.path.join(base_dir, item['save_to']) if item.get('save_to') else os.path.join(output_dir, f'{item["name"]}{_EXTENSIONS[report_type]}')
+        accounts.append(
+            Account(
+                name=item['name'],
+                activity_reports_dir=os.path.join(base_dir, item['activity_reports_dir']),
+                confirmation_reports_dir=os.path.join(base_dir, item['confirmation_reports_dir']),
+                save_to=save_to,
+                years=[int(x) for x in item.get('years', [])],
+                report_type=report_type,
+                verbose=bool(item.get('verbose', False)),
+            )
+        )
+
+    names = [x.name for x in accounts]
+    duplicates = sorted({x for x in names if names.count(x) > 1})
+    if duplicates:
+        raise ValueError(f'{filepath}: duplicate account names {duplicates}')
+    return accounts
+
+
+def _analyze_account(account: Account) -> Tuple[Optional[AccountOperations], Profiler]:
+    profiler = Profiler()
+    return analyze_reports(account.activity_reports_dir, account.confirmation_reports_dir, account.years, profiler), profiler
+
+
+# провайдер курсов процесса пула, общий для всех счетов, которые готовит этот процесс
+_process_rates: Optional[RatesProvider] = None
+
+
+def _rates_for_process(options: RatesOptions) -> RatesProvider:
+    global _process_rates
+    if _process_rates is None:
+        _process_rates = cbr.ExchangeRatesRUB(year_from=options.year_from, cache_dir=options.cache_dir, offline=options.offline)
+    return _process_rates
+
+
+def _present_account(account: Account, operations: AccountOperations, profiler: Profiler, rates: Optional[RatesProvider], options: RatesOptions, pdf_chunk_rows: int) -> Profiler:
+    if rates is None:
+        rates = _rates_for_process(options)
+    os.makedirs(os.path.dirname(os.path.abspath(account.save_to)), exist_ok=True)
+    presenter = REPORT_TYPES[account.report_type](account.verbose, account.save_to, pdf_chunk_rows=pdf_chunk_rows)
+    present_reports(operations, rates, presenter, account.years, account.verbose, profiler)
+    return profiler
+
+
+def _run(executor: Optional[Executor], fn: Callable, tasks: Sequence[Tuple]) -> List[Tuple[Any, Optional[str]]]:
+    """Результаты fn(*task) в порядке задач, ошибка одной задачи не останавливает остальные."""
+    if executor is None:
+        futures = None
+    else:
+        futures = [executor.submit(fn, *task) for task in tasks]
+
+    results: List[Tuple[Any, Optional[str]]] = []
+    for i, task in enumerate(tasks):
+        try:
+            results.append((fn(*task) if futures is None else futures[i].result(), None))
+        except Exception as ex:
+            logging.exception(f'account {task[0].name} failed')
+            results.append((None, f'{type(ex).__name__}: {ex}'))
+    return results
+
+
+def run_batch(accounts: List[Account], cache_dir: str, offline: bool = False, jobs: int = 1, pdf_chunk_rows: int = 1000, profiler: Optional[Profiler] = None) -> List[AccountResult]:
+    """Отчёты по всем счетам, jobs - количество процессов (1 - без пула, в текущем процессе)."""
+    profiler = profiler or Profiler(enabled=False)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    try:
+        with profiler.stage('analyze accounts'):
+            analyzed = _run(executor, _analyze_account, [(x,) for x in accounts])
+            profiler.add_rows('analyze accounts', len(accounts))
+
+        results: Dict[str, AccountResult] = {}
+        ready: List[Tuple[Account, AccountOperations, Profiler]] = []
+        for account, (result, error) in zip(accounts, analyzed, strict=True):
+            operations, account_profiler = result if result is not None else (None, Profiler())
+            if operations is None:
+                results[account.name] = AccountResult(account, account_profiler, error or 'no trades found')
+            else:
+                ready.append((account, operations, account_profiler))
+
+        options = RatesOptions(min((x.first_year for _, x, _ in ready), default=2000), cache_dir, offline)
+        rates = cbr.ExchangeRatesRUB(year_from=options.year_from, cache_dir=cache_dir, offline=offline)
+        with profiler.stage('rates prefetch'):
+            required: RequiredRates = defaultdict(set)
+            for account, operations, _ in ready:
+                for currency, days in required_rates(operations.finished_trades, operations.dividends, operations.fees, operations.interests, account.years).items():
+                    required[currency] |= days
+            rates.prefetch(required)
+            profiler.add_rows('rates prefetch', sum(len(x) for x in required.values()))
+
+        with profiler.stage('present accounts'):
+            # в пуле каждый процесс читает курсы из кеша на диске, без пула используется общий провайдер
+            process_rates = rates if executor is None else None
+            tasks = [(account, operations, account_profiler, process_rates, options, pdf_chunk_rows) for account, operations, account_profiler in ready]
+            for (account, _, account_profiler), (result, error) in zip(ready, _run(executor, _present_account, tasks), strict=True):
+                results[account.name] = AccountResult(account, result or account_profiler, error)
+            profiler.add_rows('present accounts', len(ready))
+
+        profiler.collect(rates.stats(), default_http_client())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return [results[x.name] for x in accounts]
+
+
+def write_batch_summary(output: TextIO, results: List[AccountResult], profiler: Profiler):
+    output.write(f'{"account":<20} {"parse, s":>9} {"fifo, s":>9} {"prepare, s":>10} {"present, s":>10} {"total, s":>9}  status\n')
+    for account, account_profiler, error in results:
+        wall: Dict[str, float] = defaultdict(float)
+        for stage in account_profiler.stages:
+            wall[stage.name.split()[0]] += stage.wall
+        prepare = wall['prepare'] + wall['rates']
+        total = sum(wall.values())
+        output.write(f'{account.name:<20} {wall["parse"]:>9.3f} {wall["fifo"]:>9.3f} {prepare:>10.3f} {wall["present"]:>10.3f} {total:>9.3f}  {error or "ok"}\n')
+    output.write('\n')
+    profiler.write_summary(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--manifest', type=str, required=True, help='json list of accounts: name, activity_reports_dir, confirmation_reports_dir, [years, save_to, report_type, verbose]')
+    parser.add_argument('--output-dir', type=str, default='.', help='directory for reports of accounts without save_to')
+    parser.add_argument('--cache-dir', type=str, default='.', help='directory for caching (CBR RUB exchange rates), shared by all accounts')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='worker processes, 1 - process accounts one by one in this process')
+    parser.add_argument('--pdf-chunk-rows', type=int, default=1000, help='max table rows laid out in one pdf document, larger tables are split')
+    parser.add_argument('--offline', nargs='?', default=False, const=True, help='use only imported exchange rates, never request cbr.ru')
+    parser.add_argument('--quiet', nargs='?', default=False, const=True, help='suppress non-error messages')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR if args.quiet else logging.WARNING)
+
+    accounts = read_manifest(args.manifest, args.output_dir)
+    profiler = Profiler()
+    results = run_batch(accounts, args.cache_dir, offline=args.offline, jobs=args.jobs, pdf_chunk_rows=args.pdf_chunk_rows, profiler=profiler)
+
+    if not args.quiet:
+        write_batch_summary(sys.stderr, results, profiler)
+    if any(x.error for x in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Пересчёт денежных столбцов отчётов в рубли.
+
+Денежные суммы в отчётах хранятся столбцами Decimal (numpy object) без валюты, валюта строки - в отдельном
+категориальном столбце currency, суммы в рублях и курсы - в столбцах с суффиксом _rub и rate.
+Money собирается только при выводе отчёта.
+
+Курсы запрашиваются пачкой через RatesProvider.get_rates, порядок операций с Decimal тот же,
+что и в RatesProvider.convert_to_rub, поэтому результат совпадает до знака.
+
+numpy и pandas импортируются только при подготовке отчётов.
+
+"""
+
+import functools
+from decimal import Decimal
+from typing import TYPE_CHECKING, Iterable, List, Sequence
+
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.money import Money
+
+if TYPE_CHECKING:
+    import numpy
+    import pandas  # type: ignore
+
+
+def amounts(values: Iterable[Money]) -> 'numpy.ndarray':
+    import numpy
+
+    return numpy.array([x.amount for x in values], dtype=object)
+
+
+def decimals(column: 'pandas.Series') -> 'numpy.ndarray':
+    return column.to_numpy(dtype=object)
+
+
+@functools.lru_cache(maxsize=None)
+def _round() -> 'numpy.ufunc':
+    import numpy
+
+    return numpy.frompyfunc(round, 2, 1)
+
+
+def round_decimals(values: 'numpy.ndarray', digits: int) -> 'numpy.ndarray':
+    """round(x, digits) для каждого Decimal столбца."""
+    return _round()(values, digits)
+
+
+def money(values: Iterable[Decimal], currencies: Iterable[Currency]) -> List[Money]:
+    return [Money(amount, currency) for amount, currency in zip(values, currencies, strict=True)]
+
+
+def currency_column(currencies: Iterable[Currency]) -> 'pandas.Categorical':
+    import pandas  # type: ignore
+
+    return pandas.Categorical(list(currencies), categories=list(Currency))
+
+
+def to_rub(values: 'numpy.ndarray', currencies: Sequence[Currency], rates: 'numpy.ndarray') -> 'numpy.ndarray':
+    """RatesProvider.convert_to_rub для столбцов: суммы в рублях не пересчитываются."""
+    import numpy
+
+    is_rub = numpy.array([currency is Currency.RUB for currency in currencies], dtype=bool)
+    return numpy.where(is_rub, values, values * rates)
+
+
+def append_rub_columns(df: 'pandas.DataFrame', cbr_client: RatesProvider, columns: Sequence[str], date_column: str = 'date', currency_column: str = 'currency'):
+    """
+    Добавляет в df курс валюты строки на дату date_column (столбец rate) и суммы в рублях (столбцы {column}_rub).
+
+    Курс на одну и ту же пару (валюта, дата) запрашивается один раз.
+
+    """
+    import pandas  # type: ignore
+
+    assert columns
+    dates = pandas.to_datetime(df[date_column]).dt.date.tolist()
+    currencies = df[currency_column].tolist()
+    rates = amounts(cbr_client.get_rates(currencies, dates))
+
+    df['rate'] = rates
+    for column in columns:
+        df[f'{column}_rub'] = to_rub(decimals(df[column]), currencies, rates)
@@ -0,0 +1,148 @@
+"""
+Выгрузка результатов ibtax для других программ: csv или json lines.
+
+Суммы выгружаются без округления строками Decimal, валюта - кодом (USD), даты - в формате ISO (2020-03-31).
+Строки пишутся в поток по одной, таблицы не форматируются и pdf не создаётся.
+
+"""
+
+import csv
+import json
+import math
+from abc import abstractmethod
+from decimal import Decimal
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from investments.ibtax.report_presenter import ReportPresenter
+from investments.ticker import Ticker
+from investments.trades_fifo import PortfolioElement
+
+if TYPE_CHECKING:
+    import pandas  # type: ignore
+
+TRADES_FIELDS = [
+    'N',
+    'ticker',
+    'ticker_kind',
+    'trade_date',
+    'settle_date',
+    'tax_year',
+    'quantity',
+    'currency',
+    'price',
+    'fee_per_piece',
+    'fee',
+    'total',
+    'settle_rate',
+    'fee_rate',
+    'price_rub',
+    'fee_per_piece_rub',
+    'total_rub',
+    'profit_rub',
+]
+DIVIDENDS_FIELDS = ['N', 'ticker', 'ticker_kind', 'date', 'tax_year', 'currency', 'amount', 'tax_paid', 'rate', 'amount_rub', 'tax_paid_rub', 'tax_rate']
+FEES_FIELDS = ['N', 'date', 'tax_year', 'description', 'currency', 'amount', 'rate', 'amount_rub']
+INTERESTS_FIELDS = FEES_FIELDS
+PORTFOLIO_FIELDS = ['ticker', 'ticker_kind', 'quantity']
+
+
+def export_value(value: Any) -> Any:
+    """Значение ячейки отчёта для выгрузки: str, int или None для пустых значений."""
+    import pandas  # type: ignore
+
+    if value is None or value is pandas.NaT:
+        return None
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, Ticker):
+        return value.symbol
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, pandas.Timestamp):
+        return value.date().isoformat()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _report_rows(report: 'pandas.DataFrame', fields: List[str], filter_years: List[int]) -> Iterator[Tuple]:
+    if filter_years:
+        report = report[report['tax_year'].isin(filter_years)]
+    columns = []
+    for field in fields:
+        if field == 'ticker_kind' and field not in report:
+            columns.append([x.kind for x in report['ticker']])
+        else:
+            columns.append(report[field].tolist())
+    for row in zip(*columns, strict=True):
+        yield tuple(export_value(x) for x in row)
+
+
+class ExportReportPresenter(ReportPresenter):
+    """Отчёты пишутся в output (по умолчанию stdout) или в файл dst_filepath с любым расширением."""
+
+    def __init__(
+        self,
+        verbose: bool = False,
+        dst_filepath: Optional[str] = None,
+        date_format: str = '%d.%m.%Y',
+        output: Optional[TextIO] = None,
+        pdf_chunk_rows: int = 1000,
+        rendered_years: Optional[Dict[int, List[str]]] = None,
+    ):
+        self._export_file = open(dst_filepath, 'w', encoding='utf-8', newline='') if output is None and dst_filepath is not None else None
+        super().__init__(verbose, date_format=date_format, output=output or self._export_file, pdf_chunk_rows=pdf_chunk_rows, rendered_years=rendered_years)
+
+    def prepare_report(
+        self,
+        trades: Optional['pandas.DataFrame'],
+        dividends: Optional['pandas.DataFrame'],
+        fees: Optional['pandas.DataFrame'],
+        interests: Optional['pandas.DataFrame'],
+        portfolio: List[PortfolioElement],
+        filter_years: List[int],
+    ):
+        reports = [('trades', trades, TRADES_FIELDS), ('dividends', dividends, DIVIDENDS_FIELDS), ('fees', fees, FEES_FIELDS), ('interests', interests, INTERESTS_FIELDS)]
+        for name, report, fields in reports:
+            if report is not None:
+                self._write_report(name, fields, _report_rows(report, fields, filter_years))
+
+        portfolio_rows = ((x.ticker.symbol, x.ticker.kind.name, str(x.quantity)) for x in portfolio)
+        self._write_report('portfolio', PORTFOLIO_FIELDS, portfolio_rows)
+
+    def present(self):
+        if self._export_file is not None:
+            self._export_file.close()
+        else:
+            self._output.flush()
+
+    @abstractmethod
+    def _write_report(self, name: str, fields: List[str], rows: Iterable[Tuple]):
+        pass
+
+
+class CsvReportPresenter(ExportReportPresenter):
+    """
+    Все отчёты в одном csv, как в отчётах Interactive Brokers: первый столбец - отчёт (Trades, Dividends, Fees, Interests, Portfolio),
+    второй - Header для строки с названиями полей или Data для строки с данными.
+
+    """
+
+    def _write_report(self, name: str, fields: List[str], rows: Iterable[Tuple]):
+        writer = csv.writer(self._output, lineterminator='\n')
+        section = name.capitalize()
+        writer.writerow([section, 'Header', *fields])
+        for row in rows:
+            writer.writerow([section, 'Data', *row])
+
+
+class JsonLinesReportPresenter(ExportReportPresenter):
+    """По одному json объекту на строку отчёта, поле report - название отчёта (trades, dividends, fees, interests, portfolio)."""
+
+    def _write_report(self, name: str, fields: List[str], rows: Iterable[Tuple]):
+        for row in rows:
+            self._output.write(json.dumps({'report': name, **dict(zip(fields, row, strict=True))}, ensure_ascii=False))
+            self._output.write('\n')
@@ -0,0 +1,55 @@
+"""
+HTML отчёта по шаблону templates/report.html.
+
+Шаблон целиком - отдельный документ для одной части pdf отчёта (год или кусок большой таблицы), по блокам
+head, section, tail - поток в html файл, разделы которого пишутся по мере подготовки.
+
+jinja2 и WeasyPrint импортируются только при выводе в html или pdf.
+
+"""
+
+import functools
+from typing import TYPE_CHECKING, Any, TextIO
+
+if TYPE_CHECKING:
+    import jinja2
+
+
+@functools.lru_cache(maxsize=None)
+def _template() -> 'jinja2.Template':
+    import jinja2
+
+    environment = jinja2.Environment(loader=jinja2.PackageLoader('investments.ibtax'), autoescape=True)
+    return environment.get_template('report.html')
+
+
+def render_document(section: str) -> str:
+    """Отдельный html документ из одного раздела отчёта (разметка раздела уже экранирована)."""
+    from markupsafe import Markup
+
+    return _template().render(section=Markup(section))
+
+
+def render_pdf_document(section: str) -> Any:
+    """Свёрстанный WeasyPrint документ (weasyprint.Document) из одного раздела отчёта."""
+    from weasyprint import HTML  # type: ignore
+
+    return HTML(string=render_document(section)).render()
+
+
+class HtmlStream:
+    def __init__(self, output: TextIO):
+        self._output = output
+        self._template = _template()
+        self._write_block('head')
+
+    def write_section(self, section: str):
+        from markupsafe import Markup
+
+        self._write_block('section', section=Markup(section))
+
+    def close(self):
+        self._write_block('tail')
+
+    def _write_block(self, name: str, **context):
+        self._output.writelines(self._template.blocks[name](self._template.new_context(context)))
@@ -1,31 +1,59 @@
 import argparse
+import contextlib
+import datetime
 import logging
 import os
 import sys
-from typing import Dict, Iterable, List, Type
+from collections import defaultdict
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from decimal import Decimal
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple, Type, TypeVar
 
-import pandas  # type: ignore
-
-from investments.calculators import compute_total_cost
 from investments.currency import Currency
 from investments.data_providers import cbr
+from investments.data_providers.http import default_http_client
+from investments.data_providers.rates import PreloadedRates, RatesProvider
 from investments.dividend import Dividend
 from investments.fees import Fee
-from investments.ibtax.report_presenter import NativeReportPresenter, ReportPresenter
+from investments.ibtax.conversion import amounts, append_rub_columns, currency_column, decimals, round_decimals, to_rub
+from investments.ibtax.export_presenter import CsvReportPresenter, JsonLinesReportPresenter
+from investments.ibtax.profiler import Profiler
+from investments.ibtax.report_presenter import NativeReportPresenter, ReportPresenter, display_mode
 from investments.interests import Interest
-from investments.money import Money
 from investments.report_parsers.ib import InteractiveBrokersReportParser
-from investments.trades_fifo import FinishedTrade, TradesAnalyzer
+from investments.reversals import cancel_dividend_reversals, cancel_fee_reversals
+from investments.trade import Trade
+from investments.trades_fifo import FinishedTrade, PortfolioElement, TradesAnalyzer
 
+if TYPE_CHECKING:
+    import numpy
+    import pandas  # type: ignore
 
-def apply_round_for_dataframe(source: pandas.DataFrame, columns: Iterable, digits: int = 2) -> pandas.DataFrame:
-    source[list(columns)] = source[list(columns)].applymap(
-        lambda x: x.round(digits=digits) if isinstance(x, Money) else round(x, digits),
-    )
-    return source
+R = TypeVar('R', bound=RatesProvider)
+
+
+def _total_cost(quantity: 'numpy.ndarray', price: 'numpy.ndarray', fee_per_piece: 'numpy.ndarray') -> 'numpy.ndarray':
+    """compute_total_cost для столбцов, порядок операций с Decimal тот же, поэтому и результат совпадает до знака."""
+    import numpy
+
+    abs_quantity = numpy.abs(quantity)
+    fee = numpy.abs(fee_per_piece) * abs_quantity
+    price_total = price * abs_quantity
+    return numpy.where(quantity > 0, (price_total + fee) * -1, price_total - fee)
+
+
+def select_tax_years(finished_trades: List[FinishedTrade], filter_years: Sequence[int]) -> List[FinishedTrade]:
+    """Закрытые сделки с налоговым годом (год последней поставки в группе N) из filter_years, пустой filter_years - все годы."""
+    if not filter_years:
+        return finished_trades
 
+    tax_years: Dict[int, int] = {}
+    for trade in finished_trades:
+        tax_years[trade.N] = max(tax_years.get(trade.N, trade.settle_date.year), trade.settle_date.year)
+    return [x for x in finished_trades if tax_years[x.N] in filter_years]
 
-def prepare_trades_report(finished_trades: List[FinishedTrade], cbr_client_usd: cbr.ExchangeRatesRUB) -> pandas.DataFrame:
+
+def prepare_trades_report(finished_trades: List[FinishedTrade], cbr_client_usd: RatesProvider) -> 'pandas.DataFrame':
     """
     Расчёт расхода/дохода и финансового результата по закрытым сделкам.
 
@@ -33,6 +61,9 @@ def prepare_trades_report(finished_trades: List[FinishedTrade], cbr_client_usd:
     [сумма сделки] * [курс валюты на дату поставки] +/- [сумма комиссии] * [курс валюты на дату сделки]
 
     """
+    import numpy
+    import pandas  # type: ignore
+
     trade_date_column = 'trade_date'
     tax_date_column = 'settle_date'
 
@@ -42,80 +73,130 @@ def prepare_trades_report(finished_trades: List[FinishedTrade], cbr_client_usd:
     df['date'] = df[trade_date_column].dt.date
     df[tax_date_column] = pandas.to_datetime(df[tax_date_column])
 
-    tax_years = df.groupby('N')[tax_date_column].max().map(lambda x: x.year).rename('tax_year')
+    tax_years = df.groupby('N')[tax_date_column].max().dt.year.rename('tax_year')
     df = df.join(tax_years, how='left', on='N')
 
-    df['price_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['price'], x[tax_date_column]), axis=1)
-    df['fee_per_piece_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['fee_per_piece'], x[trade_date_column]), axis=1)
-    df['fee'] = df.apply(lambda x: x['fee_per_piece'] * abs(x['quantity']), axis=1)
-
-    df['total'] = df.apply(
-        lambda x: compute_total_cost(x['quantity'], x['price'], x['fee_per_piece']),
-        axis=1,
-    )
-    df['total_rub'] = df.apply(
-        lambda x: compute_total_cost(x['quantity'], x['price_rub'], x['fee_per_piece_rub']),
-        axis=1,
-    )
-
-    df['settle_rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['price'].currency, x[tax_date_column]), axis=1)
-    df['fee_rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['fee_per_piece'].currency, x[trade_date_column]), axis=1)
+    currencies = [x.price.currency for x in finished_trades]
+    assert all(x.fee_per_piece.currency is currency for x, currency in zip(finished_trades, currencies, strict=True))
+
+    quantity = numpy.array([x.quantity for x in finished_trades], dtype=object)
+    price = amounts(x.price for x in finished_trades)
+    fee_per_piece = amounts(x.fee_per_piece for x in finished_trades)
+    df['price'] = price
+    df['fee_per_piece'] = fee_per_piece
+    df['currency'] = currency_column(currencies)
+    df['ticker_kind'] = [x.ticker.kind for x in finished_trades]
+    df['side'] = numpy.where(quantity > 0, 'expenses', 'income')
+
+    settle_rate = amounts(cbr_client_usd.get_rates(currencies, df[tax_date_column].dt.date.tolist()))
+    fee_rate = amounts(cbr_client_usd.get_rates(currencies, df['date'].tolist()))
+    price_rub = to_rub(price, currencies, settle_rate)
+    fee_per_piece_rub = to_rub(fee_per_piece, currencies, fee_rate)
+
+    df['price_rub'] = price_rub
+    df['fee_per_piece_rub'] = fee_per_piece_rub
+    df['fee'] = fee_per_piece * numpy.abs(quantity)
+    df['total'] = _total_cost(quantity, price, fee_per_piece)
+    df['total_rub'] = _total_cost(quantity, price_rub, fee_per_piece_rub)
+    df['settle_rate'] = settle_rate
+    df['fee_rate'] = fee_rate
     df['profit_rub'] = df['total_rub']
 
     profit = df.groupby('N')['profit_rub'].sum().reset_index().set_index('N')
     df = df.join(profit, how='left', on='N', lsuffix='_delete')
     df.drop(columns=['profit_rub_delete'], axis=0, inplace=True)
-    df.loc[~df.index.isin(df.groupby('N')[trade_date_column].idxmax()), 'profit_rub'] = Money(0, Currency.RUB)
+    df.loc[~df.index.isin(df.groupby('N')[trade_date_column].idxmax()), 'profit_rub'] = Decimal(0)
 
     return df
 
 
-def prepare_dividends_report(dividends: List[Dividend], cbr_client_usd: cbr.ExchangeRatesRUB, verbose: bool) -> pandas.DataFrame:
+def _tax_rate(amount: 'numpy.ndarray', tax_paid: 'numpy.ndarray') -> 'numpy.ndarray':
+    """Процент удержанного налога, для нулевых сумм (отменённые выплаты) не определён."""
+    import numpy
+
+    tax_rate = numpy.full(len(amount), None, dtype=object)
+    nonzero = amount != 0
+    tax_rate[nonzero] = round_decimals(tax_paid[nonzero] * 100 / amount[nonzero], 2)
+    return tax_rate
+
+
+def _in_years(day: datetime.date, filter_years: Sequence[int]) -> bool:
+    return not filter_years or day.year in filter_years
+
+
+def prepare_dividends_report(dividends: List[Dividend], cbr_client_usd: RatesProvider, verbose: bool, filter_years: Sequence[int] = ()) -> 'pandas.DataFrame':
+    """filter_years - в отчёт попадают (и пересчитываются в рубли) только выплаты этих лет, нумерация N сквозная по всем годам."""
+    import pandas  # type: ignore
+
     operation_date_column = 'date'
     if not verbose:
-        dividends = [x for x in dividends if x.amount.amount != 0 or x.tax.amount != 0]  # remove reversed dividends
+        dividends = cancel_dividend_reversals(dividends)
 
-    df_data = [(i + 1, x.ticker, pandas.to_datetime(x.date), x.amount, x.tax) for i, x in enumerate(dividends)]
-    df = pandas.DataFrame(df_data, columns=['N', 'ticker', 'date', 'amount', 'tax_paid'])
+    assert all(x.tax.currency is x.amount.currency for x in dividends)
+    numbered = [(i + 1, x) for i, x in enumerate(dividends) if _in_years(x.date, filter_years)]
+    dividends = [x for _, x in numbered]
+    df_data = [(n, x.ticker, x.date, x.amount.amount, x.tax.amount) for n, x in numbered]
+    df = pandas.DataFrame(df_data, columns=['N', 'ticker', operation_date_column, 'amount', 'tax_paid'])
+    df[operation_date_column] = pandas.to_datetime(df[operation_date_column])
+    df['currency'] = currency_column(x.amount.currency for x in dividends)
 
-    df['tax_year'] = df[operation_date_column].map(lambda x: x.year)
-    df['rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['amount'].currency, x[operation_date_column]), axis=1)
-    df['amount_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['amount'], x[operation_date_column]), axis=1)
-    df['tax_paid_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['tax_paid'], x[operation_date_column]), axis=1)
-    df['tax_rate'] = df.apply(lambda x: round(x['tax_paid'].amount * 100 / x['amount'].amount, 2), axis=1)
+    df['tax_year'] = df[operation_date_column].dt.year
+    append_rub_columns(df, cbr_client_usd, ['amount', 'tax_paid'], operation_date_column)
+    df['tax_rate'] = _tax_rate(decimals(df['amount']), decimals(df['tax_paid']))
 
     return df
 
 
-def prepare_fees_report(fees: List[Fee], cbr_client_usd: cbr.ExchangeRatesRUB, verbose: bool) -> pandas.DataFrame:
-    operation_date_column = 'date'
-    df_data = [(i + 1, pandas.to_datetime(x.date), x.amount, x.description, x.date.year) for i, x in enumerate(fees)]
-    df = pandas.DataFrame(df_data, columns=['N', operation_date_column, 'amount', 'description', 'tax_year'])
-    df['rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['amount'].currency, x[operation_date_column]), axis=1)
-    df['amount_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['amount'], x[operation_date_column]), axis=1)
+def prepare_fees_report(fees: List[Fee], cbr_client_usd: RatesProvider, verbose: bool, filter_years: Sequence[int] = ()) -> 'pandas.DataFrame':
+    import pandas  # type: ignore
 
+    operation_date_column = 'date'
     if not verbose:
-        df['abs_amount_del'] = df.apply(lambda x: abs(x.amount.amount), axis=1)
-        df['currency_del'] = df.apply(lambda x: x.amount.currency, axis=1)
-        df['sign_del'] = df.apply(lambda x: 1 if x.amount.amount > 0 else -1 if x.amount.amount < 0 else 0, axis=1)
-        reversal_key = [operation_date_column, 'description', 'currency_del', 'abs_amount_del']
-        df['reversal_number_del'] = df.groupby([*reversal_key, 'sign_del']).cumcount()
-        df.drop_duplicates(subset=[*reversal_key, 'reversal_number_del'], keep=False, inplace=True)
-        df.drop(columns=['abs_amount_del', 'currency_del', 'sign_del', 'reversal_number_del'], inplace=True)
-        df['N'] = range(1, len(df) + 1)
+        fees = cancel_fee_reversals(fees)
 
+    numbered = [(i + 1, x) for i, x in enumerate(fees) if _in_years(x.date, filter_years)]
+    fees = [x for _, x in numbered]
+    df_data = [(n, x.date, x.amount.amount, x.description, x.date.year) for n, x in numbered]
+    df = pandas.DataFrame(df_data, columns=['N', operation_date_column, 'amount', 'description', 'tax_year'])
+    df[operation_date_column] = pandas.to_datetime(df[operation_date_column])
+    df['currency'] = currency_column(x.amount.currency for x in fees)
+    append_rub_columns(df, cbr_client_usd, ['amount'], operation_date_column)
     return df
 
 
-def prepare_interests_report(interests: List[Interest], cbr_client_usd: cbr.ExchangeRatesRUB) -> pandas.DataFrame:
+def prepare_interests_report(interests: List[Interest], cbr_client_usd: RatesProvider, filter_years: Sequence[int] = ()) -> 'pandas.DataFrame':
+    import pandas  # type: ignore
+
     operation_date_column = 'date'
-    df_data = [(i + 1, pandas.to_datetime(x.date), x.amount, x.description, x.date.year) for i, x in enumerate(interests)]
+    numbered = [(i + 1, x) for i, x in enumerate(interests) if _in_years(x.date, filter_years)]
+    interests = [x for _, x in numbered]
+    df_data = [(n, x.date, x.amount.amount, x.description, x.date.year) for n, x in numbered]
     df = pandas.DataFrame(df_data, columns=['N', operation_date_column, 'amount', 'description', 'tax_year'])
-    df['rate'] = df.apply(lambda x: cbr_client_usd.get_rate(x['amount'].currency, x[operation_date_column]), axis=1)
-    df['amount_rub'] = df.apply(lambda x: cbr_client_usd.convert_to_rub(x['amount'], x[operation_date_column]), axis=1)
+    df[operation_date_column] = pandas.to_datetime(df[operation_date_column])
+    df['currency'] = currency_column(x.amount.currency for x in interests)
+    append_rub_columns(df, cbr_client_usd, ['amount'], operation_date_column)
     return df
 
 
+def required_rates(finished_trades: List[FinishedTrade], dividends: List[Dividend], fees: List[Fee], interests: List[Interest], filter_years: Sequence[int] = ()) -> Dict[Currency, Set[datetime.date]]:
+    """Даты, на которые понадобятся курсы валют при подготовке отчётов за filter_years (см. prepare_*_report)."""
+    required: Dict[Currency, Set[datetime.date]] = defaultdict(set)
+    for trade in select_tax_years(finished_trades, filter_years):
+        required[trade.price.currency].add(trade.settle_date)
+        required[trade.fee_per_piece.currency].add(trade.trade_date.date())
+    for dividend in dividends:
+        if _in_years(dividend.date, filter_years):
+            required[dividend.amount.currency].add(dividend.date)
+    for fee in fees:
+        if _in_years(fee.date, filter_years):
+            required[fee.amount.currency].add(fee.date)
+    for interest in interests:
+        if _in_years(interest.date, filter_years):
+            required[interest.amount.currency].add(interest.date)
+    required.pop(Currency.RUB, None)
+    return required
+
+
 def csvs_in_dir(directory: str):
     ret = []
     for filename in os.scandir(directory):
@@ -148,62 +229,325 @@ def parse_reports(activity_reports_dir: str, confirmation_reports_dir: str) -> I
     return parser_object
 
 
+REPORT_TYPES: Dict[str, Type[ReportPresenter]] = {
+    'native': NativeReportPresenter,
+    'csv': CsvReportPresenter,
+    'jsonl': JsonLinesReportPresenter,
+}
+
+
+class AccountOperations(NamedTuple):
+    """Операции счёта для отчёта: закрытые сделки выбранных лет (FIFO по всей истории), портфель, дивиденды, комиссии и проценты."""
+
+    finished_trades: List[FinishedTrade]
+    portfolio: List[PortfolioElement]
+    dividends: List[Dividend]
+    fees: List[Fee]
+    interests: List[Interest]
+    first_year: int
+
+
+def analyze_reports(activity_reports_dir: str, confirmation_reports_dir: str, filter_years: Sequence[int], profiler: Profiler) -> Optional[AccountOperations]:
+    """Разбор отчётов и FIFO, None - в отчётах нет сделок."""
+    with profiler.stage('parse'):
+        parser_object = parse_reports(activity_reports_dir, confirmation_reports_dir)
+    return analyze_trades(parser_object, filter_years, profiler)
+
+
+def operations_first_year(trades: List[Trade], dividends: List[Dividend]) -> int:
+    # fixme(?) first_year without dividends
+    return min(trades[0].trade_date.year, dividends[0].date.year) if dividends else trades[0].trade_date.year
+
+
+def analyze_trades(parser_object: InteractiveBrokersReportParser, filter_years: Sequence[int], profiler: Profiler) -> Optional[AccountOperations]:
+    """FIFO по разобранным отчётам, None - в отчётах нет сделок."""
+    trades = parser_object.trades
+    dividends = parser_object.dividends
+    fees = parser_object.fees
+    interests = parser_object.interests
+    profiler.add_rows('parse', len(trades) + len(dividends) + len(fees) + len(interests))
+
+    if not trades:
+        logging.error('no trades found')
+        return None
+
+    first_year = operations_first_year(trades, dividends)
+
+    # FIFO по всей истории, в рубли пересчитываются только операции выбранных лет
+    with profiler.stage('fifo'):
+        analyzer = TradesAnalyzer(trades)
+        finished_trades = select_tax_years(analyzer.finished_trades, filter_years)
+        profiler.add_rows('fifo', len(analyzer.finished_trades))
+
+    return AccountOperations(finished_trades, analyzer.final_portfolio, dividends, fees, interests, first_year)
+
+
+class PreparedReports(NamedTuple):
+    """Отчёты в рублях, готовые к выводу (None - операций такого вида нет), и портфель."""
+
+    trades: Optional['pandas.DataFrame']
+    dividends: Optional['pandas.DataFrame']
+    fees: Optional['pandas.DataFrame']
+    interests: Optional['pandas.DataFrame']
+    portfolio: List[PortfolioElement]
+
+
+def present_reports(operations: AccountOperations, cbr_client_usd: RatesProvider, presenter: ReportPresenter, filter_years: Sequence[int], verbose: bool, profiler: Profiler):
+    """Пересчёт операций выбранных лет в рубли и вывод отчёта."""
+    present_prepared_reports(prepare_reports(operations, cbr_client_usd, filter_years, verbose, profiler), presenter, filter_years, profiler)
+
+
+def prepare_reports(operations: AccountOperations, cbr_client_usd: RatesProvider, filter_years: Sequence[int], verbose: bool, profiler: Profiler, workers: int = 1) -> PreparedReports:
+    """
+    Пересчёт операций выбранных лет в рубли. Курсы загружаются заранее, затем отчёты по сделкам, дивидендам, комиссиям
+    и процентам готовятся независимо друг от друга в workers потоках (1 - по очереди в текущем потоке).
+
+    """
+    finished_trades, portfolio, dividends, fees, interests, _ = operations
+    rates = _preload_rates('rates prefetch', cbr_client_usd, required_rates(finished_trades, dividends, fees, interests, filter_years), profiler)
+    sections = [*_operations_sections(dividends, fees, interests, rates, filter_years, verbose), _trades_section(finished_trades, rates)]
+    with ThreadPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext() as executor:
+        dividends_report, fees_report, interests_report, trades_report = [x.result() for x in _start_sections(executor, sections, profiler)]
+    return PreparedReports(trades_report, dividends_report, fees_report, interests_report, portfolio)
+
+
+def analyze_and_prepare_reports(
+    activity_reports_dir: str,
+    confirmation_reports_dir: str,
+    rates_provider: Callable[[int], R],
+    filter_years: Sequence[int],
+    verbose: bool,
+    profiler: Profiler,
+    workers: int = 1,
+) -> Optional[Tuple[PreparedReports, R]]:
+    """
+    То же, что analyze_reports и prepare_reports, но этапы перекрываются. Сразу после разбора создаётся провайдер курсов
+    rates_provider(первый год операций), и в пуле из workers потоков загружаются курсы и готовятся отчёты по дивидендам,
+    комиссиям и процентам, а в текущем потоке одновременно считается FIFO, затем загружаются курсы и готовится отчёт
+    по сделкам. None - в отчётах нет сделок.
+
+    """
+    with profiler.stage('parse'):
+        parser_object = parse_reports(activity_reports_dir, confirmation_reports_dir)
+    trades, dividends, fees, interests = parser_object.trades, parser_object.dividends, parser_object.fees, parser_object.interests
+    profiler.add_rows('parse', len(trades) + len(dividends) + len(fees) + len(interests))
+
+    if not trades:
+        logging.error('no trades found')
+        return None
+
+    cbr_client_usd = rates_provider(operations_first_year(trades, dividends))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # задача только ставит секции в очередь того же пула и не ждёт их: с одним потоком они выполнятся после неё
+        operations_sections = executor.submit(_start_operations_sections, executor, dividends, fees, interests, cbr_client_usd, filter_years, verbose, profiler)
+
+        with profiler.stage('fifo'):
+            analyzer = TradesAnalyzer(trades)
+            finished_trades = select_tax_years(analyzer.finished_trades, filter_years)
+            profiler.add_rows('fifo', len(analyzer.finished_trades))
+
+        rates = _preload_rates('prefetch trades', cbr_client_usd, required_rates(finished_trades, [], [], [], filter_years), profiler)
+        trades_report = _prepare_section(_trades_section(finished_trades, rates), profiler)
+        dividends_report, fees_report, interests_report = [x.result() for x in operations_sections.result()]
+
+    return PreparedReports(trades_report, dividends_report, fees_report, interests_report, analyzer.final_portfolio), cbr_client_usd
+
+
+# секция отчёта: имя этапа и подготовка её таблицы (None - операций такого вида нет)
+Section = Tuple[str, Callable[[], Optional['pandas.DataFrame']]]
+
+
+def _preload_rates(stage: str, cbr_client_usd: RatesProvider, required: Dict[Currency, Set[datetime.date]], profiler: Profiler) -> PreloadedRates:
+    with profiler.stage(stage):
+        rates = PreloadedRates(cbr_client_usd, required)
+        profiler.add_rows(stage, sum(len(x) for x in required.values()))
+    return rates
+
+
+def _operations_sections(dividends: List[Dividend], fees: List[Fee], interests: List[Interest], rates: RatesProvider, filter_years: Sequence[int], verbose: bool) -> List[Section]:
+    return [
+        ('prepare dividends', lambda: prepare_dividends_report(dividends, rates, verbose, filter_years) if dividends else None),
+        ('prepare fees', lambda: prepare_fees_report(fees, rates, verbose, filter_years) if fees else None),
+        ('prepare interests', lambda: prepare_interests_report(interests, rates, filter_years) if interests else None),
+    ]
+
+
+def _trades_section(finished_trades: List[FinishedTrade], rates: RatesProvider) -> Section:
+    return 'prepare trades', lambda: prepare_trades_report(finished_trades, rates) if finished_trades else None
+
+
+def _prepare_section(section: Section, profiler: Profiler) -> Optional['pandas.DataFrame']:
+    name, prepare = section
+    with profiler.stage(name):
+        report = prepare()
+        profiler.add_rows(name, len(report) if report is not None else 0)
+    return report
+
+
+def _start_sections(executor: Optional[Executor], sections: List[Section], profiler: Profiler) -> List[Future]:
+    """Секции в пул, без пула (executor None) - сразу в текущем потоке."""
+    if executor is not None:
+        return [executor.submit(_prepare_section, x, profiler) for x in sections]
+
+    futures = []
+    for section in sections:
+        future: Future = Future()
+        future.set_result(_prepare_section(section, profiler))
+        futures.append(future)
+    return futures
+
+
+def _start_operations_sections(
+    executor: Executor, dividends: List[Dividend], fees: List[Fee], interests: List[Interest], cbr_client_usd: RatesProvider, filter_years: Sequence[int], verbose: bool, profiler: Profiler
+) -> List[Future]:
+    rates = _preload_rates('rates prefetch', cbr_client_usd, required_rates([], dividends, fees, interests, filter_years), profiler)
+    return _start_sections(executor, _operations_sections(dividends, fees, interests, rates, filter_years, verbose), profiler)
+
+
+def present_prepared_reports(reports: PreparedReports, presenter: ReportPresenter, filter_years: Sequence[int], profiler: Profiler):
+    with profiler.stage('present'):
+        presenter.prepare_report(reports.trades, reports.dividends, reports.fees, reports.interests, reports.portfolio, list(filter_years))
+        presenter.present()
+        profiler.add_rows('present', sum(len(x) for x in reports[:4] if x is not None) + len(reports.portfolio))
+
+
 def main() -> None:
     sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
 
-    available_report_types: Dict[str, Type[ReportPresenter]] = {
-        'native': NativeReportPresenter,
-    }
-
     parser = argparse.ArgumentParser()
-    parser.add_argument('--activity-reports-dir', type=str, required=True, help='directory with InteractiveBrokers .csv activity reports')
-    parser.add_argument('--confirmation-reports-dir', type=str, required=True, help='directory with InteractiveBrokers .csv confirmation reports')
-    parser.add_argument('--cache-dir', type=str, default='.', help='directory for caching (CBR RUB exchange rates)')
+    parser.add_argument('--activity-reports-dir', type=str, default=None, help='directory with InteractiveBrokers .csv activity reports')
+    parser.add_argument('--confirmation-reports-dir', type=str, default=None, help='directory with InteractiveBrokers .csv confirmation reports')
+    parser.add_argument('--cache-dir', type=str, default=None, help='directory for caching (CBR RUB exchange rates) [current directory by default]')
     parser.add_argument('--years', type=lambda x: [int(v.strip()) for v in x.split(',')], default=[], help='comma separated years for final report, omit for all')
     parser.add_argument('--verbose', nargs='?', default=False, const=True, help='do not "prune" reversed dividends, show dividends tax percent, disable rounding & etc.')
     parser.add_argument('--quiet', nargs='?', default=False, const=True, help='suppress non-error messages')
-    parser.add_argument('--report-type', type=str, default='native', choices=available_report_types.keys(), help='report type [native by default]')
-    parser.add_argument('--save-to', type=str, default=None, help='filepath for save report')
+    parser.add_argument('--report-type', type=str, default='native', choices=REPORT_TYPES.keys(), help='report type [native by default]')
+    parser.add_argument('--save-to', type=str, default=None, help='filepath for save report: .pdf, .html or plain text for any other extension')
+    parser.add_argument('--pdf-chunk-rows', type=int, default=1000, help='max table rows laid out in one pdf document, larger tables are split')
+    parser.add_argument('--import-rates', type=str, default=None, help='import exchange rates bundle (.csv or .json) into cache, imported rates never expire')
+    parser.add_argument('--export-rates', type=str, default=None, help='export all cached exchange rates to .csv or .json bundle')
+    parser.add_argument('--offline', nargs='?', default=False, const=True, help='use only imported exchange rates, never request cbr.ru')
+    parser.add_argument('--profile', nargs='?', default=False, const=True, help='print time, rows and memory per stage to stderr or save them to the given .json file')
+    parser.add_argument('--profile-memory', nargs='?', default=False, const=True, help='trace allocations (tracemalloc) per stage: top allocation sites and object counts, implies --profile')
+    parser.add_argument('--watch', nargs='?', default=False, const=True, help='keep running and update the report after every change of reports in the directories')
+    parser.add_argument(
+        '--memo', nargs='?', default=False, const=True, help='save results (reports in RUB and the rendered report) to --cache-dir and reuse them for the same reports, rates and options'
+    )
+    parser.add_argument('--workers', type=int, default=1, help='threads preparing report sections (trades, dividends, fees, interests), 1 - one by one')
+    parser.add_argument('--watch-interval', type=float, default=1.0, help='seconds between checks of the directories in --watch mode')
 
     args = parser.parse_args()
+    if args.memo and args.cache_dir is None:
+        parser.error('--memo stores tax reports, it requires an explicit --cache-dir')
+    if args.cache_dir is None:
+        args.cache_dir = '.'
+
+    rates_only = args.activity_reports_dir is None and args.confirmation_reports_dir is None and (args.import_rates or args.export_rates)
+    if not rates_only and (args.activity_reports_dir is None or args.confirmation_reports_dir is None):
+        parser.error('the following arguments are required: --activity-reports-dir, --confirmation-reports-dir')
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
     elif args.quiet:
         logging.basicConfig(level=logging.ERROR)
 
+    if args.import_rates:
+        cbr.ExchangeRatesRUB(cache_dir=args.cache_dir, offline=True).import_rates(args.import_rates)
+
+    if rates_only:
+        if args.export_rates:
+            cbr.ExchangeRatesRUB(cache_dir=args.cache_dir, offline=True).export_rates(args.export_rates)
+        return
+
     if os.path.abspath(args.activity_reports_dir) == os.path.abspath(args.confirmation_reports_dir):
         logging.error('--activity-reports-dir and --confirmation-reports-dir MUST be different directories')
         return
 
-    parser_object = parse_reports(args.activity_reports_dir, args.confirmation_reports_dir)
-
-    trades = parser_object.trades
-    dividends = parser_object.dividends
-    fees = parser_object.fees
-    interests = parser_object.interests
-
-    if not trades:
-        logging.error('no trades found')
+    if args.watch:
+        from investments.ibtax.watch import ReportWatcher
+
+        watcher = ReportWatcher(
+            args.activity_reports_dir,
+            args.confirmation_reports_dir,
+            args.cache_dir,
+            offline=args.offline,
+            filter_years=args.years,
+            verbose=args.verbose,
+            report_type=args.report_type,
+            dst_filepath=args.save_to,
+            pdf_chunk_rows=args.pdf_chunk_rows,
+        )
+        try:
+            watcher.run(args.watch_interval, status=None if args.quiet else sys.stderr)
+        except KeyboardInterrupt:
+            pass
         return
 
-    # fixme(?) first_year without dividends
-    first_year = min(trades[0].trade_date.year, dividends[0].date.year) if dividends else trades[0].trade_date.year
-    cbr_client_usd = cbr.ExchangeRatesRUB(year_from=first_year, cache_dir=args.cache_dir)
-
-    dividends_report = prepare_dividends_report(dividends, cbr_client_usd, args.verbose) if dividends else None
-    fees_report = prepare_fees_report(fees, cbr_client_usd, args.verbose) if fees else None
-    interests_report = prepare_interests_report(interests, cbr_client_usd) if interests else None
-
-    analyzer = TradesAnalyzer(trades)
-    finished_trades = analyzer.finished_trades
-    portfolio = analyzer.final_portfolio
-
-    trades_report = prepare_trades_report(finished_trades, cbr_client_usd) if finished_trades else None
-
-    presenter = available_report_types[args.report_type](args.verbose, args.save_to)
-    presenter.prepare_report(trades_report, dividends_report, fees_report, interests_report, portfolio, args.years)
-    presenter.present()
+    profiler = Profiler(enabled=bool(args.profile or args.profile_memory), memory=bool(args.profile_memory))
+
+    memo = None
+    output = None
+    if args.memo:
+        from investments.ibtax.memo import ReportMemo
+
+        with profiler.stage('memo lookup'):
+            memo = ReportMemo(
+                args.cache_dir,
+                csvs_in_dir(args.activity_reports_dir),
+                csvs_in_dir(args.confirmation_reports_dir),
+                report_options=[args.years, bool(args.verbose)],
+                output_options=[args.report_type, display_mode(args.save_to).value, args.pdf_chunk_rows],
+            )
+            output = memo.get_output()
+
+    cbr_client_usd = None
+    if output is not None:
+        assert memo is not None
+        memo.write_output(output, args.save_to)
+    else:
+        reports = memo.get_reports() if memo is not None else None
+        memo_reports = reports is not None
+        if reports is None:
+
+            def rates_provider(year_from: int) -> cbr.ExchangeRatesRUB:
+                return cbr.ExchangeRatesRUB(year_from=year_from, cache_dir=args.cache_dir, offline=args.offline)
+
+            if args.profile_memory:
+                # снимки памяти по этапам имеют смысл, только если этапы идут по очереди
+                operations = analyze_reports(args.activity_reports_dir, args.confirmation_reports_dir, args.years, profiler)
+                if operations is None:
+                    return
+                cbr_client_usd = rates_provider(operations.first_year)
+                reports = prepare_reports(operations, cbr_client_usd, args.years, args.verbose, profiler)
+            else:
+                prepared = analyze_and_prepare_reports(args.activity_reports_dir, args.confirmation_reports_dir, rates_provider, args.years, args.verbose, profiler, args.workers)
+                if prepared is None:
+                    return
+                reports, cbr_client_usd = prepared
+
+        output_stream = memo.output_stream(args.save_to) if memo is not None else None
+        presenter = REPORT_TYPES[args.report_type](args.verbose, args.save_to, pdf_chunk_rows=args.pdf_chunk_rows, output=output_stream)
+        present_prepared_reports(reports, presenter, args.years, profiler)
+
+        # отчёт по курсам, которые ещё могут измениться (cbr.ru недоступен или курс на дату ещё не установлен), не сохраняется
+        if memo is not None and (cbr_client_usd is None or not (cbr_client_usd.used_stale_rates or cbr_client_usd.used_unpublished_rates)):
+            with profiler.stage('memo save'):
+                memo.put(None if memo_reports else reports, args.save_to)
+
+    if cbr_client_usd is None:
+        # отчёт из кеша результатов, курсы для него не запрашивались
+        cbr_client_usd = cbr.ExchangeRatesRUB(cache_dir=args.cache_dir, offline=args.offline)
+    logging.info(f'exchange rates layers {cbr_client_usd.stats()}')
+
+    if args.export_rates:
+        cbr_client_usd.export_rates(args.export_rates)
+
+    if profiler.enabled:
+        profiler.collect(cbr_client_usd.stats(), default_http_client())
+        if isinstance(args.profile, str):
+            profiler.write_json(args.profile)
+        else:
+            profiler.write_summary(sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,187 @@
+"""
+Кеш результатов ibtax целиком, включается --memo (только вместе с явно заданным --cache-dir).
+
+Ключ - хеши содержимого всех csv отчётов, версия курсов в --cache-dir (cbr.rates_data_version), параметры
+запуска и версия кода (размеры и время изменения файлов пакета investments, версии python и pandas). Хранятся:
+
+- отчёты в рублях (PreparedReports) по отчётам, курсам, --years и --verbose: запуск, который меняет только вид
+  отчёта (--report-type, расширение --save-to, --pdf-chunk-rows), не разбирает отчёты, не считает FIFO
+  и не пересчитывает суммы в рубли;
+- готовый вывод (текст, html, pdf, csv или jsonl) по тем же данным и параметрам вывода: такой же запуск только
+  копирует его в --save-to или stdout.
+
+Результаты, для которых понадобились курсы на даты позже дня запуска (ЦБ их ещё не установил, взят последний
+установленный курс) или последний известный курс при недоступном cbr.ru, не сохраняются: ключ не изменится,
+когда ЦБ опубликует настоящий курс.
+
+Записи лежат в <cache-dir>/ibtax-memo, самые старые удаляются, когда записей больше max_entries. Отчёты в рублях
+сохраняются через pickle, поэтому запись читается, только если файл принадлежит текущему пользователю и другие
+не могут его изменить: в отличие от кеша курсов этот каталог нельзя делать общим для нескольких пользователей.
+
+"""
+
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import platform
+import stat
+import sys
+import tempfile
+from typing import Any, List, Optional, Sequence, TextIO
+
+import pandas  # type: ignore
+
+import investments
+from investments.data_providers.cbr import rates_data_version
+from investments.ibtax.ibtax import PreparedReports
+
+MEMO_DIR = 'ibtax-memo'
+
+
+def files_fingerprint(filepaths: Sequence[str]) -> str:
+    """Хеш имён и содержимого файлов в заданном порядке."""
+    digest = hashlib.sha256()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        digest.update(f'{os.path.basename(filepath)}:{len(content)}:'.encode())
+        digest.update(content)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """Версия кода для ключей кеша: после изменения или обновления пакета старые записи не используются."""
+    package_dir = os.path.dirname(os.path.abspath(investments.__file__))
+    digest = hashlib.sha256(f'{platform.python_version()}:{pandas.__version__}'.encode())
+    for root, dirs, files in os.walk(package_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(('.py', '.html', '.css')):
+                filestat = os.stat(os.path.join(root, filename))
+                digest.update(f'{os.path.relpath(os.path.join(root, filename), package_dir)}:{filestat.st_size}:{filestat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def _key(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class _StdoutCopy(io.StringIO):
+    """Вывод в stream с копией в памяти."""
+
+    def __init__(self, stream: TextIO):
+        super().__init__()
+        self._stream = stream
+
+    def write(self, s: str) -> int:
+        self._stream.write(s)
+        return super().write(s)
+
+    def flush(self):
+        self._stream.flush()
+
+
+class ReportMemo:
+    def __init__(self, cache_dir: str, activity_reports: List[str], confirmation_reports: List[str], report_options: Sequence, output_options: Sequence, max_entries: int = 64):
+        """report_options - параметры, от которых зависят отчёты в рублях, output_options - параметры только вывода."""
+        self._memo_dir = os.path.join(cache_dir, MEMO_DIR)
+        self._cache_dir = cache_dir
+        self._max_entries = max_entries
+        self._inputs = [code_version(), files_fingerprint(activity_reports), files_fingerprint(confirmation_reports), list(report_options)]
+        self._output_options = list(output_options)
+        self._rates_version = rates_data_version(cache_dir)
+        self._stdout_copy: Optional[_StdoutCopy] = None
+
+    def _keys(self, rates_version: Optional[str]):
+        reports_key = _key('reports', *self._inputs, rates_version)
+        return reports_key, _key('output', reports_key, *self._output_options)
+
+    def get_output(self) -> Optional[bytes]:
+        """Готовый вывод такого же запуска."""
+        return self._read(f'{self._keys(self._rates_version)[1]}.out')
+
+    def get_reports(self) -> Optional[PreparedReports]:
+        """Отчёты в рублях запуска с теми же отчётами, курсами и параметрами."""
+        data = self._read(f'{self._keys(self._rates_version)[0]}.pickle')
+        if data is None:
+            return None
+        try:
+            reports = pickle.loads(data)
+        except Exception as ex:
+            logging.warning(f'ignore broken memo entry: {ex}')
+            return None
+        return reports if isinstance(reports, PreparedReports) else None
+
+    def output_stream(self, dst_filepath: Optional[str]) -> Optional[TextIO]:
+        """Поток для вывода отчёта в stdout с копией для кеша, None - отчёт пишется в dst_filepath."""
+        if dst_filepath is not None:
+            return None
+        self._stdout_copy = _StdoutCopy(sys.stdout)
+        return self._stdout_copy
+
+    def put(self, reports: Optional[PreparedReports], dst_filepath: Optional[str]):
+        """
+        Сохранение отчётов в рублях (None - они уже взяты из кеша) и вывода из dst_filepath или output_stream().
+
+        Ключ - версия курсов после запуска: загруженные в этот раз курсы уже в кеше и следующий запуск их не изменит.
+
+        """
+        reports_key, output_key = self._keys(rates_data_version(self._cache_dir))
+        if reports is not None:
+            # PreparedReports из investments.ibtax.ibtax, даже если ibtax запущен как __main__
+            self._write(f'{reports_key}.pickle', pickle.dumps(PreparedReports(*reports), protocol=pickle.HIGHEST_PROTOCOL))
+
+        if self._stdout_copy is not None:
+            output = self._stdout_copy.getvalue().encode('utf-8')
+        else:
+            assert dst_filepath is not None
+            with open(dst_filepath, 'rb') as f:
+                output = f.read()
+        self._write(f'{output_key}.out', output)
+        self._evict()
+
+    @staticmethod
+    def write_output(output: bytes, dst_filepath: Optional[str]):
+        if dst_filepath is None:
+            sys.stdout.write(output.decode('utf-8'))
+            sys.stdout.flush()
+            return
+        with open(dst_filepath, 'wb') as f:
+            f.write(output)
+
+    def _read(self, filename: str) -> Optional[bytes]:
+        filepath = os.path.join(self._memo_dir, filename)
+        try:
+            with open(filepath, 'rb') as f:
+                filestat = os.fstat(f.fileno())
+                if hasattr(os, 'getuid') and (filestat.st_uid != os.getuid() or filestat.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+                    logging.warning(f'ignore memo entry {filepath}: it is writable by other users')
+                    return None
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # запись использована - удаляется последней
+        os.utime(filepath)
+        return data
+
+    def _write(self, filename: str, data: bytes):
+        os.makedirs(self._memo_dir, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._memo_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self._memo_dir, filename))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _evict(self):
+        entries = [x for x in os.scandir(self._memo_dir) if x.is_file() and not x.name.endswith('.tmp')]
+        entries.sort(key=lambda x: x.stat().st_mtime_ns, reverse=True)
+        for entry in entries[self._max_entries :]:
+            os.unlink(entry.path)
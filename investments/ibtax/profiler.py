@@ -0,0 +1,218 @@
+"""
+Замеры этапов ibtax (--profile): время (wall и CPU), количество обработанных строк, попадания в кеши курсов,
+запросы к cbr.ru и пиковая память процесса.
+
+Выключенный профайлер ничего не замеряет: stage() возвращает общий пустой контекст.
+
+Этапы могут идти одновременно в разных потоках (analyze_and_prepare_reports): их время пересекается, а CPU
+считается по всему процессу. Поэтому итог (total) - не сумма этапов, а время от создания профайлера до collect().
+
+Режим памяти (memory=True, --profile-memory) в конце каждого этапа снимает tracemalloc snapshot: память,
+выделенная Python объектами, пик за этап, места с наибольшим приростом памяти относительно предыдущего этапа
+и количество объектов Money, Trade, FinishedTrade и DataFrame (с размером данных таблиц). tracemalloc
+замедляет работу в несколько раз, время этапов в этом режиме не показательно.
+
+"""
+
+import contextlib
+import gc
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, ContextManager, Dict, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from investments.data_providers.http import HttpClient
+from investments.data_providers.rates import LayerStats
+
+_DISABLED = contextlib.nullcontext()
+
+# объекты, количество которых считается в режиме памяти
+COUNTED_TYPES = ('Money', 'Trade', 'FinishedTrade', 'DataFrame')
+
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def peak_memory() -> Optional[int]:
+    """Пиковый RSS процесса в байтах, None там, где модуля resource нет (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # в Linux - килобайты, в macOS - байты
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class StageStats(NamedTuple):
+    name: str
+    wall: float
+    cpu: float
+    rows: int
+    peak_memory: Optional[int]
+
+
+class AllocationSite(NamedTuple):
+    site: str
+    size: int  # прирост за этап, байт
+    blocks: int  # прирост количества выделенных блоков
+
+
+class MemoryStats(NamedTuple):
+    name: str
+    traced: int
+    peak: int
+    top: List[AllocationSite]
+    objects: Dict[str, int]
+    dataframes_size: int
+
+
+def count_objects() -> Tuple[Dict[str, int], int]:
+    """Количество живых объектов COUNTED_TYPES и суммарный размер данных DataFrame в байтах."""
+    counts = dict.fromkeys(COUNTED_TYPES, 0)
+    dataframes_size = 0
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+            if name == 'DataFrame':
+                dataframes_size += int(obj.memory_usage(deep=True).sum())
+    return counts, dataframes_size
+
+
+def _short_path(filename: str) -> str:
+    prefixes = [x for x in sys.path if x and filename.startswith(x)]
+    return filename[len(max(prefixes, key=len)) :].lstrip('/\\') if prefixes else filename
+
+
+class Profiler:
+    def __init__(self, enabled: bool = True, memory: bool = False, memory_top: int = 10):
+        self.enabled = enabled
+        self.rates: List[LayerStats] = []
+        self.http: Dict[str, int] = {}
+        self.memory: List[MemoryStats] = []
+        self._stages: List[Tuple[str, float, float, Optional[int]]] = []
+        self._rows: Dict[str, int] = {}
+        self._memory_top = memory_top
+        self._lock = threading.Lock()
+        self._started = (time.perf_counter(), time.process_time())
+        self._elapsed: Optional[Tuple[float, float]] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        if enabled and memory:
+            tracemalloc.start()
+            self._snapshot = self._take_snapshot()
+
+    @property
+    def stages(self) -> List[StageStats]:
+        with self._lock:
+            return [StageStats(name, wall, cpu, self._rows.get(name, 0), peak) for name, wall, cpu, peak in self._stages]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # профайлеры счетов возвращаются из процессов batch
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> Tuple[float, float]:
+        """Время работы (wall и CPU процесса) от создания профайлера до collect() или до текущего момента."""
+        if self._elapsed is not None:
+            return self._elapsed
+        return time.perf_counter() - self._started[0], time.process_time() - self._started[1]
+
+    def stage(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return _DISABLED
+        return self._measure(name)
+
+    def add_rows(self, name: str, rows: int):
+        """Строки, обработанные этапом name, можно добавлять и после его завершения."""
+        if self.enabled:
+            with self._lock:
+                self._rows[name] = self._rows.get(name, 0) + rows
+
+    def collect(self, rates: List[LayerStats], http_client: HttpClient):
+        """Счётчики кешей курсов и HTTP клиента на конец работы, режим памяти выключается."""
+        if self.enabled:
+            self.rates = rates
+            self.http = {'requests': http_client.requests_count, 'retries': http_client.retries_count, 'bytes': http_client.bytes_received}
+        self._elapsed = self.elapsed
+        self.stop()
+
+    def stop(self):
+        if self._snapshot is not None:
+            tracemalloc.stop()
+            self._snapshot = None
+
+    @contextlib.contextmanager
+    def _measure(self, name: str) -> Iterator[None]:
+        if self._snapshot is not None:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._stages.append((name, time.perf_counter() - wall, time.process_time() - cpu, peak_memory()))
+            if self._snapshot is not None:
+                self.memory.append(self._memory_stats(name))
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def _memory_stats(self, name: str) -> MemoryStats:
+        assert self._snapshot is not None
+        traced, peak = tracemalloc.get_traced_memory()
+        snapshot = self._take_snapshot()
+        top = [AllocationSite(f'{_short_path(x.traceback[0].filename)}:{x.traceback[0].lineno}', x.size_diff, x.count_diff) for x in snapshot.compare_to(self._snapshot, 'lineno')[: self._memory_top]]
+        self._snapshot = snapshot
+        objects, dataframes_size = count_objects()
+        return MemoryStats(name, traced, peak, top, objects, dataframes_size)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stages': [stage._asdict() for stage in self.stages],
+            'total': dict(zip(('wall', 'cpu'), self.elapsed, strict=True)),
+            'rates': [layer._asdict() for layer in self.rates],
+            'http': self.http,
+            'peak_memory': peak_memory(),
+            'memory': [{**x._asdict(), 'top': [site._asdict() for site in x.top]} for x in self.memory],
+        }
+
+    def write_json(self, filepath: str):
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_summary(self, output: TextIO):
+        output.write(f'{"stage":<20} {"wall, s":>9} {"cpu, s":>9} {"rows":>9} {"peak, MB":>9}\n')
+        for stage in self.stages:
+            output.write(f'{stage.name:<20} {stage.wall:>9.3f} {stage.cpu:>9.3f} {stage.rows:>9} {_megabytes(stage.peak_memory):>9}\n')
+        wall, cpu = self.elapsed
+        output.write(f'{"total":<20} {wall:>9.3f} {cpu:>9.3f}\n')
+
+        layers = ', '.join(f'{layer.name} {layer.hits}/{layer.misses}' for layer in self.rates)
+        output.write(f'rates cache hits/misses: {layers}\n')
+        if self.http:
+            output.write(f'http: {self.http["requests"]} requests, {self.http["retries"]} retries, {self.http["bytes"]} bytes\n')
+        output.write(f'peak memory: {_megabytes(peak_memory())} MB\n')
+
+        for stats in self.memory:
+            objects = ', '.join(f'{name} {count}' for name, count in stats.objects.items())
+            output.write(f'\n{stats.name}: traced {_megabytes(stats.traced)} MB, peak {_megabytes(stats.peak)} MB, dataframes {_megabytes(stats.dataframes_size)} MB\n')
+            output.write(f'  objects: {objects}\n')
+            for site in stats.top:
+                output.write(f'  {site.size / 2**20:+9.2f} MB {site.blocks:+9} {site.site}\n')
+
+
+def _megabytes(value: Optional[int]) -> str:
+    return '-' if value is None else f'{value / 2**20:.1f}'
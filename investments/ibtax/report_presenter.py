@@ -1,36 +1,126 @@
+import io
+import os
+import sys
 from abc import ABC, abstractmethod
+from decimal import Decimal
 from enum import Enum
-from typing import Iterable, List, Optional, Union
-
-import pandas  # type: ignore
-from tabulate import tabulate
-from weasyprint import CSS, HTML  # type: ignore
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, TextIO, Union
 
+from investments.currency import Currency
+from investments.ibtax import html_report
+from investments.ibtax.conversion import money, round_decimals
+from investments.ibtax.tables import render_table
 from investments.money import Money
 from investments.trades_fifo import PortfolioElement
 
+if TYPE_CHECKING:
+    import pandas  # type: ignore
+
 
-def apply_round_for_dataframe(source: pandas.DataFrame, columns: Iterable, digits: int = 2) -> pandas.DataFrame:
-    source[list(columns)] = source[list(columns)].map(
-        lambda x: x.round(digits=digits) if isinstance(x, Money) else round(x, digits),
-    )
+def apply_round_for_dataframe(source: 'pandas.DataFrame', columns: Iterable, digits: int = 2) -> 'pandas.DataFrame':
+    for column in columns:
+        source[column] = round_decimals(source[column].to_numpy(dtype=object), digits)
     return source
 
 
+def apply_money_for_dataframe(source: 'pandas.DataFrame', columns: Iterable, rub_columns: Iterable = (), currency_column: str = 'currency') -> 'pandas.DataFrame':
+    """Суммы Decimal в Money для вывода: columns в валюте строки (столбец currency_column удаляется), rub_columns в рублях."""
+    currencies = source[currency_column].tolist() if currency_column in source else []
+    for column in columns:
+        source[column] = money(source[column], currencies)
+    for column in rub_columns:
+        source[column] = [Money(x, Currency.RUB) if isinstance(x, Decimal) else x for x in source[column]]
+    return source.drop(columns=[currency_column], errors='ignore')
+
+
+def trades_summary(trades: 'pandas.DataFrame') -> 'pandas.DataFrame':
+    """Расходы (покупки), доходы (продажи) и финансовый результат по видам инструментов, строки - (tax_year, ticker_kind)."""
+    summary = trades.groupby(['tax_year', 'ticker_kind', 'side'])['total_rub'].sum().unstack('side').reindex(columns=['expenses', 'income'])
+    summary['profit'] = summary['income'] + summary['expenses']
+    summary.columns.name = ''
+    return summary
+
+
+def split_by_year(report: Optional['pandas.DataFrame']) -> Dict[int, 'pandas.DataFrame']:
+    """Разбиение отчёта по годам (tax_year) за один проход, столбец tax_year в частях не нужен."""
+    if report is None:
+        return {}
+    return {int(year): part.drop(columns=['tax_year']) for year, part in report.groupby('tax_year', sort=False)}
+
+
 class DisplayMode(Enum):
     PRINT = 'print'
+    HTML = 'html'
     PDF = 'pdf'
 
 
+def display_mode(dst_filepath: Optional[str]) -> DisplayMode:
+    extension = os.path.splitext(dst_filepath)[1].lower() if dst_filepath else ''
+    if extension == '.pdf':
+        return DisplayMode.PDF
+    if extension in ('.html', '.htm'):
+        return DisplayMode.HTML
+    return DisplayMode.PRINT
+
+
 class ReportPresenter(ABC):
-    def __init__(self, verbose: bool = False, dst_filepath: Optional[str] = None, date_format: str = '%d.%m.%Y'):
-        assert dst_filepath is None or dst_filepath.endswith('.pdf')
+    """
+    Отчёт выводится по мере подготовки разделов.
+
+    Без dst_filepath - в output (по умолчанию stdout), с dst_filepath *.html - в html файл по шаблону templates/report.html,
+    с dst_filepath *.pdf - в pdf файл, с любым другим dst_filepath - в текстовый файл.
 
-        self._output: str = ''
+    Pdf собирается из отдельных документов: каждый год и каждые pdf_chunk_rows строк большой таблицы верстаются
+    по отдельности, страницы документов затем объединяются в один файл.
+
+    rendered_years - кеш разметки разделов по годам (год -> части разметки между документами pdf), общий для нескольких
+    отчётов с теми же параметрами: годы из кеша не форматируются заново, устаревшие годы из него удаляет вызывающий код.
+
+    """
+
+    def __init__(
+        self,
+        verbose: bool = False,
+        dst_filepath: Optional[str] = None,
+        date_format: str = '%d.%m.%Y',
+        output: Optional[TextIO] = None,
+        pdf_chunk_rows: int = 1000,
+        rendered_years: Optional[Dict[int, List[str]]] = None,
+    ):
         self._dst_filepath: Optional[str] = dst_filepath
         self._verbose: bool = verbose
-        self._display_mode: DisplayMode = DisplayMode.PDF if dst_filepath else DisplayMode.PRINT
+        self._display_mode: DisplayMode = display_mode(dst_filepath)
         self._date_format = date_format
+        self._pdf_chunk_rows = pdf_chunk_rows
+        self._rendered_years = rendered_years
+        # разделы года, который форматируется в кеш: готовые части и буфер текущей части
+        self._captured: List[str] = []
+        self._capture_buffer: Optional[io.StringIO] = None
+
+        self._stream: Optional[TextIO] = None
+        self._close_stream = False
+        if self._display_mode != DisplayMode.PDF:
+            if output is not None:
+                self._stream = output
+            elif dst_filepath is not None:
+                self._stream = open(dst_filepath, 'w', encoding='utf-8')
+                self._close_stream = True
+            else:
+                self._stream = sys.stdout
+
+        # текст пишется сразу в поток, html - в буфер текущего раздела (года или куска большой таблицы)
+        self._section: Optional[io.StringIO] = None
+        self._html_stream: Optional[html_report.HtmlStream] = None
+        self._pdf_documents: list = []
+        if self.is_print_mode():
+            assert self._stream is not None
+            self._output: TextIO = self._stream
+        else:
+            self._section = io.StringIO()
+            self._output = self._section
+            if self._display_mode == DisplayMode.HTML:
+                assert self._stream is not None
+                self._html_stream = html_report.HtmlStream(self._stream)
 
     def is_print_mode(self) -> bool:
         return self._display_mode == DisplayMode.PRINT
@@ -38,10 +128,10 @@ class ReportPresenter(ABC):
     @abstractmethod
     def prepare_report(
         self,
-        trades: Optional[pandas.DataFrame],
-        dividends: Optional[pandas.DataFrame],
-        fees: Optional[pandas.DataFrame],
-        interests: Optional[pandas.DataFrame],
+        trades: Optional['pandas.DataFrame'],
+        dividends: Optional['pandas.DataFrame'],
+        fees: Optional['pandas.DataFrame'],
+        interests: Optional['pandas.DataFrame'],
         portfolio: List[PortfolioElement],
         filter_years: List[int],
     ):
@@ -49,36 +139,75 @@ class ReportPresenter(ABC):
 
     def present(self):
         if self.is_print_mode():
-            print(self._output)
+            self._append_output('\n')
+        else:
+            self._end_section()
+
+        if self._html_stream is not None:
+            self._html_stream.close()
+
+        if self._display_mode == DisplayMode.PDF:
+            pages = [page for document in self._pdf_documents for page in document.pages]
+            self._pdf_documents[0].copy(pages).write_pdf(self._dst_filepath)
+        elif self._close_stream:
+            self._stream.close()
         else:
-            css_style = """
-            @page {
-                size: a4 landscape;
-                margin: 1cm;
-            }
-            table, th, td {
-                border: 2px solid black;
-                border-collapse: collapse;
-            }
-            div.pagebreak {
-                page-break-after: always;
-            }
-            h1.year {
-                page-break-before: always;
-            }
-            """
-            HTML(string=self._output).write_pdf(self._dst_filepath, stylesheets=[CSS(string=css_style)])
+            self._stream.flush()
+
+    def _end_section(self):
+        if self._capture_buffer is not None:
+            self._captured.append(self._capture_buffer.getvalue())
+            self._capture_buffer.seek(0)
+            self._capture_buffer.truncate()
+            return
+
+        assert self._section is not None
+        section = self._section.getvalue()
+        if section:
+            if self._html_stream is not None:
+                self._html_stream.write_section(section)
+            else:
+                self._pdf_documents.append(html_report.render_pdf_document(section))
+        self._section.seek(0)
+        self._section.truncate()
 
     def _append_output(self, msg: str):
-        self._output += msg
+        self._output.write(msg)
 
     def _append_year_header(self, year: int):
         if self.is_print_mode():
             line = '______' * 8
             self._append_output(f'\n\n\n>>> {line} {year} {line} <<<\n')
         else:
+            self._end_section()
             self._append_output(f'<h1 class="year">{year}</h1>')
 
+    def _append_year(self, year: int, append_sections: Callable[[], None]):
+        """Заголовок года и его разделы: без rendered_years - append_sections(), иначе разметка из кеша или сохранённая в кеш."""
+        self._append_year_header(year)
+        if self._rendered_years is None:
+            append_sections()
+            return
+
+        parts = self._rendered_years.get(year)
+        if parts is None:
+            parts = self._rendered_years[year] = self._capture(append_sections)
+        for i, part in enumerate(parts):
+            if i > 0:
+                self._end_section()
+            self._append_output(part)
+
+    def _capture(self, append_sections: Callable[[], None]) -> List[str]:
+        output = self._output
+        self._output = self._capture_buffer = io.StringIO()
+        self._captured = []
+        try:
+            append_sections()
+            return [*self._captured, self._capture_buffer.getvalue()]
+        finally:
+            self._output = output
+            self._capture_buffer = None
+
     def _append_header(self, header: str):
         if self.is_print_mode():
             self._append_output(f'\n>>> {header} <<<\n')
@@ -91,53 +220,59 @@ class ReportPresenter(ABC):
         else:
             self._append_output('<div class="pagebreak"></div>')
 
-    def _append_table(self, tabulate_data: Union[list, pandas.DataFrame], headers: str | list[str] = 'keys', **kwargs) -> str:
-        defaults = {
-            'showindex': False,
-            'numalign': 'decimal',
-            'stralign': 'right',
-            'tablefmt': 'presto' if self.is_print_mode() else 'html',
-        }
-        if isinstance(tabulate_data, pandas.DataFrame):
-            for col in tabulate_data.select_dtypes(include=['datetime64']):
-                tabulate_data[col] = tabulate_data[col].dt.strftime(self._date_format)
+    def _append_table(self, data: Union[list, 'pandas.DataFrame'], headers: str | list[str] = 'keys', colalign: Optional[Sequence[str]] = None):
+        import pandas  # type: ignore
+
+        if isinstance(data, pandas.DataFrame):
+            for col in data.select_dtypes(include=['datetime64']):
+                data[col] = data[col].dt.strftime(self._date_format)
+
+        tablefmt = 'presto' if self.is_print_mode() else 'html'
+        chunks = [data]
+        if self._display_mode == DisplayMode.PDF and isinstance(data, pandas.DataFrame) and len(data) > self._pdf_chunk_rows:
+            chunks = [data.iloc[i : i + self._pdf_chunk_rows] for i in range(0, len(data), self._pdf_chunk_rows)]
 
-        defaults.update(**kwargs)
-        return tabulate(tabulate_data, headers=headers, **defaults)  # type: ignore
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                self._end_section()
+            render_table(self._output, chunk, headers=headers, tablefmt=tablefmt, colalign=colalign)
 
 
 class NativeReportPresenter(ReportPresenter):
     def prepare_report(
         self,
-        trades: Optional[pandas.DataFrame],
-        dividends: Optional[pandas.DataFrame],
-        fees: Optional[pandas.DataFrame],
-        interests: Optional[pandas.DataFrame],
+        trades: Optional['pandas.DataFrame'],
+        dividends: Optional['pandas.DataFrame'],
+        fees: Optional['pandas.DataFrame'],
+        interests: Optional['pandas.DataFrame'],
         portfolio: List[PortfolioElement],
         filter_years: List[int],
     ):
-        years = set()
-        for report in (trades, dividends, fees, interests):
-            if report is not None:
-                years |= set(report['tax_year'].unique())
+        summary = trades_summary(trades) if trades is not None else None
+        trades_by_year = split_by_year(trades)
+        dividends_by_year = split_by_year(dividends)
+        fees_by_year = split_by_year(fees)
+        interests_by_year = split_by_year(interests)
 
+        years = set(trades_by_year) | set(dividends_by_year) | set(fees_by_year) | set(interests_by_year)
         for year in years:
             if filter_years and (year not in filter_years):
                 continue
 
-            self._append_year_header(year)
+            def append_sections(year=year):
+                if year in dividends_by_year:
+                    self._append_dividends_report(dividends_by_year[year])
 
-            if dividends is not None:
-                self._append_dividends_report(dividends, year)
+                if year in trades_by_year and summary is not None:
+                    self._append_trades_report(trades_by_year[year], summary.loc[year])
 
-            if trades is not None:
-                self._append_trades_report(trades, year)
+                if year in fees_by_year:
+                    self._append_fees_report(fees_by_year[year])
 
-            if fees is not None:
-                self._append_fees_report(fees, year)
+                if year in interests_by_year:
+                    self._append_interests_report(interests_by_year[year])
 
-            if interests is not None:
-                self._append_interests_report(interests, year)
+            self._append_year(year, append_sections)
 
         self._append_portfolio_report(portfolio)
 
@@ -145,64 +280,49 @@ class NativeReportPresenter(ReportPresenter):
         self._start_new_page()
         self._append_header('PORTFOLIO')
         if len(portfolio) > 0:
-            self._append_output(self._append_table([[str(elem.ticker), elem.quantity] for elem in portfolio], headers=['Ticker', 'Quantity'], colalign=('left',)))
-
-    def _append_dividends_report(self, dividends: pandas.DataFrame, year: int):
-        dividends_by_year = dividends[dividends['tax_year'] == year].drop(columns=['tax_year'])
-        if dividends_by_year.empty:
-            return
+            self._append_table([[str(elem.ticker), elem.quantity] for elem in portfolio], headers=['Ticker', 'Quantity'], colalign=('left',))
 
-        dividends_by_year['N'] -= dividends_by_year['N'].iloc[0] - 1
-        dividends_presenter = dividends_by_year.copy(deep=True)
+    def _append_dividends_report(self, dividends_presenter: 'pandas.DataFrame'):
+        dividends_presenter['N'] -= dividends_presenter['N'].iloc[0] - 1
         if not self._verbose:
             apply_round_for_dataframe(dividends_presenter, {'rate'}, 4)
             apply_round_for_dataframe(dividends_presenter, {'amount', 'amount_rub', 'tax_paid', 'tax_paid_rub'}, 2)
             dividends_presenter = dividends_presenter.drop(columns=['tax_rate'])
+        dividends_presenter = apply_money_for_dataframe(dividends_presenter, ['amount', 'tax_paid'], ['rate', 'amount_rub', 'tax_paid_rub'])
 
         self._start_new_page()
         self._append_header('DIVIDENDS')
-        self._append_output(self._append_table(dividends_presenter))
+        self._append_table(dividends_presenter)
 
-    def _append_fees_report(self, fees: pandas.DataFrame, year: int):
-        fees_by_year = fees[fees['tax_year'] == year].drop(columns=['tax_year'])
-        if fees_by_year.empty:
-            return
-
-        feed_presenter = fees_by_year.copy(deep=True)
+    def _append_fees_report(self, feed_presenter: 'pandas.DataFrame'):
         if not self._verbose:
             apply_round_for_dataframe(feed_presenter, {'rate'}, 4)
             apply_round_for_dataframe(feed_presenter, {'amount', 'amount_rub'}, 2)
+        feed_presenter = apply_money_for_dataframe(feed_presenter, ['amount'], ['rate', 'amount_rub'])
 
         self._start_new_page()
         self._append_header('OTHER FEES')
-        self._append_output(self._append_table(feed_presenter))
+        self._append_table(feed_presenter)
 
-    def _append_interests_report(self, interests: pandas.DataFrame, year: int):
-        interests_by_year = interests[interests['tax_year'] == year].drop(columns=['tax_year'])
-        if interests_by_year.empty:
-            return
-
-        interests_presenter = interests_by_year.copy(deep=True)
+    def _append_interests_report(self, interests_presenter: 'pandas.DataFrame'):
         if not self._verbose:
             apply_round_for_dataframe(interests_presenter, {'rate'}, 4)
             apply_round_for_dataframe(interests_presenter, {'amount', 'amount_rub'}, 2)
+        interests_presenter = apply_money_for_dataframe(interests_presenter, ['amount'], ['rate', 'amount_rub'])
 
         self._start_new_page()
         self._append_header('INTERESTS')
-        self._append_output(self._append_table(interests_presenter))
-
-    def _append_trades_report(self, trades: pandas.DataFrame, year: int):
-        trades_by_year = trades[trades['tax_year'] == year].drop(columns=['tax_year'])
-        if trades_by_year.empty:
-            return
+        self._append_table(interests_presenter)
 
+    def _append_trades_report(self, trades_by_year: 'pandas.DataFrame', trades_summary_presenter: 'pandas.DataFrame'):
         trades_by_year['N'] -= trades_by_year['N'].iloc[0] - 1
 
-        trades_presenter = trades_by_year.copy(deep=True).set_index(['N', 'ticker', 'trade_date'])
-        trades_presenter['ticker_name'] = trades_presenter.apply(lambda x: str(x.name[1]), axis=1)
+        trades_presenter = trades_by_year.set_index(['N', 'ticker', 'trade_date'])
+        trades_presenter['ticker_name'] = trades_presenter.index.get_level_values('ticker').map(str)
 
         trades_presenter = trades_presenter[
             [
+                'currency',
                 'ticker_name',
                 'date',
                 'settle_date',
@@ -223,31 +343,25 @@ class NativeReportPresenter(ReportPresenter):
         if not self._verbose:
             apply_round_for_dataframe(trades_presenter, {'price', 'total', 'total_rub', 'profit_rub'}, 2)
             apply_round_for_dataframe(trades_presenter, {'fee', 'settle_rate', 'fee_rate'}, 4)
+
+        trades_presenter = apply_money_for_dataframe(
+            trades_presenter,
+            ['price', 'fee_per_piece', 'fee', 'total'],
+            ['price_rub', 'fee_per_piece_rub', 'total_rub', 'settle_rate', 'fee_rate', 'profit_rub'],
+        )
+        if not self._verbose:
             trades_presenter = trades_presenter.drop(columns=['fee_per_piece', 'fee_per_piece_rub', 'price_rub'])
 
         self._start_new_page()
         self._append_header('TRADES')
-        self._append_output(self._append_table(trades_presenter))
+        self._append_table(trades_presenter)
 
         self._start_new_page()
         self._append_header('TRADES RESULTS BEFORE TAXES')
-        trades_summary_presenter = (
-            trades_by_year.copy(deep=True)
-            .groupby(
-                lambda idx: (
-                    trades_by_year.loc[idx, 'ticker'].kind,
-                    'expenses' if trades_by_year.loc[idx, 'quantity'] > 0 else 'income',
-                )
-            )['total_rub']
-            .sum()
-            .reset_index()
-        )
-        trades_summary_presenter = trades_summary_presenter['index'].apply(pandas.Series).join(trades_summary_presenter).pivot(index=0, columns=1, values='total_rub')
         trades_summary_presenter.index.name = ''
-        trades_summary_presenter.columns.name = ''
-        trades_summary_presenter['profit'] = trades_summary_presenter['income'] + trades_summary_presenter['expenses']
 
         if not self._verbose:
             apply_round_for_dataframe(trades_summary_presenter, {'expenses', 'income', 'profit'}, 2)
+        trades_summary_presenter = apply_money_for_dataframe(trades_summary_presenter, [], ['expenses', 'income', 'profit'])
 
-        self._append_output(self._append_table(trades_summary_presenter.reset_index()))
+        self._append_table(trades_summary_presenter.reset_index())
@@ -0,0 +1,269 @@
+"""
+Сервис ibtax: локальный HTTP сервер, который держит в памяти курсы валют, прочитанные отчёты и результаты FIFO.
+
+    python -m investments.ibtax.service --port 8765 --cache-dir /path/to/cache
+
+POST /report, тело - json:
+
+    {"activity_reports_dir": "...", "confirmation_reports_dir": "...", "years": [2023], "format": "text", "verbose": false}
+
+вместо каталогов можно передать сами отчёты: {"activity_reports": {"2023.csv": "<csv>"}, "confirmation_reports": {"all.csv": "<csv>"}}.
+format - text, html, pdf, csv или jsonl, в ответе - отчёт в этом формате. GET /stats - счётчики кешей сервиса.
+
+Строки отчётов кешируются по файлам (путь, размер и время изменения или хеш переданного содержимого): после изменения
+одного файла заново читается только он. Результат разбора и FIFO кешируется по набору файлов, повторный запрос
+по тем же отчётам только пересчитывает суммы в рубли по курсам из памяти и выводит отчёт.
+
+Сервис слушает 127.0.0.1 и без --reports-root читает любые каталоги, доступные процессу. Слушать другой адрес
+(--host) можно только с --reports-root: тогда *_reports_dir должны быть внутри этого каталога.
+
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import ipaddress
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from investments.data_providers import cbr
+from investments.ibtax.ibtax import REPORT_TYPES, AccountOperations, analyze_trades, csvs_in_dir, present_reports, select_tax_years
+from investments.ibtax.profiler import Profiler
+from investments.report_parsers.ib import CsvFile, InteractiveBrokersReportParser
+
+
+class ReportFormat(NamedTuple):
+    report_type: str
+    extension: str
+    content_type: str
+
+
+FORMATS = {
+    'text': ReportFormat('native', '.txt', 'text/plain; charset=utf-8'),
+    'html': ReportFormat('native', '.html', 'text/html; charset=utf-8'),
+    'pdf': ReportFormat('native', '.pdf', 'application/pdf'),
+    'csv': ReportFormat('csv', '.csv', 'text/csv; charset=utf-8'),
+    'jsonl': ReportFormat('jsonl', '.jsonl', 'application/x-ndjson; charset=utf-8'),
+}
+
+
+class NoTradesError(Exception):
+    pass
+
+
+class CacheStats(NamedTuple):
+    cached: int
+    hits: int
+    misses: int
+
+
+class LruCache:
+    """LRU кеш, общий для потоков сервера: блокировка только на время обращения к нему."""
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._items: OrderedDict[Any, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any):
+        with self._lock:
+            self._items[key] = value
+            if len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(len(self._items), self.hits, self.misses)
+
+
+# строки отчёта и ключ, по которому они кешируются
+ReportRows = Tuple[Tuple, List[List[str]]]
+
+
+class ReportService:
+    def __init__(self, cache_dir: Optional[str], offline: bool = False, max_files: int = 1024, max_accounts: int = 32, reports_root: Optional[str] = None):
+        """reports_root - каталог, внутри которого должны быть *_reports_dir запросов (None - любые каталоги)."""
+        self._reports_root = os.path.realpath(reports_root) if reports_root is not None else None
+        self._rates = cbr.ExchangeRatesRUB(cache_dir=cache_dir, offline=offline)
+        self._files = LruCache(max_files)
+        self._accounts = LruCache(max_accounts)
+        self._lock = threading.Lock()
+        self.requests_count = 0
+
+    def report(self, request: Dict[str, Any]) -> Tuple[bytes, str]:
+        """Отчёт по запросу POST /report и его content type."""
+        report_format = FORMATS[request.get('format', 'text')]
+        years = [int(x) for x in request.get('years', [])]
+        verbose = bool(request.get('verbose', False))
+
+        with self._lock:
+            self.requests_count += 1
+
+        # кеши блокируются только на время обращения, курсы - внутри провайдера (RatesChain), разбор, FIFO и вывод
+        # разных запросов идут одновременно: медленный pdf не задерживает остальные запросы и /stats
+        operations = self._operations(self._reports(request, 'activity'), self._reports(request, 'confirmation'))
+        operations = operations._replace(finished_trades=select_tax_years(operations.finished_trades, years))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dst_filepath = os.path.join(tmpdir, f'report{report_format.extension}')
+            presenter = REPORT_TYPES[report_format.report_type](verbose, dst_filepath)
+            present_reports(operations, self._rates, presenter, years, verbose, Profiler(enabled=False))
+            with open(dst_filepath, 'rb') as f:
+                return f.read(), report_format.content_type
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests_count = self.requests_count
+        return {
+            'requests': requests_count,
+            'files': self._files.stats()._asdict(),
+            'accounts': self._accounts.stats()._asdict(),
+            'rates': [x._asdict() for x in self._rates.stats()],
+        }
+
+    def _reports(self, request: Dict[str, Any], kind: str) -> List[ReportRows]:
+        if f'{kind}_reports_dir' in request:
+            return [self._file_rows(x) for x in csvs_in_dir(self._reports_dir(request[f'{kind}_reports_dir']))]
+        if f'{kind}_reports' in request:
+            return [self._uploaded_rows(text) for _, text in sorted(request[f'{kind}_reports'].items())]
+        raise ValueError(f'{kind}_reports_dir or {kind}_reports is required')
+
+    def _reports_dir(self, directory: str) -> str:
+        if self._reports_root is None:
+            return directory
+        path = os.path.realpath(os.path.join(self._reports_root, directory))
+        if os.path.commonpath([self._reports_root, path]) != self._reports_root:
+            raise PermissionError(f'{directory} is outside of the reports root')
+        return path
+
+    def _file_rows(self, filepath: str) -> ReportRows:
+        stat = os.stat(filepath)
+        key = ('file', os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+        rows = self._files.get(key)
+        if rows is None:
+            rows = list(CsvFile(filepath))
+            self._files.put(key, rows)
+        return key, rows
+
+    def _uploaded_rows(self, text: str) -> ReportRows:
+        key = ('sha256', hashlib.sha256(text.encode('utf-8')).hexdigest())
+        rows = self._files.get(key)
+        if rows is None:
+            rows = list(csv.reader(io.StringIO(text, newline=''), delimiter=','))
+            self._files.put(key, rows)
+        return key, rows
+
+    def _operations(self, activity: List[ReportRows], confirmation: List[ReportRows]) -> AccountOperations:
+        """Разбор и FIFO по всем годам, кешируются по ключам отчётов (одновременные запросы по новым отчётам могут посчитать их дважды)."""
+        key = (tuple(x for x, _ in activity), tuple(x for x, _ in confirmation))
+        operations = self._accounts.get(key)
+        if operations is None:
+            parser_object = InteractiveBrokersReportParser()
+            parser_object.parse_rows(activity_reports=[x for _, x in activity], trade_confirmations=[x for _, x in confirmation])
+            operations = analyze_trades(parser_object, [], Profiler(enabled=False))
+            if operations is None:
+                raise NoTradesError('no trades found')
+            self._accounts.put(key, operations)
+        return operations
+
+
+class ReportServer(ThreadingHTTPServer):
+    def __init__(self, service: ReportService, host: str = '127.0.0.1', port: int = 8765):
+        self.service = service
+        super().__init__((host, port), _RequestHandler)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: ReportServer
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._reply(404, b'not found\n')
+            return
+        self._reply(200, json.dumps(self.server.service.stats()).encode('utf-8'), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/report':
+            self._reply(404, b'not found\n')
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            body, content_type = self.server.service.report(request)
+        except NoTradesError as ex:
+            self._reply(422, f'{ex}\n'.encode('utf-8'))
+        except PermissionError as ex:
+            self._reply(403, f'{ex}\n'.encode('utf-8'))
+        except (ValueError, KeyError, TypeError, OSError) as ex:
+            self._reply(400, f'{type(ex).__name__}: {ex}\n'.encode('utf-8'))
+        except Exception as ex:
+            logging.exception('report failed')
+            self._reply(500, f'{type(ex).__name__}: {ex}\n'.encode('utf-8'))
+        else:
+            self._reply(200, body, content_type)
+
+    def _reply(self, status: int, body: bytes, content_type: str = 'text/plain; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f'{self.address_string()} {format % args}')
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on, non-loopback addresses require --reports-root')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--cache-dir', type=str, default='.', help='directory for caching (CBR RUB exchange rates)')
+    parser.add_argument('--offline', nargs='?', default=False, const=True, help='use only imported exchange rates, never request cbr.ru')
+    parser.add_argument('--reports-root', type=str, default=None, help='serve *_reports_dir only inside this directory (relative paths are resolved against it)')
+    parser.add_argument('--verbose', nargs='?', default=False, const=True, help='log every request')
+    args = parser.parse_args()
+    if not is_loopback(args.host) and args.reports_root is None:
+        parser.error(f'--host {args.host} is not a loopback address: requests could read any directory of this machine, set --reports-root')
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    server = ReportServer(ReportService(args.cache_dir, offline=args.offline, reports_root=args.reports_root), args.host, args.port)
+    print(f'ibtax service on http://{args.host}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Вывод таблиц отчёта в форматах presto и html.
+
+Результат совпадает с tabulate(..., showindex=False, numalign='decimal', stralign='right'), но считается только для
+значений, которые встречаются в таблицах отчёта: None, целые, Decimal и float, Money, тикеры, даты и обычные строки.
+Всё остальное (bool, bytes, строки, похожие на числа, непечатаемые символы, пустые таблицы) отдаётся самому tabulate.
+
+"""
+
+import re
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+from html import escape
+from itertools import zip_longest
+from numbers import Integral
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
+
+from investments.money import Money
+from investments.ticker import Ticker, TickerKind
+
+if TYPE_CHECKING:
+    import pandas  # type: ignore
+
+try:
+    from wcwidth import wcswidth  # type: ignore
+except ImportError:  # без wcwidth tabulate тоже считает ширину как len
+    wcswidth = len
+
+TABLE_FORMATS = ('presto', 'html')
+
+# виды значений в порядке обобщения, как в tabulate: столбец получает самый общий вид своих значений
+_NONE, _INT, _FLOAT, _STR = range(4)
+
+_KINDS: Dict[type, int] = {type(None): _NONE, int: _INT, float: _FLOAT, Decimal: _FLOAT, Money: _STR, Ticker: _STR, TickerKind: _STR, date: _STR}
+
+# строки, которые tabulate считает числами с разделителем тысяч
+_THOUSANDS = re.compile(r'^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$')
+
+_HTML_ALIGNS = {'right': ' style="text-align: right;"', 'center': ' style="text-align: center;"', 'decimal': ' style="text-align: right;"'}
+
+_MIN_HEADER_PADDING = 2
+
+_ASCII_PREFIX = re.compile(r'[\x00-\x7f]*')
+_VS16 = '\ufe0f'
+
+
+def _looks_like_number(value: str) -> bool:
+    """Строки, которые tabulate выводит как bool или число."""
+    if value in ('True', 'False') or _THOUSANDS.match(value):
+        return True
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _kind(value: Any) -> Optional[int]:
+    """Вид значения или None, если его тип здесь не поддерживается."""
+    kind = _KINDS.get(type(value))
+    if kind is not None:
+        return kind
+    if isinstance(value, Integral) and not isinstance(value, bool):  # целые numpy
+        return _INT
+    if isinstance(value, str):
+        if not value:
+            return _NONE
+        return None if _looks_like_number(value) else _STR
+    return None
+
+
+def _format(value: Any, kind: int) -> str:
+    if value is None or (isinstance(value, str) and not value):
+        return ''
+    if kind == _INT:
+        return format(value, '')
+    if kind == _FLOAT:
+        return format(float(value), 'g')
+    return f'{value}'
+
+
+def _afterpoint(cell: str) -> int:
+    """Число знаков после десятичной точки (или после e) в отформатированном числе, -1 для целых и пустых ячеек."""
+    if not cell or cell.lstrip('+-').isdigit():
+        return -1
+    pos = cell.rfind('.')
+    if pos < 0:
+        pos = cell.lower().rfind('e')
+    return len(cell) - pos - 1 if pos >= 0 else -1
+
+
+@lru_cache(maxsize=4096)
+def _tail_width(tail: str) -> int:
+    return wcswidth(tail)
+
+
+def _width(cell: str) -> int:
+    """wcswidth(cell): ASCII-начало строки (сумма Money до символа валюты) считается как len, остаток - через wcwidth с кэшем."""
+    if cell.isascii():
+        return len(cell)
+    match = _ASCII_PREFIX.match(cell)
+    prefix = match.end() if match else 0
+    tail = cell[prefix:]
+    if _VS16 in tail:  # вариант эмодзи меняет ширину предыдущего символа
+        return wcswidth(cell)
+    return prefix + _tail_width(tail)
+
+
+def _center(cell: str, width: int) -> str:
+    # str.center кладёт лишний пробел не с той стороны, что format (и tabulate)
+    return format(cell, f'^{width}s')
+
+
+_PADS: Dict[str, Callable[[str, int], str]] = {'right': str.rjust, 'center': _center}
+
+
+def _align_column(cells: List[str], alignment: Optional[str], min_width: int) -> Tuple[List[str], int]:
+    if alignment == 'decimal':
+        points = [_afterpoint(x) for x in cells]
+        max_points = max(points)
+        cells = [x + ' ' * (max_points - p) for x, p in zip(cells, points, strict=True)]
+        pad: Optional[Callable[[str, int], str]] = str.rjust
+    elif not alignment:
+        pad = None
+    else:
+        cells = [x.strip() for x in cells]
+        pad = _PADS.get(alignment, str.ljust)
+
+    widths = [_width(x) for x in cells]
+    width = max(max(widths), min_width)
+    if pad is not None:
+        cells = [pad(x, width - (w - len(x))) for x, w in zip(cells, widths, strict=True)]
+    return cells, width
+
+
+def _align_header(header: str, alignment: Optional[str], width: int) -> str:
+    if not alignment:
+        return header
+    fill = {'left': '<', 'center': '^'}.get(alignment, '>')
+    return format(header, f'{fill}{width + len(header) - _width(header)}s')
+
+
+def _columns(data: Union[list, 'pandas.DataFrame'], headers: Union[str, Sequence[str]]) -> Optional[Tuple[List[str], List[Sequence]]]:
+    import pandas  # type: ignore
+
+    if isinstance(data, pandas.DataFrame):
+        if not (isinstance(headers, str) and headers == 'keys'):
+            return None
+        values = data.to_numpy()
+        columns: List[Sequence] = [values[:, i] for i in range(values.shape[1])] if len(values) else []
+        header_names = list(map(str, data.columns))
+    else:
+        if isinstance(headers, str):
+            return None
+        rows = list(data)
+        columns = list(zip_longest(*rows))
+        header_names = list(map(str, headers))
+        if header_names and rows:
+            header_names = [''] * max(0, len(rows[0]) - len(header_names)) + header_names
+
+    if not columns or (header_names and len(header_names) != len(columns)):
+        return None
+    return header_names, columns
+
+
+def _format_column(column: Sequence) -> Optional[Tuple[int, List[str]]]:
+    kind = _NONE
+    for value in column:
+        value_kind = _kind(value)
+        if value_kind is None:
+            return None
+        kind = max(kind, value_kind)
+    return kind, [_format(x, kind) for x in column]
+
+
+def _presto_lines(headers: List[str], rows: Iterator[Tuple[str, ...]], widths: List[int]) -> Iterator[str]:
+    if headers:
+        yield f' {" | ".join(headers)} '.rstrip()
+        yield '+'.join('-' * (w + 2) for w in widths)
+    for row in rows:
+        yield f' {" | ".join(row)} '.rstrip()
+
+
+def _html_lines(headers: List[str], rows: Iterator[Tuple[str, ...]], aligns: List[str]) -> Iterator[str]:
+    if headers:
+        cells = ''.join(f'<th{align}>{escape(x)}</th>' for x, align in zip(headers, aligns, strict=True))
+        yield f'<table>\n<thead>\n<tr>{cells}</tr>\n</thead>\n<tbody>'
+    else:
+        yield '<table>\n<tbody>'
+    for row in rows:
+        cells = ''.join(f'<td{align}>{escape(x)}</td>' for x, align in zip(row, aligns, strict=True))
+        yield f'<tr>{cells}</tr>'
+    yield '</tbody>\n</table>'
+
+
+def _write_table(output: TextIO, headers: List[str], columns: List[Sequence], tablefmt: str, colalign: Optional[Sequence[str]]) -> bool:
+    formatted = [_format_column(column) for column in columns]
+    if any(x is None for x in formatted):
+        return False
+    kinds = [x[0] for x in formatted if x is not None]
+    cells = [x[1] for x in formatted if x is not None]
+    if not all(x.isprintable() for x in headers) or not all(x.isprintable() for column in cells for x in column):
+        return False
+
+    aligns = ['decimal' if kind in (_INT, _FLOAT) else 'right' for kind in kinds]
+    for i, align in enumerate((colalign or ())[: len(aligns)]):
+        if align != 'global':
+            aligns[i] = align
+
+    min_widths = [_width(x) + _MIN_HEADER_PADDING for x in headers] if headers else [0] * len(cells)
+    widths = []
+    for i, (column, align, min_width) in enumerate(zip(cells, aligns, min_widths, strict=True)):
+        cells[i], width = _align_column(column, align, min_width)
+        widths.append(width)
+    headers = [_align_header(x, align, width) for x, align, width in zip(headers, aligns, widths, strict=True)]
+
+    rows = zip(*cells, strict=True)
+    if tablefmt == 'presto':
+        lines = _presto_lines(headers, rows, widths)
+    else:
+        lines = _html_lines(headers, rows, [_HTML_ALIGNS.get(x, '') for x in aligns])
+
+    output.write(next(lines))
+    for line in lines:
+        output.write(f'\n{line}')
+    return True
+
+
+def render_table(output: TextIO, data: Union[list, 'pandas.DataFrame'], headers: Union[str, Sequence[str]] = 'keys', tablefmt: str = 'presto', colalign: Optional[Sequence[str]] = None):
+    """Пишет в output то же, что вернул бы tabulate(data, headers, tablefmt, numalign='decimal', stralign='right', colalign, showindex=False)."""
+    prepared = _columns(data, headers) if tablefmt in TABLE_FORMATS else None
+    if prepared is not None and _write_table(output, *prepared, tablefmt, colalign):
+        return
+
+    from tabulate import tabulate
+
+    output.write(tabulate(data, headers=headers, tablefmt=tablefmt, numalign='decimal', stralign='right', colalign=colalign, showindex=False))
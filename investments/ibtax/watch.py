@@ -0,0 +1,241 @@
+"""
+Режим ibtax --watch: отчёт обновляется после каждого изменения отчётов Interactive Brokers в каталогах.
+
+Каталоги опрашиваются раз в --watch-interval секунд (размер и время изменения csv файлов). После изменения:
+
+- заново читаются только изменённые файлы, строки остальных берутся из памяти. Строки разбираются в операции
+  по всем файлам: инструменты и даты поставки для сделок одного отчёта могут быть в других;
+- FIFO пересчитывается с последней сохранённой точки перед первой изменённой сделкой (IncrementalTradesAnalyzer);
+- в рубли пересчитываются и заново форматируются только годы, операции которых изменились, таблицы остальных лет
+  берутся из памяти. Портфель выводится заново при каждом обновлении.
+
+"""
+
+import datetime
+import logging
+import os
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, TextIO, Tuple, TypeVar
+
+import pandas  # type: ignore
+
+from investments.data_providers import cbr
+from investments.data_providers.rates import RatesProvider
+from investments.ibtax.ibtax import (
+    REPORT_TYPES,
+    AccountOperations,
+    csvs_in_dir,
+    operations_first_year,
+    prepare_dividends_report,
+    prepare_fees_report,
+    prepare_interests_report,
+    prepare_trades_report,
+    required_rates,
+    select_tax_years,
+)
+from investments.report_parsers.ib import CsvFile, InteractiveBrokersReportParser
+from investments.trades_fifo import FinishedTrade, IncrementalTradesAnalyzer
+
+T = TypeVar('T')
+
+
+class YearReports(NamedTuple):
+    trades: Optional[pandas.DataFrame]
+    dividends: Optional[pandas.DataFrame]
+    fees: Optional[pandas.DataFrame]
+    interests: Optional[pandas.DataFrame]
+
+
+def trades_by_tax_year(finished_trades: Iterable[FinishedTrade]) -> Dict[int, List[FinishedTrade]]:
+    """Закрытые сделки по налоговым годам (год последней поставки в группе N, как в select_tax_years)."""
+    groups: Dict[int, List[FinishedTrade]] = {}
+    for trade in finished_trades:
+        groups.setdefault(trade.N, []).append(trade)
+
+    ret: Dict[int, List[FinishedTrade]] = {}
+    for group in groups.values():
+        ret.setdefault(max(x.settle_date.year for x in group), []).extend(group)
+    return ret
+
+
+def changed_years(old: Sequence[T], new: Sequence[T], date: Callable[[T], datetime.date]) -> Set[int]:
+    """
+    Годы, отчёты за которые меняются при замене операций old на new (оба списка отсортированы по дате).
+
+    Нумерация N в отчётах сквозная, поэтому меняются все годы начиная с первой изменённой операции.
+
+    """
+    common = min(len(old), len(new))
+    changed = next((i for i in range(common) if old[i] != new[i]), common)
+    return {date(x).year for x in old[changed:]} | {date(x).year for x in new[changed:]}
+
+
+def _changed_trade_years(old: List[FinishedTrade], new: List[FinishedTrade]) -> Set[int]:
+    old_by_year, new_by_year = trades_by_tax_year(old), trades_by_tax_year(new)
+    return {year for year in old_by_year.keys() | new_by_year.keys() if old_by_year.get(year) != new_by_year.get(year)}
+
+
+def _concat(frames: List[Optional[pandas.DataFrame]]) -> Optional[pandas.DataFrame]:
+    """Таблицы лет в одну, как если бы отчёт готовился сразу за все годы; None - таблицы нет ни за один год."""
+    present = [x for x in frames if x is not None]
+    if not present:
+        return None
+    return pandas.concat([x for x in present if len(x)] or present[:1], ignore_index=True)
+
+
+class ReportWatcher:
+    def __init__(
+        self,
+        activity_reports_dir: str,
+        confirmation_reports_dir: str,
+        cache_dir: str,
+        offline: bool = False,
+        filter_years: Sequence[int] = (),
+        verbose: bool = False,
+        report_type: str = 'native',
+        dst_filepath: Optional[str] = None,
+        pdf_chunk_rows: int = 1000,
+    ):
+        self._activity_reports_dir = activity_reports_dir
+        self._confirmation_reports_dir = confirmation_reports_dir
+        self._cache_dir = cache_dir
+        self._offline = offline
+        self._filter_years = list(filter_years)
+        self._verbose = verbose
+        self._report_type = report_type
+        self._dst_filepath = dst_filepath
+        self._pdf_chunk_rows = pdf_chunk_rows
+
+        # путь -> (размер и время изменения, строки файла)
+        self._files: Dict[str, Tuple[Tuple[int, int], List[List[str]]]] = {}
+        self._activity_reports: List[str] = []
+        self._confirmation_reports: List[str] = []
+        self._fifo = IncrementalTradesAnalyzer()
+        self._operations: Optional[AccountOperations] = None
+        self._rates: Optional[RatesProvider] = None
+        self._years: Dict[int, YearReports] = {}
+        self._rendered_years: Dict[int, List[str]] = {}
+
+    def scan(self) -> List[str]:
+        """Перечитывает изменённые и новые csv файлы, возвращает изменённые, новые и удалённые файлы."""
+        self._activity_reports = csvs_in_dir(self._activity_reports_dir)
+        self._confirmation_reports = csvs_in_dir(self._confirmation_reports_dir)
+        filepaths = self._activity_reports + self._confirmation_reports
+        changed = sorted(set(self._files) - set(filepaths))
+        for filepath in changed:
+            del self._files[filepath]
+
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            cached = self._files.get(filepath)
+            if cached is None or cached[0] != signature:
+                self._files[filepath] = (signature, list(CsvFile(filepath)))
+                changed.append(filepath)
+        return changed
+
+    def update(self) -> Optional[List[int]]:
+        """Разбор, FIFO и пересчёт в рубли изменившихся лет по прочитанным scan() файлам. Возвращает пересчитанные годы, None - в отчётах нет сделок."""
+        parser_object = InteractiveBrokersReportParser()
+        parser_object.parse_rows(
+            activity_reports=[self._files[x][1] for x in self._activity_reports],
+            trade_confirmations=[self._files[x][1] for x in self._confirmation_reports],
+        )
+        trades, dividends, fees, interests = parser_object.trades, parser_object.dividends, parser_object.fees, parser_object.interests
+        if not trades:
+            logging.error('no trades found')
+            return None
+
+        old = self._operations
+        old_finished_trades = list(self._fifo.finished_trades)
+        kept = self._fifo.update(trades)
+        finished_trades = self._fifo.finished_trades
+
+        first_year = operations_first_year(trades, dividends)
+        operations = AccountOperations(finished_trades, self._fifo.final_portfolio, dividends, fees, interests, first_year)
+        if self._rates is None:
+            self._rates = cbr.ExchangeRatesRUB(year_from=first_year, cache_dir=self._cache_dir, offline=self._offline)
+
+        changed = _changed_trade_years(old_finished_trades[kept:], finished_trades[kept:])
+        if old is not None:
+            changed |= changed_years(old.dividends, dividends, lambda x: x.date)
+            changed |= changed_years(old.fees, fees, lambda x: x.date)
+            changed |= changed_years(old.interests, interests, lambda x: x.date)
+        self._operations = operations
+
+        if self._filter_years:
+            years = set(self._filter_years)
+        else:
+            years = set(trades_by_tax_year(finished_trades)) | {x.date.year for x in dividends} | {x.date.year for x in fees} | {x.date.year for x in interests}
+        for year in set(self._years) - years:
+            del self._years[year]
+
+        updated = sorted(year for year in years if year in changed or year not in self._years)
+        if updated:
+            self._rates.prefetch(required_rates(finished_trades, dividends, fees, interests, updated))
+        for year in updated:
+            self._years[year] = self._prepare_year(operations, year)
+            self._rendered_years.pop(year, None)
+        return updated
+
+    def reset(self):
+        """Сброс результатов разбора, FIFO и таблиц лет (строки файлов остаются): следующий update() пересчитает всё."""
+        self._fifo = IncrementalTradesAnalyzer()
+        self._operations = None
+        self._years.clear()
+        self._rendered_years.clear()
+
+    def _prepare_year(self, operations: AccountOperations, year: int) -> YearReports:
+        assert self._rates is not None
+        finished_trades = select_tax_years(operations.finished_trades, [year])
+        return YearReports(
+            trades=prepare_trades_report(finished_trades, self._rates) if finished_trades else None,
+            dividends=prepare_dividends_report(operations.dividends, self._rates, self._verbose, [year]) if operations.dividends else None,
+            fees=prepare_fees_report(operations.fees, self._rates, self._verbose, [year]) if operations.fees else None,
+            interests=prepare_interests_report(operations.interests, self._rates, [year]) if operations.interests else None,
+        )
+
+    def present(self):
+        """Вывод отчёта по всем годам: годы, которые не пересчитывались, берутся из памяти."""
+        assert self._operations is not None
+        reports = [self._years[year] for year in sorted(self._years)]
+        trades = _concat([x.trades for x in reports])
+        if trades is not None:
+            # в отчёте за все годы сделки идут по порядку N
+            trades = trades.sort_values('N', kind='stable', ignore_index=True)
+
+        presenter = REPORT_TYPES[self._report_type](self._verbose, self._dst_filepath, pdf_chunk_rows=self._pdf_chunk_rows, rendered_years=self._rendered_years)
+        presenter.prepare_report(
+            trades,
+            _concat([x.dividends for x in reports]),
+            _concat([x.fees for x in reports]),
+            _concat([x.interests for x in reports]),
+            self._operations.portfolio,
+            self._filter_years,
+        )
+        presenter.present()
+
+    def run(self, interval: float, status: Optional[TextIO] = None, iterations: Optional[int] = None):
+        """Отчёт сразу и после каждого изменения файлов, iterations - сколько раз опросить каталоги (None - без ограничения)."""
+        checks = 0
+        while True:
+            start = time.perf_counter()
+            changed = self.scan()
+            if changed or checks == 0:
+                try:
+                    updated = self.update()
+                    if updated is not None:
+                        self.present()
+                except Exception:
+                    # файл мог быть записан не полностью: отчёт пересчитается после следующего изменения
+                    logging.exception(f'report update failed, changed files: {changed}')
+                    self.reset()
+                else:
+                    if status is not None and updated is not None:
+                        status.write(f'report updated in {time.perf_counter() - start:.3f}s, changed files: {len(changed)}, recalculated years: {updated}\n')
+                        status.flush()
+
+            checks += 1
+            if iterations is not None and checks >= iterations:
+                return
+            time.sleep(interval)
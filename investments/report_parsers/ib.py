@@ -2,7 +2,7 @@ import csv
 import datetime
 import logging
 import re
-from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 from decimal import Decimal
 
 from investments.cash import Cash
@@ -146,6 +146,17 @@ class SettleDatesStorage:
         return None
 
 
+class CsvFile:
+    """Строки csv файла, файл открывается заново при каждом проходе."""
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+
+    def __iter__(self) -> Iterator[List[str]]:
+        with open(self.filepath, newline='') as fh:
+            yield from csv.reader(fh, delimiter=',')
+
+
 class InteractiveBrokersReportParser:
     def __init__(self) -> None:
         self._account_base_currency = None
@@ -187,43 +198,44 @@ class InteractiveBrokersReportParser:
         return self._cash if self._cash else self._cash_base_currency
 
     def parse_csv(self, *, activity_csvs: List[str], trade_confirmation_csvs: List[str]):
+        self.parse_rows(activity_reports=[CsvFile(x) for x in activity_csvs], trade_confirmations=[CsvFile(x) for x in trade_confirmation_csvs])
+
+    def parse_rows(self, *, activity_reports: Sequence[Iterable[List[str]]], trade_confirmations: Sequence[Iterable[List[str]]]):
+        """Разбор уже прочитанных отчётов: строки каждого activity отчёта перебираются дважды."""
         # 1. parse tickers info
-        for ac_fname in activity_csvs:
-            with open(ac_fname, newline='') as ac_fh:
-                self._real_parse_activity_csv(
-                    csv.reader(ac_fh, delimiter=','),
-                    {
-                        'Financial Instrument Information': self._parse_instrument_information,
-                    },
-                )
+        for activity_rows in activity_reports:
+            self._real_parse_activity_csv(
+                iter(activity_rows),
+                {
+                    'Financial Instrument Information': self._parse_instrument_information,
+                },
+            )
 
         # 2. parse settle_date from trade confirmation
-        for tc_fname in trade_confirmation_csvs:
-            with open(tc_fname, newline='') as tc_fh:
-                self._parse_trade_confirmation_csv(csv.reader(tc_fh, delimiter=','))
+        for confirmation_rows in trade_confirmations:
+            self._parse_trade_confirmation_csv(iter(confirmation_rows))
 
         # 3. parse everything else from activity (trades, dividends, ...)
-        for activity_fname in activity_csvs:
-            with open(activity_fname, newline='') as activity_fh:
-                self._real_parse_activity_csv(
-                    csv.reader(activity_fh, delimiter=','),
-                    {
-                        'Trades': self._parse_trades,
-                        'Dividends': self._parse_dividends,
-                        'Withholding Tax': self._parse_withholding_tax,
-                        'Deposits & Withdrawals': self._parse_deposits,
-                        'Account Information': self._parse_account_information,
-                        # 'Account Information', 'Cash Report', 'Change in Dividend Accruals', 'Change in NAV',
-                        # 'Codes',
-                        'Fees': self._parse_fees,
-                        # 'Interest Accruals',
-                        'Interest': self._parse_interests,
-                        # 'Mark-to-Market Performance Summary',
-                        # 'Net Asset Value', 'Notes/Legal Notes', 'Open Positions', 'Realized & Unrealized Performance Summary',
-                        # 'Statement', '\ufeffStatement', 'Total P/L for Statement Period', 'Transaction Fees',
-                        'Cash Report': self._parse_cash_report,
-                    },
-                )
+        for activity_rows in activity_reports:
+            self._real_parse_activity_csv(
+                iter(activity_rows),
+                {
+                    'Trades': self._parse_trades,
+                    'Dividends': self._parse_dividends,
+                    'Withholding Tax': self._parse_withholding_tax,
+                    'Deposits & Withdrawals': self._parse_deposits,
+                    'Account Information': self._parse_account_information,
+                    # 'Account Information', 'Cash Report', 'Change in Dividend Accruals', 'Change in NAV',
+                    # 'Codes',
+                    'Fees': self._parse_fees,
+                    # 'Interest Accruals',
+                    'Interest': self._parse_interests,
+                    # 'Mark-to-Market Performance Summary',
+                    # 'Net Asset Value', 'Notes/Legal Notes', 'Open Positions', 'Realized & Unrealized Performance Summary',
+                    # 'Statement', '\ufeffStatement', 'Total P/L for Statement Period', 'Transaction Fees',
+                    'Cash Report': self._parse_cash_report,
+                },
+            )
 
         # 4. sort
         self._trades.sort(key=lambda x: x.trade_date)
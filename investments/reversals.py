@@ -0,0 +1,52 @@
+"""
+Исключение операций, отменённых сторнированием (Reversal).
+
+Операция и её отмена совпадают по дате, описанию, валюте и модулю суммы, но имеют противоположные знаки.
+Каждая отмена гасит самую раннюю ещё не погашенную операцию с тем же ключом, список обходится один раз.
+
+"""
+
+from collections import defaultdict, deque
+from decimal import Decimal
+from typing import Callable, Deque, Dict, Hashable, Iterable, List, Optional, Tuple, TypeVar
+
+from investments.dividend import Dividend
+from investments.fees import Fee
+
+T = TypeVar('T')
+
+
+def cancel_reversals(items: Iterable[T], key: Callable[[T], Hashable], amount: Callable[[T], Decimal]) -> List[T]:
+    kept: List[Optional[T]] = []
+    pending: Dict[Tuple[Hashable, int], Deque[int]] = defaultdict(deque)
+
+    for item in items:
+        value = amount(item)
+        sign = (value > 0) - (value < 0)
+        item_key = key(item)
+        if sign:
+            opposite = pending.get((item_key, -sign))
+            if opposite:
+                kept[opposite.popleft()] = None
+                continue
+            pending[(item_key, sign)].append(len(kept))
+        kept.append(item)
+
+    return [x for x in kept if x is not None]
+
+
+def cancel_fee_reversals(fees: Iterable[Fee]) -> List[Fee]:
+    return cancel_reversals(
+        fees,
+        key=lambda x: (x.date, x.description, x.amount.currency, abs(x.amount.amount)),
+        amount=lambda x: x.amount.amount,
+    )
+
+
+def cancel_dividend_reversals(dividends: Iterable[Dividend]) -> List[Dividend]:
+    """Отмену, найденную в том же отчёте, парсер уже вычел из суммы дивиденда - такие обнулённые записи тоже исключаются."""
+    return cancel_reversals(
+        (x for x in dividends if x.amount.amount != 0 or x.tax.amount != 0),
+        key=lambda x: (x.date, x.ticker, x.dtype, x.amount.currency, abs(x.amount.amount)),
+        amount=lambda x: x.amount.amount,
+    )
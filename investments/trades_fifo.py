@@ -50,58 +50,64 @@ class TradesAnalyzer:
         active_trades = _TradesFIFO()
 
         for trade in trades:
-            total_profit = None
-
-            quantity = trade.quantity
-            while quantity != 0:
-                matched_trade, q = active_trades.match(quantity, trade.ticker)
-                if matched_trade is None:
-                    assert q == 0
-                    break
-                assert q != 0
-
-                total_cost = compute_total_cost(q, matched_trade.price, matched_trade.fee_per_piece)
-
-                finished_trade = FinishedTrade(
-                    finished_trade_id,
-                    trade.ticker,
-                    matched_trade.trade_date,
-                    matched_trade.settle_date,
-                    q,
-                    matched_trade.price,
-                    matched_trade.fee_per_piece,
-                )
-                self._finished_trades.append(finished_trade)
-
-                q = -1 * q
-
-                profit = compute_total_cost(q, trade.price, trade.fee_per_piece) + total_cost
-                if total_profit is None:
-                    total_profit = profit
-                else:
-                    total_profit += profit
-
-                quantity -= q
-
-            if total_profit is not None:
-                q = trade.quantity - quantity
-                self._finished_trades.append(
-                    FinishedTrade(
-                        finished_trade_id,
-                        trade.ticker,
-                        trade.trade_date,
-                        trade.settle_date,
-                        q,
-                        trade.price,
-                        trade.fee_per_piece,
-                    )
-                )
-                finished_trade_id += 1
+            finished_trade_id = _match_trade(trade, active_trades, finished_trade_id, self._finished_trades)
 
-            if quantity != 0:
-                active_trades.put(quantity, trade)
+        self._portfolio = active_trades.portfolio()
+
+    @property
+    def finished_trades(self) -> List[FinishedTrade]:
+        return self._finished_trades
+
+    @property
+    def final_portfolio(self) -> List[PortfolioElement]:
+        return self._portfolio
+
+
+class _Checkpoint(NamedTuple):
+    trades_count: int
+    finished_trades_count: int
+    finished_trade_id: int
+    active_trades: Dict[Ticker, List[Dict[str, Any]]]
+
+
+class IncrementalTradesAnalyzer:
+    """
+    FIFO для меняющегося списка сделок: update() пересчитывает только сделки начиная с первой изменённой.
+
+    Перед каждой checkpoint_every сделкой сохраняется состояние FIFO (открытые позиции и номер следующей закрытой сделки),
+    пересчёт начинается с последней сохранённой точки перед изменением, закрытые до неё сделки не пересчитываются.
+
+    """
+
+    def __init__(self, checkpoint_every: int = 256):
+        assert checkpoint_every > 0
+        self._checkpoint_every = checkpoint_every
+        self._trades: List[Trade] = []
+        self._checkpoints: List[_Checkpoint] = []
+        self._finished_trades: List[FinishedTrade] = []
+        self._portfolio: List[PortfolioElement] = []
+
+    def update(self, trades: List[Trade]) -> int:
+        """Пересчёт по новому списку сделок, отсортированному по дате. Возвращает количество закрытых сделок, которые остались без изменений."""
+        changed = next((i for i, (old, new) in enumerate(zip(self._trades, trades, strict=False)) if old != new), min(len(self._trades), len(trades)))
+        if changed == len(self._trades) == len(trades):
+            return len(self._finished_trades)
+
+        while self._checkpoints and self._checkpoints[-1].trades_count > changed:
+            self._checkpoints.pop()
+        checkpoint = self._checkpoints[-1] if self._checkpoints else _Checkpoint(0, 0, 1, {})
 
-        self._portfolio = [PortfolioElement(quantity=element['quantity'], ticker=element['ticker']) for element in active_trades.unmatched()]
+        del self._finished_trades[checkpoint.finished_trades_count :]
+        finished_trade_id = checkpoint.finished_trade_id
+        active_trades = _TradesFIFO(checkpoint.active_trades)
+        for i in range(checkpoint.trades_count, len(trades)):
+            if i % self._checkpoint_every == 0 and i > checkpoint.trades_count:
+                self._checkpoints.append(_Checkpoint(i, len(self._finished_trades), finished_trade_id, active_trades.snapshot()))
+            finished_trade_id = _match_trade(trades[i], active_trades, finished_trade_id, self._finished_trades)
+
+        self._trades = list(trades)
+        self._portfolio = active_trades.portfolio()
+        return checkpoint.finished_trades_count
 
     @property
     def finished_trades(self) -> List[FinishedTrade]:
@@ -112,9 +118,71 @@ class TradesAnalyzer:
         return self._portfolio
 
 
+def _match_trade(trade: Trade, active_trades: '_TradesFIFO', finished_trade_id: int, finished_trades: List[FinishedTrade]) -> int:
+    """Закрытие позиций сделкой trade по FIFO, закрытые сделки добавляются в finished_trades. Возвращает номер следующей закрытой сделки."""
+    total_profit = None
+
+    quantity = trade.quantity
+    while quantity != 0:
+        matched_trade, q = active_trades.match(quantity, trade.ticker)
+        if matched_trade is None:
+            assert q == 0
+            break
+        assert q != 0
+
+        total_cost = compute_total_cost(q, matched_trade.price, matched_trade.fee_per_piece)
+
+        finished_trade = FinishedTrade(
+            finished_trade_id,
+            trade.ticker,
+            matched_trade.trade_date,
+            matched_trade.settle_date,
+            q,
+            matched_trade.price,
+            matched_trade.fee_per_piece,
+        )
+        finished_trades.append(finished_trade)
+
+        q = -1 * q
+
+        profit = compute_total_cost(q, trade.price, trade.fee_per_piece) + total_cost
+        if total_profit is None:
+            total_profit = profit
+        else:
+            total_profit += profit
+
+        quantity -= q
+
+    if total_profit is not None:
+        q = trade.quantity - quantity
+        finished_trades.append(
+            FinishedTrade(
+                finished_trade_id,
+                trade.ticker,
+                trade.trade_date,
+                trade.settle_date,
+                q,
+                trade.price,
+                trade.fee_per_piece,
+            )
+        )
+        finished_trade_id += 1
+
+    if quantity != 0:
+        active_trades.put(quantity, trade)
+
+    return finished_trade_id
+
+
 class _TradesFIFO:
-    def __init__(self):
-        self._portfolio = defaultdict(list)
+    def __init__(self, portfolio: Optional[Dict[Ticker, List[Dict[str, Any]]]] = None):
+        self._portfolio: Dict[Ticker, List[Dict[str, Any]]] = defaultdict(list)
+        for ticker, trades in (portfolio or {}).items():
+            self._portfolio[ticker] = [dict(x) for x in trades]
+
+    def snapshot(self) -> Dict[Ticker, List[Dict[str, Any]]]:
+        """Копия открытых позиций, из которой можно восстановить FIFO."""
+        return {ticker: [dict(x) for x in trades] for ticker, trades in self._portfolio.items()}
 
     @staticmethod
     def sign(v: Decimal) -> int:
@@ -184,3 +252,6 @@ class _TradesFIFO:
             if quantity != 0:
                 ret.append({'quantity': quantity, 'ticker': ticker})
         return ret
+
+    def portfolio(self) -> List[PortfolioElement]:
+        return [PortfolioElement(quantity=element['quantity'], ticker=element['ticker']) for element in self.unmatched()]
@@ -0,0 +1,58 @@
+import datetime
+import time
+
+import numpy
+
+from investments.currency import Currency
+from investments.data_providers.cache import RatesCache, RatesTable
+from investments.money import Money
+
+
+def test_rates_cache_keeps_exact_decimals(tmp_path):
+    rates = {
+        datetime.date(2020, 3, 31): Money('77.7325', Currency.RUB),
+        datetime.date(2020, 4, 1): Money('77.7300', Currency.RUB),
+        datetime.date(1999, 12, 31): Money('0.447568', Currency.RUB),
+    }
+    cache = RatesCache(str(tmp_path), 'USD.npy')
+
+    cache.put(RatesTable.from_rates(rates))
+    table = cache.get()
+
+    assert table is not None
+    assert dict(table.items()) == rates
+    assert str(table.get(datetime.date(2020, 4, 1))) == '77.7300₽'
+    assert table.get(datetime.date(2020, 4, 2)) is None
+
+
+def test_rates_cache_does_not_unpickle(tmp_path):
+    numpy.save(tmp_path / 'USD.npy', numpy.array([Money(1, Currency.RUB)], dtype=object), allow_pickle=True)
+
+    assert RatesCache(str(tmp_path), 'USD.npy').get() is None
+    assert RatesCache(str(tmp_path), 'EUR.npy').get() is None
+    assert RatesCache(None, 'USD.npy').get() is None
+
+
+def test_rates_table_merge_prefers_new_rates():
+    day = datetime.date(2020, 3, 31)
+    old = RatesTable.from_rates({day: Money('1', Currency.RUB), datetime.date(2020, 3, 30): Money('2', Currency.RUB)})
+
+    merged = old.merge(RatesTable.from_rates({day: Money('3', Currency.RUB)}))
+
+    assert len(merged) == 2
+    assert merged.get(day) == Money('3', Currency.RUB)
+
+
+def test_rates_cache_bulk_load_is_fast(tmp_path):
+    first_day = datetime.date(2000, 1, 1)
+    rates = {first_day + datetime.timedelta(days=i): Money(f'{50 + i % 100}.{i % 10000:04d}', Currency.RUB) for i in range(9000)}
+    table = RatesTable.from_rates(rates)
+    for i in range(20):
+        RatesCache(str(tmp_path), f'cur{i}.npy').put(table)
+
+    started = time.perf_counter()
+    tables = [RatesCache(str(tmp_path), f'cur{i}.npy').get() for i in range(20)]
+    elapsed = time.perf_counter() - started
+
+    assert all(t is not None and len(t) == 9000 for t in tables)
+    assert elapsed < 0.5
@@ -1,12 +1,11 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from types import SimpleNamespace
 
 import pytest  # type: ignore
 from requests.exceptions import ConnectionError
 
 from investments.currency import Currency
-from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.data_providers.cbr import RATES_LOOKBACK, ExchangeRatesRUB, RatesRange, plan_rates_fetch
 from investments.money import Money
 
 test_cases = [
@@ -55,8 +54,7 @@ def test_convert_to_rub():
 
 
 def test_exchange_rate_uses_per_unit_rate(monkeypatch):
-    response = SimpleNamespace(
-        text="""<?xml version='1.0' encoding='windows-1251'?>
+    response = """<?xml version='1.0' encoding='windows-1251'?>
         <ValCurs ID="R01820">
             <Record Date="10.06.2026" Id="R01820">
                 <Nominal>100</Nominal>
@@ -64,9 +62,93 @@ def test_exchange_rate_uses_per_unit_rate(monkeypatch):
                 <VunitRate>0,447568</VunitRate>
             </Record>
         </ValCurs>"""
-    )
-    monkeypatch.setattr('investments.data_providers.cbr.requests.get', lambda *args, **kwargs: response)
+    monkeypatch.setattr('investments.data_providers.http.HttpClient.get_text', lambda self, url: response)
 
     rate = ExchangeRatesRUB(year_from=2026).get_rate(Currency.YEN, datetime(2026, 6, 10))
 
     assert rate == Money('0.447568', Currency.RUB)
+
+
+def test_plan_rates_fetch_dynamic_ranges():
+    plan = plan_rates_fetch(
+        {
+            Currency.USD: [date(2020, 1, 9), date(2020, 3, 31), date(2020, 2, 4)],
+            Currency.EUR: [date(2015, 1, 15)] + [date(2016, 1, 1) + timedelta(days=i) for i in range(300)],
+            Currency.RUB: [date(2015, 1, 15)],
+        }
+    )
+
+    assert plan.daily_dates == []
+    assert plan.ranges == [
+        RatesRange(Currency.USD, date(2020, 1, 9) - RATES_LOOKBACK, date(2020, 3, 31)),
+        RatesRange(Currency.EUR, date(2015, 1, 15) - RATES_LOOKBACK, date(2016, 10, 26)),
+    ]
+
+
+def test_plan_rates_fetch_sparse_dates():
+    plan = plan_rates_fetch({Currency.USD: [date(2015, 1, 15), date(2020, 3, 31)], Currency.EUR: [date(2020, 3, 31)]})
+
+    assert plan.ranges == []
+    assert plan.daily_dates == [date(2015, 1, 15), date(2020, 3, 31)]
+    assert plan.daily_currencies == [Currency.USD, Currency.EUR]
+
+
+def test_prefetch_daily(monkeypatch):
+    requested_urls = []
+
+    def fake_get_text(self, url):
+        requested_urls.append(url)
+        return """<?xml version='1.0' encoding='windows-1251'?>
+            <ValCurs Date="31.03.2020" name="Foreign Currency Market">
+                <Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode><Nominal>1</Nominal><Value>77,7325</Value></Valute>
+                <Valute ID="R01820"><NumCode>392</NumCode><CharCode>JPY</CharCode><Nominal>100</Nominal><Value>71,9563</Value></Valute>
+            </ValCurs>"""
+
+    monkeypatch.setattr('investments.data_providers.http.HttpClient.get_text', fake_get_text)
+
+    p = ExchangeRatesRUB(year_from=2020)
+    p.prefetch({Currency.USD: [date(2020, 3, 31)], Currency.YEN: [date(2020, 3, 31)]})
+
+    assert p.get_rate(Currency.USD, datetime(2020, 3, 31)) == Money('77.7325', Currency.RUB)
+    assert p.get_rate(Currency.YEN, datetime(2020, 3, 31)) == Money('0.719563', Currency.RUB)
+    assert requested_urls == ['http://www.cbr.ru/scripts/XML_daily.asp?date_req=31/03/2020']
+
+
+def test_offline_rates_after_import(tmp_path, monkeypatch):
+    bundle = tmp_path / 'rates.csv'
+    bundle.write_text('currency,date,rate\nUSD,2020-03-27,77.7325\nUSD,2020-03-31,77.7325\nEUR,2020-03-31,85.7389\n')
+
+    def no_network(*args, **kwargs):
+        raise AssertionError('network is not expected in offline mode')
+
+    monkeypatch.setattr('investments.data_providers.http.HttpClient.get_text', no_network)
+
+    ExchangeRatesRUB(cache_dir=str(tmp_path / 'cache'), offline=True).import_rates(str(bundle))
+
+    p = ExchangeRatesRUB(year_from=2020, cache_dir=str(tmp_path / 'cache'), offline=True)
+    p.prefetch({Currency.USD: [date(2020, 3, 27)], Currency.EUR: [date(2020, 3, 31)]})
+
+    assert p.get_rate(Currency.USD, datetime(2020, 3, 27)) == Money('77.7325', Currency.RUB)
+    assert p.get_rate(Currency.EUR, datetime(2020, 3, 31)) == Money('85.7389', Currency.RUB)
+
+    with pytest.raises(KeyError, match='no CHF rate'):
+        p.get_rate(Currency.CHF, datetime(2020, 3, 31))
+
+    p.export_rates(str(tmp_path / 'exported.json'))
+    exported = ExchangeRatesRUB(offline=True)
+    exported.import_rates(str(tmp_path / 'exported.json'))
+    assert exported.get_rate(Currency.USD, datetime(2020, 3, 31)) == Money('77.7325', Currency.RUB)
+
+
+def test_unpublished_rates(tmp_path):
+    future = date.today() + timedelta(days=2)
+    bundle = tmp_path / 'rates.csv'
+    bundle.write_text(f'currency,date,rate\nUSD,2020-03-31,77.7325\nUSD,{future},90\n')
+    p = ExchangeRatesRUB(cache_dir=str(tmp_path / 'cache'), offline=True)
+    p.import_rates(str(bundle))
+
+    p.get_rate(Currency.USD, datetime(2020, 3, 31))
+    p.get_rate(Currency.RUB, future)
+    assert not p.used_unpublished_rates
+    p.get_rate(Currency.USD, future)
+    assert p.used_unpublished_rates
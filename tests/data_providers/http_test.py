@@ -0,0 +1,148 @@
+import threading
+import time
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import pytest  # type: ignore
+import requests
+
+from investments.currency import Currency
+from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.data_providers.http import CircuitOpenError, HttpClient
+from investments.money import Money
+
+
+class StandInServer:
+    """Локальный сервер вместо cbr.ru: отвечает по сценарию, добавляя задержки и ошибки."""
+
+    def __init__(self):
+        self.script: List[tuple] = []  # (status, delay), по одному на запрос; дальше - 200 без задержки
+        self.body = 'ok'
+        self.requests = 0
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.requests += 1
+                    stand_in.connections.add(self.client_address)
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                    status, delay = stand_in.script.pop(0) if stand_in.script else (200, 0)
+                try:
+                    time.sleep(delay)
+                    body = stand_in.body.encode()
+                    self.send_response(status)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with stand_in._lock:
+                        stand_in.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def server():
+    s = StandInServer()
+    yield s
+    s.close()
+
+
+def test_keep_alive(server):
+    client = HttpClient()
+    for _ in range(5):
+        assert client.get_text(f'{server.url}/') == 'ok'
+
+    assert server.requests == 5
+    assert len(server.connections) == 1
+    assert client.requests_count == 5
+    assert client.bytes_received == 10
+
+
+def test_retry_errors_and_timeouts(server):
+    server.script = [(503, 0), (200, 1), (500, 0)]
+    client = HttpClient(retries=3, backoff=0.01, timeout=0.3)
+
+    assert client.get_text(f'{server.url}/') == 'ok'
+    assert server.requests == 4
+    assert client.retries_count == 3
+
+
+def test_no_retry_on_client_error(server):
+    server.script = [(404, 0)]
+    client = HttpClient(retries=3, backoff=0.01)
+
+    with pytest.raises(requests.HTTPError):
+        client.get_text(f'{server.url}/')
+    assert server.requests == 1
+
+
+def test_circuit_breaker(server):
+    server.script = [(503, 0)] * 4
+    client = HttpClient(retries=1, backoff=0.01, failure_threshold=2, reset_timeout=0.2)
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.get_text(f'{server.url}/')
+    assert server.requests == 4
+
+    # цепь разомкнута: запросы не доходят до сервера
+    with pytest.raises(CircuitOpenError):
+        client.get_text(f'{server.url}/')
+    assert server.requests == 4
+
+    time.sleep(0.25)
+    assert client.get_text(f'{server.url}/') == 'ok'
+    assert client.get_text(f'{server.url}/') == 'ok'
+
+
+def test_bounded_concurrency(server):
+    server.script = [(200, 0.1)] * 8
+    client = HttpClient(max_concurrency=2)
+
+    threads = [threading.Thread(target=client.get_text, args=(f'{server.url}/',)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert server.requests == 8
+    assert server.max_in_flight == 2
+
+
+def test_stale_rates_when_cbr_unavailable(server, tmp_path, caplog):
+    cache_dir = str(tmp_path)
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True)._store.save(Currency.USD, {date(2020, 3, 27): Money('77.7325', Currency.RUB)})
+
+    server.script = [(503, 0)] * 100
+    client = HttpClient(retries=1, backoff=0.01, failure_threshold=1, reset_timeout=60)
+    p = ExchangeRatesRUB(year_from=2020, cache_dir=cache_dir, http_client=client, cbr_url=server.url)
+    p.prefetch({Currency.USD: [date(2020, 3, 31)]})
+
+    assert p.get_rate(Currency.USD, datetime(2020, 3, 31)) == Money('77.7325', Currency.RUB)
+    assert 'use stale USD rate' in caplog.text
+    with pytest.raises(KeyError, match='no EUR rate'):
+        p.get_rate(Currency.EUR, datetime(2020, 3, 31))
+    assert server.requests == 2
@@ -0,0 +1,29 @@
+import datetime
+
+import pytest
+
+from investments.currency import Currency
+from investments.data_providers.rates_bundle import read_rates_bundle, write_rates_bundle
+from investments.money import Money
+
+
+@pytest.mark.parametrize('filename', ['rates.csv', 'rates.json'])
+def test_rates_bundle_roundtrip(tmp_path, filename):
+    rates = {
+        Currency.USD: {datetime.date(2020, 3, 31): Money('77.7325', Currency.RUB), datetime.date(2020, 1, 9): Money('61.9057', Currency.RUB)},
+        Currency.YEN: {datetime.date(2026, 6, 10): Money('0.447568', Currency.RUB)},
+    }
+    filepath = str(tmp_path / filename)
+
+    write_rates_bundle(filepath, rates)
+
+    assert read_rates_bundle(filepath) == rates
+
+
+def test_rates_bundle_keeps_exact_decimals(tmp_path):
+    filepath = str(tmp_path / 'rates.csv')
+
+    write_rates_bundle(filepath, {Currency.EUR: {datetime.date(2015, 1, 15): Money('77.9629', Currency.RUB)}})
+
+    with open(filepath) as fh:
+        assert fh.read().splitlines() == ['currency,date,rate', 'EUR,2015-01-15,77.9629']
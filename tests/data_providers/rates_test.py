@@ -0,0 +1,93 @@
+import datetime
+from typing import Dict, Optional
+
+import pytest
+
+from investments.currency import Currency
+from investments.data_providers.rates import LayerStats, LruRatesLayer, PreloadedRates, RatesChain, RatesLayer, RequiredRates, StoreRatesLayer
+from investments.money import Money
+
+
+class StandInRatesLayer(RatesLayer):
+    name = 'stand-in'
+
+    def __init__(self, rates: Dict[datetime.date, Money]):
+        super().__init__()
+        self._rates = rates
+        self._loaded: Dict[Currency, Dict[datetime.date, Money]] = {}
+        self.prefetched: RequiredRates = {}
+
+    def get(self, currency: Currency, day: datetime.date) -> Optional[Money]:
+        rate = self._rates.get(day)
+        if rate is not None:
+            self._loaded.setdefault(currency, {})[day] = rate
+        return rate
+
+    def prefetch(self, required: RequiredRates) -> RequiredRates:
+        self.prefetched = required
+        return super().prefetch(required)
+
+    def take_loaded(self) -> Dict[Currency, Dict[datetime.date, Money]]:
+        loaded, self._loaded = self._loaded, {}
+        return loaded
+
+
+def test_rates_chain_layers_hits(tmp_path):
+    day = datetime.date(2020, 3, 31)
+    remote = StandInRatesLayer({day: Money('77.7325', Currency.RUB)})
+    store = StoreRatesLayer('store', str(tmp_path), 'rates_{code}.cache')
+    chain = RatesChain([LruRatesLayer(), store, remote])
+
+    assert chain.get_rate(Currency.USD, datetime.datetime(2020, 3, 31)) == Money('77.7325', Currency.RUB)
+    assert chain.get_rate(Currency.USD, datetime.datetime(2020, 3, 31)) == Money('77.7325', Currency.RUB)
+    assert chain.get_rate(Currency.RUB, datetime.datetime(2020, 3, 31)) == Money(1, Currency.RUB)
+    assert chain.stats() == [LayerStats('lru', 1, 1), LayerStats('store', 0, 1), LayerStats('stand-in', 1, 0)]
+
+    # курс, загруженный нижним слоем, сохранён в локальном хранилище
+    restarted = RatesChain([LruRatesLayer(), StoreRatesLayer('store', str(tmp_path), 'rates_{code}.cache')])
+    assert restarted.get_rate(Currency.USD, day) == Money('77.7325', Currency.RUB)
+
+    with pytest.raises(KeyError):
+        restarted.get_rate(Currency.USD, datetime.date(2020, 4, 1))
+
+
+def test_rates_chain_prefetch_skips_covered_dates():
+    known, unknown = datetime.date(2020, 3, 30), datetime.date(2020, 3, 31)
+    store = StoreRatesLayer('store', None, 'rates_{code}.cache')
+    store.save(Currency.USD, {known: Money('77.0', Currency.RUB)})
+    remote = StandInRatesLayer({unknown: Money('77.7325', Currency.RUB)})
+
+    RatesChain([LruRatesLayer(), store, remote]).prefetch({Currency.USD: [known, unknown], Currency.RUB: [known]})
+
+    assert remote.prefetched == {Currency.USD: {unknown}}
+    assert store.get(Currency.USD, unknown) == Money('77.7325', Currency.RUB)
+
+
+def test_preloaded_rates():
+    known, unknown = datetime.date(2020, 3, 30), datetime.date(2020, 3, 31)
+    remote = StandInRatesLayer({known: Money('77.0', Currency.RUB)})
+    chain = RatesChain([LruRatesLayer(), remote])
+
+    rates = PreloadedRates(chain, {Currency.USD: [known, unknown]})
+    assert remote.prefetched == {Currency.USD: {known, unknown}}
+    stats = chain.stats()
+
+    # загруженный курс читается без обращения к цепочке, остальные - из неё
+    assert rates.get_rate(Currency.USD, datetime.datetime(2020, 3, 30)) == Money('77.0', Currency.RUB)
+    assert chain.stats() == stats
+    assert rates.get_rate(Currency.RUB, known) == Money(1, Currency.RUB)
+    with pytest.raises(KeyError):
+        rates.get_rate(Currency.USD, unknown)
+
+
+def test_lru_rates_layer_evicts_oldest():
+    lru = LruRatesLayer(maxsize=2)
+    days = [datetime.date(2020, 1, d) for d in (1, 2, 3)]
+    lru.put(Currency.USD, days[0], Money(1, Currency.RUB))
+    lru.put(Currency.USD, days[1], Money(2, Currency.RUB))
+    assert lru.get(Currency.USD, days[0]) == Money(1, Currency.RUB)
+
+    lru.put(Currency.USD, days[2], Money(3, Currency.RUB))
+
+    assert lru.get(Currency.USD, days[1]) is None
+    assert lru.get(Currency.USD, days[0]) == Money(1, Currency.RUB)
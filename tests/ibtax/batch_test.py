@@ -0,0 +1,64 @@
+import json
+
+import pytest  # type: ignore
+
+from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.ibtax.batch import read_manifest, run_batch
+from tests.ibtax.samples import ACTIVITY, CONFIRMATION, RATES
+
+
+def _write_manifest(tmp_path, accounts) -> str:
+    for name in ('a', 'b'):
+        (tmp_path / name / 'activity').mkdir(parents=True)
+        (tmp_path / name / 'confirmation').mkdir(parents=True)
+        (tmp_path / name / 'activity' / '2020.csv').write_text(ACTIVITY)
+        (tmp_path / name / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+
+    manifest = tmp_path / 'accounts.json'
+    manifest.write_text(json.dumps(accounts))
+    return str(manifest)
+
+
+def test_read_manifest(tmp_path):
+    manifest = _write_manifest(
+        tmp_path,
+        [
+            {'name': 'a', 'activity_reports_dir': 'a/activity', 'confirmation_reports_dir': 'a/confirmation'},
+            {'name': 'b', 'activity_reports_dir': 'b/activity', 'confirmation_reports_dir': 'b/confirmation', 'years': [2021], 'save_to': 'b.csv', 'report_type': 'csv'},
+        ],
+    )
+
+    a, b = read_manifest(manifest, 'out')
+    assert a.activity_reports_dir == str(tmp_path / 'a' / 'activity')
+    assert a.save_to == 'out/a.txt'
+    assert a.years == []
+    assert (b.save_to, b.years, b.report_type) == (str(tmp_path / 'b.csv'), [2021], 'csv')
+
+    (tmp_path / 'bad.json').write_text(json.dumps([{'name': 'a', 'activity_reports_dir': 'a', 'confirmation_reports_dir': 'b', 'year': [2020]}]))
+    with pytest.raises(ValueError, match='unknown fields'):
+        read_manifest(str(tmp_path / 'bad.json'), 'out')
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_run_batch(tmp_path, jobs):
+    manifest = _write_manifest(
+        tmp_path,
+        [
+            {'name': 'a', 'activity_reports_dir': 'a/activity', 'confirmation_reports_dir': 'a/confirmation'},
+            {'name': 'b', 'activity_reports_dir': 'b/activity', 'confirmation_reports_dir': 'b/confirmation', 'years': [2020], 'report_type': 'jsonl'},
+            {'name': 'missing', 'activity_reports_dir': 'missing/activity', 'confirmation_reports_dir': 'missing/confirmation'},
+        ],
+    )
+    (tmp_path / 'rates.csv').write_text(RATES)
+    ExchangeRatesRUB(cache_dir=str(tmp_path / 'cache'), offline=True).import_rates(str(tmp_path / 'rates.csv'))
+
+    results = run_batch(read_manifest(manifest, str(tmp_path / 'out')), str(tmp_path / 'cache'), offline=True, jobs=jobs)
+
+    assert [(x.account.name, x.error) for x in results[:2]] == [('a', None), ('b', None)]
+    assert results[2].error.startswith('FileNotFoundError')
+    assert [x.name for x in results[0].profiler.stages][:2] == ['parse', 'fifo']
+
+    report = (tmp_path / 'out' / 'a.txt').read_text()
+    assert '2021' in report and 'VT' in report
+    # за 2020 сделок нет - только портфель
+    assert [json.loads(x)['report'] for x in (tmp_path / 'out' / 'b.jsonl').read_text().splitlines()] == ['portfolio']
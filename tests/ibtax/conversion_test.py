@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+import pandas  # type: ignore
+
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.ibtax.conversion import append_rub_columns, currency_column
+from investments.money import Money
+
+
+class CountingRates(RatesProvider):
+    def __init__(self):
+        self.calls = 0
+
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        self.calls += 1
+        if currency is Currency.RUB:
+            return Money(1, Currency.RUB)
+        return Money({Currency.USD: '73.1', Currency.EUR: '89.25'}[currency], Currency.RUB)
+
+
+def test_append_rub_columns():
+    df = pandas.DataFrame(
+        [
+            (datetime.date(2021, 1, 5), Decimal('10.5'), Decimal('-1.05')),
+            (datetime.date(2021, 1, 5), Decimal('2'), Decimal(0)),
+            (datetime.date(2021, 1, 5), Decimal('3.333'), Decimal('-0.5')),
+            (datetime.date(2021, 1, 6), Decimal('100.10'), Decimal('-13.01')),
+        ],
+        columns=['date', 'amount', 'tax_paid'],
+    )
+    df['date'] = pandas.to_datetime(df['date'])
+    df['currency'] = currency_column([Currency.USD, Currency.EUR, Currency.USD, Currency.RUB])
+    rates = CountingRates()
+
+    append_rub_columns(df, rates, ['amount', 'tax_paid'])
+
+    assert list(df.columns) == ['date', 'amount', 'tax_paid', 'currency', 'rate', 'amount_rub', 'tax_paid_rub']
+    assert df['rate'].tolist() == [Decimal('73.1'), Decimal('89.25'), Decimal('73.1'), Decimal(1)]
+    assert [str(x) for x in df['amount_rub']] == ['767.55', '178.50', '243.6423', '100.10']
+    assert df['tax_paid_rub'].tolist() == [Decimal('-76.755'), Decimal(0), Decimal('-36.55'), Decimal('-13.01')]
+
+    # курс на пару (валюта, дата) запрашивается один раз
+    assert rates.calls == 3
+
+
+def test_append_rub_columns_empty():
+    df = pandas.DataFrame([], columns=['date', 'amount'])
+    df['currency'] = currency_column([])
+
+    append_rub_columns(df, CountingRates(), ['amount'])
+
+    assert df.empty
+    assert list(df.columns) == ['date', 'amount', 'currency', 'rate', 'amount_rub']
@@ -0,0 +1,99 @@
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.dividend import Dividend
+from investments.ibtax.export_presenter import CsvReportPresenter, JsonLinesReportPresenter
+from investments.ibtax.ibtax import prepare_dividends_report, prepare_trades_report
+from investments.money import Money
+from investments.ticker import Ticker, TickerKind
+from investments.trades_fifo import FinishedTrade, PortfolioElement
+
+
+class FixedRates(RatesProvider):
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        return Money(1 if currency is Currency.RUB else '73.1234', Currency.RUB)
+
+
+def _reports():
+    ticker = Ticker('VT', TickerKind.Stock)
+    trades = [
+        FinishedTrade(
+            N=1,
+            ticker=ticker,
+            trade_date=datetime.datetime(2020, 3, 2, 10),
+            settle_date=datetime.date(2020, 3, 4),
+            quantity=3,
+            price=Money('10.01', Currency.USD),
+            fee_per_piece=Money('-0.3333333', Currency.USD),
+        ),
+        FinishedTrade(
+            N=1,
+            ticker=ticker,
+            trade_date=datetime.datetime(2021, 1, 5, 10),
+            settle_date=datetime.date(2021, 1, 7),
+            quantity=-3,
+            price=Money('12.5', Currency.USD),
+            fee_per_piece=Money(-1, Currency.USD),
+        ),
+    ]
+    dividends = [Dividend(dtype='', ticker=ticker, date=datetime.date(2020, 3, 31), amount=Money('10.5', Currency.USD), tax=Money('-1.05', Currency.USD))]
+    return prepare_trades_report(trades, FixedRates()), prepare_dividends_report(dividends, FixedRates(), False), [PortfolioElement(ticker, Decimal('1.5'))]
+
+
+def test_csv_export():
+    trades, dividends, portfolio = _reports()
+    output = io.StringIO()
+    presenter = CsvReportPresenter(output=output)
+    presenter.prepare_report(trades, dividends, None, None, portfolio, [])
+    presenter.present()
+
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert [row[:2] for row in rows] == [
+        ['Trades', 'Header'],
+        ['Trades', 'Data'],
+        ['Trades', 'Data'],
+        ['Dividends', 'Header'],
+        ['Dividends', 'Data'],
+        ['Portfolio', 'Header'],
+        ['Portfolio', 'Data'],
+    ]
+    first_trade = dict(zip(rows[0][2:], rows[1][2:], strict=True))
+    assert first_trade['ticker'] == 'VT'
+    assert first_trade['trade_date'] == '2020-03-02'
+    assert first_trade['tax_year'] == '2021'
+    assert first_trade['currency'] == 'USD'
+    assert first_trade['total_rub'] == str(trades['total_rub'][0])
+    assert Decimal(first_trade['fee_per_piece_rub']) == Decimal('-0.3333333') * Decimal('73.1234')
+    assert rows[-1] == ['Portfolio', 'Data', 'VT', 'Stock', '1.5']
+
+
+def test_jsonl_export_filter_years():
+    trades, dividends, portfolio = _reports()
+    output = io.StringIO()
+    presenter = JsonLinesReportPresenter(output=output)
+    presenter.prepare_report(trades, dividends, None, None, portfolio, [2020])
+    presenter.present()
+
+    lines = [json.loads(x) for x in output.getvalue().splitlines()]
+    # сделка закрыта в 2021 - в выгрузку за 2020 не попадает
+    assert [x['report'] for x in lines] == ['dividends', 'portfolio']
+    assert lines[0] == {
+        'report': 'dividends',
+        'N': 1,
+        'ticker': 'VT',
+        'ticker_kind': 'Stock',
+        'date': '2020-03-31',
+        'tax_year': 2020,
+        'currency': 'USD',
+        'amount': '10.5',
+        'tax_paid': '-1.05',
+        'rate': '73.1234',
+        'amount_rub': '767.79570',
+        'tax_paid_rub': '-76.779570',
+        'tax_rate': '-10.00',
+    }
@@ -0,0 +1,61 @@
+import os
+
+import pandas  # type: ignore
+
+from investments.data_providers.cbr import ExchangeRatesRUB, rates_data_version
+from investments.ibtax.ibtax import analyze_reports, csvs_in_dir, prepare_reports
+from investments.ibtax.memo import MEMO_DIR, ReportMemo
+from investments.ibtax.profiler import Profiler
+from investments.ibtax.report_presenter import NativeReportPresenter
+from tests.ibtax.samples import ACTIVITY, CONFIRMATION, RATES
+
+
+def _memo(tmp_path, output_options=('native', 'print')) -> ReportMemo:
+    return ReportMemo(str(tmp_path / 'cache'), csvs_in_dir(str(tmp_path / 'activity')), csvs_in_dir(str(tmp_path / 'confirmation')), [[], False], list(output_options))
+
+
+def test_memo(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    (tmp_path / 'rates.csv').write_text(RATES)
+    assert rates_data_version(cache_dir) == rates_data_version(str(tmp_path / 'missing'))
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True).import_rates(str(tmp_path / 'rates.csv'))
+    (tmp_path / 'activity').mkdir()
+    (tmp_path / 'confirmation').mkdir()
+    (tmp_path / 'activity' / '2020.csv').write_text(ACTIVITY)
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+
+    memo = _memo(tmp_path)
+    assert memo.get_output() is None
+    assert memo.get_reports() is None
+
+    operations = analyze_reports(str(tmp_path / 'activity'), str(tmp_path / 'confirmation'), [], Profiler(enabled=False))
+    reports = prepare_reports(operations, ExchangeRatesRUB(cache_dir=cache_dir, offline=True), [], False, Profiler(enabled=False))
+    dst_filepath = str(tmp_path / 'report.txt')
+    presenter = NativeReportPresenter(dst_filepath=dst_filepath)
+    presenter.prepare_report(*reports[:4], reports.portfolio, [])
+    presenter.present()
+    memo.put(reports, dst_filepath)
+
+    assert _memo(tmp_path).get_output() == (tmp_path / 'report.txt').read_bytes()
+    # другой вид отчёта - готового вывода нет, но отчёты в рублях те же
+    other = _memo(tmp_path, ('csv', 'print'))
+    assert other.get_output() is None
+    pandas.testing.assert_frame_equal(other.get_reports().trades, reports.trades)
+    assert other.get_reports().portfolio == reports.portfolio
+
+    # запись, которую могут изменить другие пользователи, не читается
+    for entry in os.scandir(tmp_path / 'cache' / MEMO_DIR):
+        os.chmod(entry.path, 0o666)
+    assert _memo(tmp_path).get_output() is None
+    for entry in os.scandir(tmp_path / 'cache' / MEMO_DIR):
+        os.chmod(entry.path, 0o600)
+    assert _memo(tmp_path).get_output() is not None
+
+    # изменённый отчёт или новые курсы - другой ключ
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION.replace('2021-03-04', '2021-03-05'))
+    assert _memo(tmp_path).get_reports() is None
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+    assert _memo(tmp_path).get_reports() is not None
+    (tmp_path / 'rates.csv').write_text(RATES + 'USD,2021-03-05,73.0\n')
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True).import_rates(str(tmp_path / 'rates.csv'))
+    assert _memo(tmp_path).get_reports() is None
@@ -0,0 +1,53 @@
+import pandas  # type: ignore
+
+from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.ibtax.ibtax import PreparedReports, analyze_and_prepare_reports, analyze_reports, prepare_reports
+from investments.ibtax.profiler import Profiler
+from tests.ibtax.samples import ACTIVITY, CONFIRMATION, RATES
+
+DIVIDENDS = """Dividends,Header,Currency,Date,Description,Amount
+Dividends,Data,USD,2020-03-04,VT(US9220427424) Cash Dividend USD 0.5 per Share (Ordinary Dividend),5
+Dividends,Data,USD,2021-03-04,VT(US9220427424) Cash Dividend USD 0.5 per Share (Ordinary Dividend),3
+Withholding Tax,Header,Currency,Date,Description,Amount,Code
+Withholding Tax,Data,USD,2020-03-04,VT(US9220427424) Cash Dividend USD 0.5 per Share - US Tax,-0.5,
+"""
+
+
+def test_analyze_and_prepare_reports(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    (tmp_path / 'rates.csv').write_text(RATES)
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True).import_rates(str(tmp_path / 'rates.csv'))
+    (tmp_path / 'activity').mkdir()
+    (tmp_path / 'confirmation').mkdir()
+    (tmp_path / 'activity' / '2020.csv').write_text(ACTIVITY + DIVIDENDS)
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+
+    def rates_provider(year_from: int) -> ExchangeRatesRUB:
+        assert year_from == 2020
+        return ExchangeRatesRUB(year_from=year_from, cache_dir=cache_dir, offline=True)
+
+    for years, workers in (([], 1), ([], 4), ([2021], 2)):
+        operations = analyze_reports(str(tmp_path / 'activity'), str(tmp_path / 'confirmation'), years, Profiler(enabled=False))
+        expected = prepare_reports(operations, rates_provider(operations.first_year), years, False, Profiler(enabled=False))
+        assert expected.dividends is not None
+        prepared = analyze_and_prepare_reports(str(tmp_path / 'activity'), str(tmp_path / 'confirmation'), rates_provider, years, False, Profiler(), workers)
+        assert prepared is not None
+        _assert_reports_equal(prepared[0], expected)
+        _assert_reports_equal(prepare_reports(operations, rates_provider(operations.first_year), years, False, Profiler(), workers), expected)
+
+
+def _assert_reports_equal(reports: PreparedReports, expected: PreparedReports):
+    for name in ('trades', 'dividends', 'fees', 'interests'):
+        if getattr(expected, name) is None:
+            assert getattr(reports, name) is None
+        else:
+            pandas.testing.assert_frame_equal(getattr(reports, name), getattr(expected, name))
+    assert reports.portfolio == expected.portfolio
+
+
+def test_analyze_and_prepare_reports_no_trades(tmp_path):
+    (tmp_path / 'activity').mkdir()
+    (tmp_path / 'confirmation').mkdir()
+    (tmp_path / 'activity' / '2020.csv').write_text(ACTIVITY.replace('Trades,Data', 'Trades,Total'))
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+    assert analyze_and_prepare_reports(str(tmp_path / 'activity'), str(tmp_path / 'confirmation'), ExchangeRatesRUB, [], False, Profiler(enabled=False)) is None
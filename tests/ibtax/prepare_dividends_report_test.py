@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.dividend import Dividend
+from investments.ibtax.ibtax import prepare_dividends_report
+from investments.money import Money
+from investments.ticker import Ticker, TickerKind
+from tests.ibtax.samples import offline_rates
+
+
+def test_dividends_with_reversal_verbose(tmp_path):
+    ticker = Ticker(symbol='VT', kind=TickerKind.Stock)
+    dividends = [
+        Dividend(dtype='', ticker=ticker, date=datetime.date(2020, 3, 31), amount=Money('10.5', Currency.USD), tax=Money('-1.05', Currency.USD)),
+        Dividend(dtype='', ticker=ticker, date=datetime.date(2020, 3, 31), amount=Money(0, Currency.USD), tax=Money(0, Currency.USD)),
+    ]
+
+    rates = offline_rates(tmp_path, 'currency,date,rate\nUSD,2020-03-31,77.7325\n')
+
+    res = prepare_dividends_report(dividends, rates, True)
+
+    assert res['tax_year'].tolist() == [2020, 2020]
+    assert res['currency'].tolist() == [Currency.USD, Currency.USD]
+    assert res['rate'].tolist() == [Decimal('77.7325'), Decimal('77.7325')]
+    assert res['amount_rub'].tolist() == [Decimal('816.19125'), Decimal(0)]
+    assert res['tax_paid_rub'].tolist() == [Decimal('-81.619125'), Decimal(0)]
+    assert res['tax_rate'].tolist() == [-10, None]
+
+    assert prepare_dividends_report(dividends, rates, False)['N'].tolist() == [1]
+
+
+class RecordingRates(RatesProvider):
+    def __init__(self):
+        self.days = set()
+
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        self.days.add(dt)
+        return Money(70, Currency.RUB)
+
+
+def test_dividends_filter_years():
+    ticker = Ticker(symbol='VT', kind=TickerKind.Stock)
+    dividends = [
+        Dividend(dtype='', ticker=ticker, date=datetime.date(2020, 3, 31), amount=Money('10.5', Currency.USD), tax=Money('-1.05', Currency.USD)),
+        Dividend(dtype='', ticker=ticker, date=datetime.date(2021, 3, 31), amount=Money('11', Currency.USD), tax=Money('-1.1', Currency.USD)),
+    ]
+    rates = RecordingRates()
+
+    res = prepare_dividends_report(dividends, rates, False, [2021])
+
+    assert res['N'].tolist() == [2]
+    assert res['amount_rub'].tolist() == [Decimal(770)]
+    assert rates.days == {datetime.date(2021, 3, 31)}
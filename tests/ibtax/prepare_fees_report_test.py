@@ -1,21 +1,24 @@
 import datetime
+from decimal import Decimal
 
 from investments.currency import Currency
 from investments.money import Money
 from investments.fees import Fee
 from investments.data_providers.cbr import ExchangeRatesRUB
 from investments.ibtax.ibtax import prepare_fees_report
+from tests.ibtax.samples import CBR_RATES_2020, offline_rates
 
 
-def test_simple_fees_verbose():
+def test_simple_fees_verbose(tmp_path):
     fees = [
         Fee(date=datetime.datetime(2020, 1, 30, 0, 0), amount=Money(0.01, Currency.USD), description='Other Fees'),
         Fee(date=datetime.datetime(2020, 1, 30, 0, 0), amount=Money(-0.01, Currency.USD), description='Other Fees'),
     ]
-    cbr_client = ExchangeRatesRUB()
+    cbr_client = offline_rates(tmp_path, CBR_RATES_2020)
     res: dict = prepare_fees_report(fees, cbr_client, True).to_dict()
-    assert res['rate'] == {0: Money(62.3934, Currency.RUB), 1: Money(62.3934, Currency.RUB)}
-    assert res['amount_rub'] == {0: Money(0.623934, Currency.RUB), 1: Money(-0.623934, Currency.RUB)}
+    assert res['currency'] == {0: Currency.USD, 1: Currency.USD}
+    assert res['rate'] == {0: Decimal('62.3934'), 1: Decimal('62.3934')}
+    assert res['amount_rub'] == {0: Decimal('0.623934'), 1: Decimal('-0.623934')}
 
 
 def test_simple_fees_no_verbose():
@@ -37,7 +40,7 @@ def test_same_sign_fees_are_not_treated_as_reversals():
 
     res = prepare_fees_report(fees, ExchangeRatesRUB(), False)
 
-    assert res['amount'].tolist() == [Money(-1, Currency.RUB), Money(-1, Currency.RUB)]
+    assert res['amount'].tolist() == [Decimal(-1), Decimal(-1)]
 
 
 def test_fee_reversals_are_matched_one_to_one():
@@ -49,4 +52,18 @@ def test_fee_reversals_are_matched_one_to_one():
 
     res = prepare_fees_report(fees, ExchangeRatesRUB(), False)
 
-    assert res['amount'].tolist() == [Money(-1, Currency.RUB)]
+    assert res['amount'].tolist() == [Decimal(-1)]
+
+
+def test_fee_reversals_in_different_currencies(tmp_path):
+    fees = [
+        Fee(date=datetime.date(2024, 1, 1), amount=Money(-1, Currency.RUB), description='Same fee'),
+        Fee(date=datetime.date(2024, 1, 1), amount=Money(-1, Currency.USD), description='Same fee'),
+        Fee(date=datetime.date(2024, 1, 1), amount=Money(1, Currency.RUB), description='Same fee'),
+    ]
+
+    res = prepare_fees_report(fees, offline_rates(tmp_path, 'currency,date,rate\nUSD,2024-01-01,89.6883\n'), False)
+
+    assert res['amount'].tolist() == [Decimal(-1)]
+    assert res['currency'].tolist() == [Currency.USD]
+    assert res['N'].tolist() == [1]
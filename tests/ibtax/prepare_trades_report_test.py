@@ -1,16 +1,18 @@
 import datetime
 from decimal import Decimal
 
+from investments.calculators import compute_total_cost
 from investments.currency import Currency
-from investments.data_providers.cbr import ExchangeRatesRUB
-from investments.ibtax.ibtax import prepare_trades_report
+from investments.data_providers.rates import RatesProvider
+from investments.ibtax.ibtax import prepare_trades_report, select_tax_years
 from investments.money import Money
 from investments.ticker import Ticker, TickerKind
 from investments.trades_fifo import FinishedTrade
+from tests.ibtax.samples import CBR_RATES_2020, offline_rates
 from tests.trades_fifo_test import get_trades_precision_testcase
 
 
-def test_simple_trades():
+def test_simple_trades(tmp_path):
     ticker = Ticker(symbol='VT', kind=TickerKind.Stock)
 
     trades = [
@@ -60,37 +62,38 @@ def test_simple_trades():
             fee_per_piece=Money('-0.101812674', Currency.USD),
         ),
     ]
-    cbr_client = ExchangeRatesRUB()
+    cbr_client = offline_rates(tmp_path, CBR_RATES_2020)
 
     res: dict = prepare_trades_report(trades, cbr_client).to_dict()
 
-    assert res['settle_rate'] == {0: Money(63.1385, Currency.RUB), 1: Money(63.9091, Currency.RUB), 2: Money(63.1385, Currency.RUB), 3: Money(63.9091, Currency.RUB), 4: Money(63.9490, Currency.RUB)}
-    assert res['fee_rate'] == {0: Money(62.3934, Currency.RUB), 1: Money(63.0359, Currency.RUB), 2: Money(62.3934, Currency.RUB), 3: Money(63.0359, Currency.RUB), 4: Money(63.4720, Currency.RUB)}
+    assert res['currency'] == {i: Currency.USD for i in range(5)}
+    assert res['settle_rate'] == {0: Decimal('63.1385'), 1: Decimal('63.9091'), 2: Decimal('63.1385'), 3: Decimal('63.9091'), 4: Decimal('63.9490')}
+    assert res['fee_rate'] == {0: Decimal('62.3934'), 1: Decimal('63.0359'), 2: Decimal('62.3934'), 3: Decimal('63.0359'), 4: Decimal('63.4720')}
     assert res['fee'] == {
-        0: Money('-0.863625', Currency.USD),
-        1: Money('-0.9167399999999999999999999997', Currency.USD),
-        2: Money('-0.123375', Currency.USD),
-        3: Money('-0.9', Currency.USD),
-        4: Money('-1.018126740', Currency.USD),
+        0: Decimal('-0.863625'),
+        1: Decimal('-0.9167399999999999999999999997'),
+        2: Decimal('-0.123375'),
+        3: Decimal('-0.9'),
+        4: Decimal('-1.018126740'),
     }
     assert res['total'] == {
-        0: Money('-565.203625', Currency.USD),
-        1: Money('571.82326', Currency.USD),
-        2: Money('-80.743375', Currency.USD),
-        3: Money('-726.48', Currency.USD),
-        4: Money('817.181873260', Currency.USD),
+        0: Decimal('-565.203625'),
+        1: Decimal('571.82326'),
+        2: Decimal('-80.743375'),
+        3: Decimal('-726.48'),
+        4: Decimal('817.181873260'),
     }
     assert res['total_rub'] == {
-        0: Money('-35685.465590075', Currency.RUB),
-        1: Money('36545.510403034', Currency.RUB),
-        2: Money('-5097.923655725', Currency.RUB),
-        3: Money('-46427.897088', Currency.RUB),
-        4: Money('52258.44925955872', Currency.RUB),
+        0: Decimal('-35685.465590075'),
+        1: Decimal('36545.510403034'),
+        2: Decimal('-5097.923655725'),
+        3: Decimal('-46427.897088'),
+        4: Decimal('52258.44925955872'),
     }
-    assert res['profit_rub'] == {0: Money(0, Currency.RUB), 1: Money('860.044812959', Currency.RUB), 2: Money(0, Currency.RUB), 3: Money(0, Currency.RUB), 4: Money('732.62851583372', Currency.RUB)}
+    assert res['profit_rub'] == {0: Decimal('0'), 1: Decimal('860.044812959'), 2: Decimal('0'), 3: Decimal('0'), 4: Decimal('732.62851583372')}
 
 
-def test_precision():
+def test_precision(tmp_path):
     """
     Отладка проблемы с потерей точности при расчётах финансового результата.
 
@@ -98,14 +101,69 @@ def test_precision():
 
     test_case = get_trades_precision_testcase()
 
-    res: dict = prepare_trades_report(test_case, ExchangeRatesRUB()).to_dict()
+    res: dict = prepare_trades_report(test_case, offline_rates(tmp_path, CBR_RATES_2020)).to_dict()
 
-    assert [x.amount for x in res['total_rub'].values()] == [
+    assert list(res['total_rub'].values()) == [
         Decimal('-51586.552320'),  # Расход: (80.62 * 10 * 63.9091) + (0.1 * 10 * 63.0359) = 51586.55232₽
         Decimal('52258.4492595587200'),  # Доход: (81.82 * 10 * 63.9490) - (0.101812674 * 10 * 63.4720) = 52258.4492595587200₽
     ]
 
-    assert [x.amount for x in res['profit_rub'].values()] == [
+    assert list(res['profit_rub'].values()) == [
         Decimal('0'),
         Decimal('671.8969395587200'),  # Финансовый результат: 52258.4492595587200 - 51586.552320 = 671.896939559₽
     ]
+
+
+class StaticRates(RatesProvider):
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        if currency is Currency.RUB:
+            return Money(1, Currency.RUB)
+        day = dt.date() if isinstance(dt, datetime.datetime) else dt
+        return Money(Decimal('60.1234') + Decimal(day.toordinal() % 97) / 7, Currency.RUB)
+
+
+def _synthetic_trades():
+    trades = []
+    for i in range(60):
+        currency = [Currency.USD, Currency.EUR, Currency.RUB][i % 3]
+        trades.append(
+            FinishedTrade(
+                N=i // 2 + 1,
+                ticker=Ticker(symbol=f'T{i % 5}', kind=TickerKind.Stock),
+                trade_date=datetime.datetime(2019 + i % 3, 1 + i % 12, 1 + i % 28, 10, 30),
+                settle_date=datetime.datetime(2019 + i % 3, 1 + i % 12, 1 + i % 28) + datetime.timedelta(days=2),
+                quantity=Decimal(i % 7 + 1) if i % 2 == 0 else -(i % 7 + 1),
+                price=Money(Decimal(1000 + i) / 3, currency),
+                fee_per_piece=Money(Decimal(-i) / 11, currency),
+            )
+        )
+    return trades
+
+
+def test_same_as_row_wise_calculation():
+    trades = _synthetic_trades()
+    rates = StaticRates()
+    res = prepare_trades_report(trades, rates)
+
+    for trade, (_, row) in zip(trades, res.iterrows(), strict=True):
+        price_rub = rates.convert_to_rub(trade.price, trade.settle_date)
+        fee_per_piece_rub = rates.convert_to_rub(trade.fee_per_piece, datetime.datetime.combine(trade.trade_date.date(), datetime.time()))
+        assert row['currency'] is trade.price.currency
+        assert str(row['price_rub']) == str(price_rub.amount)
+        assert str(row['fee_per_piece_rub']) == str(fee_per_piece_rub.amount)
+        assert str(row['fee']) == str((trade.fee_per_piece * abs(trade.quantity)).amount)
+        assert str(row['total']) == str(compute_total_cost(trade.quantity, trade.price, trade.fee_per_piece).amount)
+        assert str(row['total_rub']) == str(compute_total_cost(trade.quantity, price_rub, fee_per_piece_rub).amount)
+
+
+def test_select_tax_years():
+    trades = _synthetic_trades()
+    full = prepare_trades_report(trades, StaticRates())
+
+    selected = select_tax_years(trades, [2020])
+    assert len(selected) < len(trades)
+    assert select_tax_years(trades, []) is trades
+
+    res = prepare_trades_report(selected, StaticRates())
+    expected = full[full['tax_year'] == 2020].reset_index(drop=True)
+    assert res.astype(str).to_dict() == expected.astype(str).to_dict()
@@ -0,0 +1,89 @@
+import io
+import json
+import pickle
+import threading
+import time
+
+from benchmarks.prepare_trades_report import SyntheticRates, generate_trades
+from investments.data_providers.http import HttpClient
+from investments.data_providers.rates import LayerStats
+from investments.ibtax.ibtax import prepare_trades_report
+from investments.ibtax.profiler import Profiler
+
+
+def test_profiler_stages():
+    profiler = Profiler()
+    with profiler.stage('parse'):
+        profiler.add_rows('parse', 10)
+    with profiler.stage('present'):
+        pass
+    profiler.add_rows('present', 3)
+    profiler.collect([LayerStats('memory', 5, 2)], HttpClient())
+
+    assert [(x.name, x.rows) for x in profiler.stages] == [('parse', 10), ('present', 3)]
+    assert all(x.wall >= 0 and x.cpu >= 0 for x in profiler.stages)
+
+    summary = io.StringIO()
+    profiler.write_summary(summary)
+    assert 'rates cache hits/misses: memory 5/2' in summary.getvalue()
+    assert 'http: 0 requests, 0 retries, 0 bytes' in summary.getvalue()
+
+    data = json.loads(json.dumps(profiler.to_dict()))
+    assert data['stages'][0]['name'] == 'parse'
+    assert data['rates'] == [{'name': 'memory', 'hits': 5, 'misses': 2}]
+
+
+def test_profiler_concurrent_stages():
+    profiler = Profiler()
+    barrier = threading.Barrier(4)
+
+    def stage():
+        with profiler.stage('prepare'):
+            barrier.wait()
+            for _ in range(1000):
+                profiler.add_rows('prepare', 1)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=stage) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.collect([], HttpClient())
+
+    assert [(x.name, x.rows) for x in profiler.stages] == [('prepare', 4000)] * 4
+    assert pickle.loads(pickle.dumps(profiler)).stages == profiler.stages
+    # этапы шли одновременно: итог - время работы, а не сумма этапов
+    wall, _ = profiler.elapsed
+    assert wall < sum(x.wall for x in profiler.stages)
+    assert profiler.to_dict()['total']['wall'] == wall
+
+
+def test_disabled_profiler():
+    profiler = Profiler(enabled=False)
+    with profiler.stage('parse'):
+        profiler.add_rows('parse', 10)
+    profiler.collect([LayerStats('memory', 5, 2)], HttpClient())
+
+    assert profiler.stages == []
+    assert profiler.to_dict()['rates'] == []
+
+
+def test_memory_profile():
+    trades = generate_trades(2000)
+    profiler = Profiler(memory=True)
+    try:
+        with profiler.stage('prepare trades'):
+            report = prepare_trades_report(trades, SyntheticRates())
+    finally:
+        profiler.stop()
+
+    stats = profiler.memory[0]
+    assert stats.name == 'prepare trades'
+    assert stats.objects['FinishedTrade'] >= len(trades)
+    assert stats.objects['DataFrame'] >= 1
+    assert stats.dataframes_size >= report.memory_usage(deep=True).sum()
+    assert stats.top and all(x.site for x in stats.top)
+    # отчёт по сделкам: не больше 4 КБ на строку в пике
+    assert stats.peak < 4 * 1024 * len(trades)
+    assert json.loads(json.dumps(profiler.to_dict()))['memory'][0]['top'][0]['site'] == stats.top[0].site
@@ -0,0 +1,135 @@
+import datetime
+import io
+from decimal import Decimal
+
+import pandas  # type: ignore
+
+from investments.currency import Currency
+from investments.data_providers.rates import RatesProvider
+from investments.ibtax import html_report
+from investments.ibtax.ibtax import prepare_trades_report
+from investments.ibtax.report_presenter import NativeReportPresenter, split_by_year, trades_summary
+from investments.money import Money
+from investments.ticker import Ticker, TickerKind
+from investments.trades_fifo import FinishedTrade
+
+
+class FixedRates(RatesProvider):
+    def get_rate(self, currency: Currency, dt: datetime.date) -> Money:
+        return Money(1 if currency is Currency.RUB else 70, Currency.RUB)
+
+
+def _trade(n: int, kind: TickerKind, year: int, quantity: int, price: int) -> FinishedTrade:
+    dt = datetime.datetime(year, 3, 2)
+    return FinishedTrade(N=n, ticker=Ticker('X', kind), trade_date=dt, settle_date=dt.date(), quantity=quantity, price=Money(price, Currency.USD), fee_per_piece=Money(-1, Currency.USD))
+
+
+def test_trades_summary():
+    trades = [
+        _trade(1, TickerKind.Option, 2020, 1, 10),
+        _trade(1, TickerKind.Option, 2020, -1, 12),
+        _trade(2, TickerKind.Stock, 2020, -2, 50),
+        _trade(2, TickerKind.Stock, 2020, 2, 40),
+        _trade(3, TickerKind.Stock, 2021, 1, 100),
+        _trade(3, TickerKind.Stock, 2021, -1, 90),
+    ]
+
+    summary = trades_summary(prepare_trades_report(trades, FixedRates()))
+
+    assert list(summary.columns) == ['expenses', 'income', 'profit']
+    assert summary.index.tolist() == [(2020, TickerKind.Stock), (2020, TickerKind.Option), (2021, TickerKind.Stock)]
+    assert summary.loc[2020].to_dict('index') == {
+        TickerKind.Stock: {'expenses': Decimal(-5740), 'income': Decimal(6860), 'profit': Decimal(1120)},
+        TickerKind.Option: {'expenses': Decimal(-770), 'income': Decimal(770), 'profit': Decimal(0)},
+    }
+    assert summary.loc[2021, 'profit'].tolist() == [Decimal(-840)]
+    assert not pandas.isna(summary).any().any()
+
+
+def test_split_by_year_does_not_touch_report():
+    trades = [
+        _trade(1, TickerKind.Stock, 2020, 1, 10),
+        _trade(1, TickerKind.Stock, 2020, -1, 12),
+        _trade(2, TickerKind.Stock, 2021, 2, 50),
+        _trade(2, TickerKind.Stock, 2021, -2, 40),
+    ]
+    report = prepare_trades_report(trades, FixedRates())
+    snapshot = report.copy(deep=True)
+
+    by_year = split_by_year(report)
+
+    assert list(by_year) == [2020, 2021]
+    assert by_year[2021]['N'].tolist() == [2, 2]
+    assert 'tax_year' not in by_year[2021]
+
+    output = io.StringIO()
+    presenter = NativeReportPresenter(output=output)
+    presenter.prepare_report(report, None, None, None, [], [])
+    assert report.equals(snapshot)
+
+    # разделы выводятся по мере подготовки, present только завершает вывод
+    assert '>>> TRADES RESULTS BEFORE TAXES <<<' in output.getvalue()
+    presenter.present()
+    assert output.getvalue().endswith('\n')
+
+
+def _two_years_report() -> pandas.DataFrame:
+    trades = [
+        _trade(1, TickerKind.Stock, 2020, 1, 10),
+        _trade(1, TickerKind.Stock, 2020, -1, 12),
+        _trade(2, TickerKind.Stock, 2020, 1, 10),
+        _trade(2, TickerKind.Stock, 2020, -1, 11),
+        _trade(3, TickerKind.Stock, 2021, 2, 50),
+        _trade(3, TickerKind.Stock, 2021, -2, 40),
+    ]
+    return prepare_trades_report(trades, FixedRates())
+
+
+def test_html_report_streams_sections(tmp_path):
+    output = io.StringIO()
+    presenter = NativeReportPresenter(dst_filepath=str(tmp_path / 'report.html'), output=output)
+    presenter.prepare_report(_two_years_report(), None, None, None, [], [])
+
+    # разделы года попадают в поток, когда начинается следующий год
+    assert output.getvalue().startswith('<!DOCTYPE html>')
+    assert '<h1 class="year">2020</h1>' in output.getvalue()
+    assert '<h1 class="year">2021</h1>' not in output.getvalue()
+
+    presenter.present()
+    html = output.getvalue()
+    assert '<h1 class="year">2021</h1>' in html
+    assert html.count('<table>') == 4
+    assert html.endswith('</body>\n</html>\n')
+
+
+class FakeDocument:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def copy(self, pages):
+        return FakeDocument(list(pages))
+
+    def write_pdf(self, target):
+        with open(target, 'w') as f:
+            f.write('\n'.join(self.pages))
+
+
+def fake_pdf_document(section):
+    return FakeDocument([html_report.render_document(section)])
+
+
+def test_pdf_report_laid_out_by_years_and_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr('investments.ibtax.html_report.render_pdf_document', fake_pdf_document)
+    dst = tmp_path / 'report.pdf'
+
+    presenter = NativeReportPresenter(dst_filepath=str(dst), pdf_chunk_rows=3)
+    presenter.prepare_report(_two_years_report(), None, None, None, [], [])
+    presenter.present()
+
+    documents = dst.read_text().split('<!DOCTYPE html>')[1:]
+    # 2020: 4 сделки - два куска по 3 строки, 2021: один документ
+    assert len(documents) == 3
+    assert '<h1 class="year">2020</h1>' in documents[0]
+    assert documents[0].count('<tr><td') == 3
+    assert documents[1].count('<tr><td') == 2  # последняя сделка и итоги года
+    assert '<h1 class="year">2021</h1>' in documents[2]
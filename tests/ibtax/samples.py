@@ -0,0 +1,30 @@
+"""Отчёты Interactive Brokers и курсы для тестов ibtax: покупка VT в 2020 и частичная продажа в 2021."""
+
+from investments.data_providers.cbr import ExchangeRatesRUB
+
+ACTIVITY = """Account Information,Header,Field Name,Field Value
+Account Information,Data,Base Currency,USD
+Financial Instrument Information,Header,Asset Category,Symbol,Description,Conid,Security ID,Multiplier,Type,Code
+Financial Instrument Information,Data,Stocks,VT,VT CORP,1000,,1,,
+Trades,Header,DataDiscriminator,Asset Category,Currency,Symbol,Date/Time,Quantity,T. Price,C. Price,Proceeds,Comm/Fee,Basis,Realized P/L,MTM P/L,Code
+Trades,Data,Order,Stocks,USD,VT,"2020-03-02, 10:14:29",10,80.5,80.5,0,-1,0,0,0,O
+Trades,Data,Order,Stocks,USD,VT,"2021-03-02, 11:24:54",-4,90.25,90.25,0,-1,0,0,0,O
+"""
+
+CONFIRMATION = """Symbol,Date/Time,SettleDate,OrderID,LevelOfDetail,TransactionType
+VT,"2020-03-02, 10:14:29",2020-03-04,1,EXECUTION,ExchTrade
+VT,"2021-03-02, 11:24:54",2021-03-04,2,EXECUTION,ExchTrade
+"""
+
+# курсы ЦБ на даты сделок из тестов prepare_*_report
+CBR_RATES_2020 = 'currency,date,rate\nUSD,2020-01-30,62.3934\nUSD,2020-01-31,63.0359\nUSD,2020-02-03,63.1385\nUSD,2020-02-04,63.9091\nUSD,2020-02-10,63.4720\nUSD,2020-02-12,63.9490\n'
+
+RATES = 'currency,date,rate\nUSD,2020-03-02,66.9909\nUSD,2020-03-04,66.3274\nUSD,2021-03-02,74.0988\nUSD,2021-03-04,73.6542\n'
+
+
+def offline_rates(tmp_path, rates: str = RATES) -> ExchangeRatesRUB:
+    """Курсы только из импортированного csv, без запросов к cbr.ru."""
+    (tmp_path / 'rates.csv').write_text(rates)
+    cache_dir = str(tmp_path / 'cache')
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True).import_rates(str(tmp_path / 'rates.csv'))
+    return ExchangeRatesRUB(cache_dir=cache_dir, offline=True)
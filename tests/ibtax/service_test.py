@@ -0,0 +1,109 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest  # type: ignore
+
+from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.ibtax import service
+from investments.ibtax.service import ReportServer, ReportService
+from tests.ibtax.samples import ACTIVITY, CONFIRMATION, RATES
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / 'rates.csv').write_text(RATES)
+    ExchangeRatesRUB(cache_dir=str(tmp_path / 'cache'), offline=True).import_rates(str(tmp_path / 'rates.csv'))
+
+    server = ReportServer(ReportService(str(tmp_path / 'cache'), offline=True), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def _post(url: str, request: dict) -> bytes:
+    with urllib.request.urlopen(urllib.request.Request(f'{url}/report', data=json.dumps(request).encode())) as response:
+        return response.read()
+
+
+def _stats(url: str) -> dict:
+    with urllib.request.urlopen(f'{url}/stats') as response:
+        return json.loads(response.read())
+
+
+def test_report_from_dirs_reuses_parsed_files(server, tmp_path):
+    (tmp_path / 'activity').mkdir()
+    (tmp_path / 'confirmation').mkdir()
+    (tmp_path / 'activity' / '2020.csv').write_text(ACTIVITY)
+    (tmp_path / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+    request = {'activity_reports_dir': str(tmp_path / 'activity'), 'confirmation_reports_dir': str(tmp_path / 'confirmation')}
+
+    text = _post(server, request).decode()
+    assert 'VT' in text and '2021' in text
+
+    assert _post(server, request).decode() == text
+    stats = _stats(server)
+    assert stats['accounts'] == {'cached': 1, 'hits': 1, 'misses': 1}
+    assert stats['files'] == {'cached': 2, 'hits': 2, 'misses': 2}
+
+    # новый файл: читается только он, разбор и FIFO - заново
+    (tmp_path / 'activity' / '2021.csv').write_text(ACTIVITY.split('Trades,Header')[0])
+    _post(server, request)
+    stats = _stats(server)
+    assert stats['files'] == {'cached': 3, 'hits': 4, 'misses': 3}
+    assert stats['accounts'] == {'cached': 2, 'hits': 1, 'misses': 2}
+
+
+def test_report_from_uploaded_csvs(server):
+    request = {'activity_reports': {'2020.csv': ACTIVITY}, 'confirmation_reports': {'all.csv': CONFIRMATION}, 'years': [2020], 'format': 'jsonl'}
+    lines = [json.loads(x) for x in _post(server, request).decode().splitlines()]
+    assert [x['report'] for x in lines] == ['portfolio']
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        _post(server, {'activity_reports': {'2020.csv': ACTIVITY}, 'format': 'docx'})
+    assert error.value.code == 400
+
+
+def test_slow_report_does_not_block_other_requests(server, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    present_reports = service.present_reports
+
+    def slow_present_reports(operations, rates, presenter, years, *args):
+        if years == [2020]:
+            started.set()
+            assert release.wait(10)
+        present_reports(operations, rates, presenter, years, *args)
+
+    monkeypatch.setattr(service, 'present_reports', slow_present_reports)
+    request = {'activity_reports': {'2020.csv': ACTIVITY}, 'confirmation_reports': {'all.csv': CONFIRMATION}}
+    slow = threading.Thread(target=_post, args=(server, {**request, 'years': [2020]}))
+    slow.start()
+    try:
+        assert started.wait(10)
+        assert _stats(server)['requests'] == 1
+        assert 'VT' in _post(server, request).decode()
+    finally:
+        release.set()
+        slow.join()
+
+
+def test_reports_root(tmp_path):
+    (tmp_path / 'root' / 'activity').mkdir(parents=True)
+    (tmp_path / 'root' / 'confirmation').mkdir()
+    (tmp_path / 'root' / 'activity' / '2020.csv').write_text(ACTIVITY)
+    (tmp_path / 'root' / 'confirmation' / 'all.csv').write_text(CONFIRMATION)
+    (tmp_path / 'rates.csv').write_text(RATES)
+    ExchangeRatesRUB(cache_dir=str(tmp_path / 'cache'), offline=True).import_rates(str(tmp_path / 'rates.csv'))
+    report_service = ReportService(str(tmp_path / 'cache'), offline=True, reports_root=str(tmp_path / 'root'))
+
+    body, _ = report_service.report({'activity_reports_dir': 'activity', 'confirmation_reports_dir': str(tmp_path / 'root' / 'confirmation')})
+    assert b'VT' in body
+    for directory in ('../root/../', str(tmp_path), '/'):
+        with pytest.raises(PermissionError):
+            report_service.report({'activity_reports_dir': directory, 'confirmation_reports_dir': 'confirmation'})
+
+    assert service.is_loopback('127.0.0.1') and service.is_loopback('::1') and service.is_loopback('localhost')
+    assert not service.is_loopback('0.0.0.0') and not service.is_loopback('example.com')
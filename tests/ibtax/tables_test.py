@@ -0,0 +1,82 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import numpy
+import pandas  # type: ignore
+import pytest  # type: ignore
+from tabulate import tabulate
+
+from investments.currency import Currency
+from investments.ibtax.tables import render_table
+from investments.money import Money
+from investments.ticker import TickerKind
+
+
+def _tabulate(data, **kwargs) -> str:
+    return tabulate(data, showindex=False, numalign='decimal', stralign='right', **kwargs)
+
+
+def _render(data, **kwargs) -> str:
+    output = io.StringIO()
+    render_table(output, data, **kwargs)
+    return output.getvalue()
+
+
+def _frame() -> pandas.DataFrame:
+    return pandas.DataFrame(
+        {
+            'N': [1, 2, 10, 11],
+            'ticker': ['AAPL', 'VT', 'Ростелеком', '中国移动'],
+            'kind': [TickerKind.Stock, TickerKind.Option, TickerKind.Stock, TickerKind.Bond],
+            'quantity': [Decimal('1'), Decimal('-20.5'), Decimal('0.333333333'), Decimal('1E+3')],
+            'ratio': [0.5, 12.0, float('nan'), 1e-07],
+            'price': [Money('1.5', Currency.USD), Money('-20.1234', Currency.EUR), Money(3, Currency.RUB), Money('0.01', Currency.USD)],
+            'profit_rub': [Money(0, Currency.RUB), Money('-1.99', Currency.RUB), float('nan'), Money('12345.6789', Currency.RUB)],
+            'comment': ['', None, 'text', 'x'],
+            'date': ['01.02.2020', '31.12.2020', '05.05.2021', '06.06.2021'],
+            'description': ['<b>fee</b> & "tax"', 'plain', ' padded ', 'x'],
+        }
+    )
+
+
+@pytest.fixture
+def no_tabulate(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected tabulate fallback')
+
+    monkeypatch.setattr('tabulate.tabulate', fail)
+
+
+@pytest.mark.parametrize('tablefmt', ['presto', 'html'])
+def test_render_dataframe_as_tabulate(tablefmt):
+    assert _render(_frame(), tablefmt=tablefmt) == _tabulate(_frame(), headers='keys', tablefmt=tablefmt)
+
+
+@pytest.mark.parametrize('tablefmt', ['presto', 'html'])
+def test_render_dataframe_without_tabulate(tablefmt, no_tabulate):
+    assert _render(_frame(), tablefmt=tablefmt)
+
+
+@pytest.mark.parametrize('tablefmt', ['presto', 'html'])
+@pytest.mark.parametrize('colalign', [None, ('left',), ('center', 'global', None, 'decimal')])
+def test_render_rows_as_tabulate(tablefmt, colalign, no_tabulate):
+    rows = [
+        ['AAPL', Decimal('10'), numpy.int64(3), date(2020, 1, 2)],
+        ['TSLA', Decimal('-2.125'), numpy.int64(-15), date(2021, 12, 31)],
+        ['T', 7, 0, None],
+        ['ORCL', Decimal('1E-8')],
+    ]
+    expected = _tabulate(rows, headers=['Ticker', 'Quantity'], colalign=colalign, tablefmt=tablefmt)
+    assert _render(rows, headers=['Ticker', 'Quantity'], tablefmt=tablefmt, colalign=colalign) == expected
+
+
+@pytest.mark.parametrize('tablefmt', ['presto', 'html'])
+def test_render_falls_back_to_tabulate(tablefmt):
+    multiline = pandas.DataFrame({'description': ['first\nsecond', 'third'], 'amount': [1, 2]})
+    empty = pandas.DataFrame({'description': [], 'amount': []})
+    numeric_text = pandas.DataFrame({'numeric text': ['12', '1,234.5', '', None], 'amount': [1, 2, 3, 4]})
+    flags = pandas.DataFrame({'flag': [True, False, None, True], 'amount': [1, 2, 3, 4]})
+
+    for data in (multiline, empty, numeric_text, flags):
+        assert _render(data, tablefmt=tablefmt) == _tabulate(data, headers='keys', tablefmt=tablefmt)
@@ -0,0 +1,46 @@
+import datetime
+
+from investments.data_providers.cbr import ExchangeRatesRUB
+from investments.ibtax.ibtax import analyze_reports, present_reports
+from investments.ibtax.profiler import Profiler
+from investments.ibtax.report_presenter import NativeReportPresenter
+from investments.ibtax.watch import ReportWatcher, changed_years
+from tests.ibtax.samples import ACTIVITY, CONFIRMATION, RATES
+
+
+def test_changed_years():
+    dates = [datetime.date(2019, 1, 1), datetime.date(2020, 5, 1), datetime.date(2020, 7, 1), datetime.date(2021, 2, 1)]
+    assert changed_years(dates, dates, lambda x: x) == set()
+    assert changed_years(dates, [*dates, datetime.date(2022, 1, 1)], lambda x: x) == {2022}
+    # нумерация сквозная: после изменения в 2020 меняются и следующие годы
+    assert changed_years(dates, [dates[0], datetime.date(2020, 6, 1), *dates[2:]], lambda x: x) == {2020, 2021}
+
+
+def test_watch_updates_changed_years(tmp_path):
+    (tmp_path / 'rates.csv').write_text(RATES)
+    cache_dir = str(tmp_path / 'cache')
+    ExchangeRatesRUB(cache_dir=cache_dir, offline=True).import_rates(str(tmp_path / 'rates.csv'))
+
+    activity, confirmation = tmp_path / 'activity', tmp_path / 'confirmation'
+    activity.mkdir()
+    confirmation.mkdir()
+    (confirmation / 'all.csv').write_text(CONFIRMATION)
+    # отчёт за 2020 - только покупка, продажа 2021 появится позже
+    sell = ACTIVITY.splitlines(keepends=True)[-1]
+    (activity / '2020.csv').write_text(ACTIVITY.replace(sell, ''))
+
+    watcher = ReportWatcher(str(activity), str(confirmation), cache_dir, offline=True, dst_filepath=str(tmp_path / 'watch.txt'))
+    watcher.run(0, iterations=1)
+    assert 'VT' in (tmp_path / 'watch.txt').read_text()
+
+    (activity / '2020.csv').write_text(ACTIVITY)
+    assert watcher.scan() == [str(activity / '2020.csv')]
+    assert watcher.update() == [2021]
+    watcher.present()
+    assert watcher.scan() == []
+    assert watcher.update() == []
+
+    operations = analyze_reports(str(activity), str(confirmation), [], Profiler(enabled=False))
+    presenter = NativeReportPresenter(dst_filepath=str(tmp_path / 'full.txt'))
+    present_reports(operations, ExchangeRatesRUB(cache_dir=cache_dir, offline=True), presenter, [], False, Profiler(enabled=False))
+    assert (tmp_path / 'watch.txt').read_text() == (tmp_path / 'full.txt').read_text()
@@ -0,0 +1,33 @@
+import datetime
+
+from investments.currency import Currency
+from investments.fees import Fee
+from investments.money import Money
+from investments.reversals import cancel_fee_reversals
+
+
+def _fee(day: int, amount: int, currency: Currency = Currency.USD, description: str = 'Other Fees') -> Fee:
+    return Fee(date=datetime.date(2024, 1, day), amount=Money(amount, currency), description=description)
+
+
+def test_cancel_fee_reversals():
+    fees = [
+        _fee(1, -3),
+        _fee(1, -3),
+        _fee(1, -3, Currency.EUR),
+        _fee(1, 3),
+        _fee(2, 3),
+        _fee(1, -3, description='Market Data'),
+        _fee(1, 0),
+        _fee(3, 5),
+        _fee(3, -5),
+        _fee(3, -5),
+        _fee(3, 5),
+    ]
+
+    assert cancel_fee_reversals(fees) == [_fee(1, -3), _fee(1, -3, Currency.EUR), _fee(2, 3), _fee(1, -3, description='Market Data'), _fee(1, 0)]
+
+
+def test_reversal_before_fee():
+    assert cancel_fee_reversals([_fee(1, 3), _fee(1, -3), _fee(1, -3)]) == [_fee(1, -3)]
+    assert cancel_fee_reversals([_fee(1, -3), _fee(1, 3), _fee(1, 3)]) == [_fee(1, 3)]
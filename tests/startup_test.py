@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+import investments
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(investments.__file__)))
+
+
+def _loaded_modules(code: str, modules) -> list:
+    script = f'import sys\n{code}\nprint(" ".join(x for x in {list(modules)!r} if x in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_ibtax_startup_without_report_dependencies():
+    assert _loaded_modules('import investments.ibtax.ibtax', ['pandas', 'weasyprint', 'jinja2', 'requests', 'tabulate']) == []
+
+
+def test_ibdds_startup_without_heavy_dependencies():
+    assert _loaded_modules('import investments.ibdds.ibdds', ['pandas', 'requests', 'tabulate']) == []
+
+
+def test_cached_rates_without_requests(tmp_path):
+    bundle = tmp_path / 'rates.csv'
+    bundle.write_text('currency,date,rate\nUSD,2020-03-31,77.7325\n')
+    code = f"""
+import datetime
+from investments.currency import Currency
+from investments.data_providers.cbr import ExchangeRatesRUB
+ExchangeRatesRUB(cache_dir={str(tmp_path)!r}).import_rates({str(bundle)!r})
+assert str(ExchangeRatesRUB(cache_dir={str(tmp_path)!r}).get_rate(Currency.USD, datetime.date(2020, 3, 31)).amount) == '77.7325'
+"""
+    assert _loaded_modules(code, ['requests']) == []
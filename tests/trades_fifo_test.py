@@ -8,7 +8,7 @@ from investments.currency import Currency
 from investments.money import Money
 from investments.ticker import Ticker, TickerKind
 from investments.trade import Trade
-from investments.trades_fifo import TradesAnalyzer, FinishedTrade
+from investments.trades_fifo import IncrementalTradesAnalyzer, TradesAnalyzer, FinishedTrade
 
 analyze_trades_fifo_testdata = [
     # trades: [(Date, Symbol, Quantity, Price)]
@@ -128,3 +128,24 @@ def test_trades_precision():
     sell_trade: FinishedTrade = finished_trades[1]
     assert sell_trade.price.amount == Decimal('81.82')
     assert sell_trade.fee_per_piece.amount == Decimal('-0.101812674')
+
+
+def test_incremental_trades_analyzer():
+    def trade(day: int, symbol: str, qty: int, price: int) -> Trade:
+        dt = datetime.datetime(2020, 1, 1) + datetime.timedelta(days=day)
+        return Trade(ticker=Ticker(symbol, TickerKind.Stock), trade_date=dt, settle_date=dt.date(), quantity=Decimal(qty), price=Money(price, Currency.USD), fee=Money(-1, Currency.USD))
+
+    trades = [trade(i, 'AB'[i % 2], [5, 3, -4, 2, -6, 7, -5, -3, 4, -1][i % 10], 10 + i) for i in range(40)]
+    analyzer = IncrementalTradesAnalyzer(checkpoint_every=3)
+
+    # сделки дописываются в конец, затем меняется сделка в середине и удаляются последние
+    changed = [*trades[:17], trade(17, 'A', -9, 50), *trades[18:]]
+    for i, version in enumerate([trades[:10], trades[:25], trades, trades, changed, changed[:30]]):
+        kept = analyzer.update(version)
+        expected = TradesAnalyzer(version)
+        assert analyzer.finished_trades == expected.finished_trades, f'version {i}'
+        assert analyzer.final_portfolio == expected.final_portfolio, f'version {i}'
+        if i == 3:
+            assert kept == len(expected.finished_trades)
+        if i == 4:
+            assert 0 < kept < len(expected.finished_trades)